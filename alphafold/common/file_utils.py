@@ -0,0 +1,50 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utilities for writing files that are read concurrently."""
+
+import contextlib
+import os
+from typing import IO, Iterator
+import uuid
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w') -> Iterator[IO]:
+  """Opens a temporary file next to path and moves it into place when done.
+
+  Readers of path see either the previous file or the complete new one. Unlike
+  the files of the tempfile module, which only their owner can read, the file
+  gets the mode of a regular new file, i.e. 0o666 masked by the umask. If the
+  block raises, the temporary file is removed and path is left unchanged.
+
+  Args:
+    path: The path of the file.
+    mode: The mode the file is opened in, 'w' or 'wb'.
+
+  Yields:
+    The open temporary file.
+  """
+  tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+  fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+  try:
+    with os.fdopen(fd, mode) as f:
+      yield f
+    os.replace(tmp_path, path)
+  except BaseException:
+    try:
+      os.remove(tmp_path)
+    except FileNotFoundError:
+      pass
+    raise
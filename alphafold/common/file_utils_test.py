@@ -0,0 +1,69 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for file_utils."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from alphafold.common import file_utils
+
+
+class AtomicWriteTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = tempfile.mkdtemp(dir=absltest.get_default_test_tmpdir())
+    self.path = os.path.join(self.tmp_dir, 'file.txt')
+
+  def test_replaces_file(self):
+    with open(self.path, 'w') as f:
+      f.write('old')
+
+    with file_utils.atomic_write(self.path) as f:
+      f.write('new')
+      # Not visible until the file is complete.
+      with open(self.path) as g:
+        self.assertEqual(g.read(), 'old')
+
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'new')
+    self.assertEqual(os.listdir(self.tmp_dir), ['file.txt'])
+
+  def test_file_has_mode_of_new_files(self):
+    umask = os.umask(0o027)
+    try:
+      with file_utils.atomic_write(self.path, 'wb') as f:
+        f.write(b'data')
+    finally:
+      os.umask(umask)
+    self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+  def test_failed_write_leaves_file_unchanged(self):
+    with open(self.path, 'w') as f:
+      f.write('old')
+
+    with self.assertRaises(ValueError):
+      with file_utils.atomic_write(self.path) as f:
+        f.write('partial')
+        raise ValueError('Write failed.')
+
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'old')
+    self.assertEqual(os.listdir(self.tmp_dir), ['file.txt'])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,257 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A spool directory of inference jobs, shared by submitters and workers.
+
+A job names a target whose features are in <output_dir>/<target_name>. Jobs
+move between the subdirectories of the spool directory by renaming their job
+files, which is atomic, so that any number of submitters and workers can share
+a spool directory on the same file system:
+  pending/: Submitted jobs, claimed oldest first.
+  running/: Jobs claimed by a worker, with the host and process ID of the
+    worker. Jobs whose worker is gone are re-queued with requeue_stale_jobs.
+  done/: Finished jobs, with the timings of the job.
+  failed/: Failed jobs, with the error. Job files that cannot be read are
+    moved here as well.
+  status.json: The queue depth and job counts, written by the workers.
+  closed: Exists once no more jobs will be submitted, so that the workers
+    exit when the spool is empty.
+"""
+
+import dataclasses
+import json
+import os
+import socket
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from alphafold.common import file_utils
+
+_PENDING = 'pending'
+_RUNNING = 'running'
+_DONE = 'done'
+_FAILED = 'failed'
+_STATUS_FILE = 'status.json'
+_CLOSED_FILE = 'closed'
+
+
+@dataclasses.dataclass(frozen=True)
+class Job:
+  """An inference job.
+
+  Contains:
+    name: The name of the job file, unique within the spool.
+    target_name: The name of the target, i.e. of its directory.
+    output_dir: The directory that contains the target directory.
+    submit_time: When the job was submitted, in seconds since the epoch.
+  """
+  name: str
+  target_name: str
+  output_dir: str
+  submit_time: float
+
+
+def _write_json(path: str, data: Mapping[str, Any]):
+  """Writes a JSON file atomically."""
+  with file_utils.atomic_write(path) as f:
+    json.dump(data, f, indent=4)
+
+
+def _read_job(path: str) -> Job:
+  """Reads a job file, ignoring the details added by the spool."""
+  with open(path) as f:
+    record = json.load(f)
+  return Job(**{field.name: record[field.name]
+                for field in dataclasses.fields(Job)})
+
+
+def _process_exists(pid: int) -> bool:
+  """Whether a process with this ID runs on this host."""
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    # The process runs as another user.
+    return True
+  return True
+
+
+class JobSpool:
+  """Submits, claims and completes the jobs of a spool directory."""
+
+  def __init__(self, spool_dir: str):
+    self.spool_dir = spool_dir
+    for state in (_PENDING, _RUNNING, _DONE, _FAILED):
+      os.makedirs(os.path.join(spool_dir, state), exist_ok=True)
+
+  def _path(self, state: str, job_name: str) -> str:
+    return os.path.join(self.spool_dir, state, job_name)
+
+  def _job_names(self, state: str) -> List[str]:
+    return sorted(name for name in os.listdir(
+        os.path.join(self.spool_dir, state)) if name.endswith('.json'))
+
+  def submit(self, target_name: str, output_dir: str) -> Job:
+    """Submits a job for a target whose features are in output_dir."""
+    submit_time = time.time()
+    # Job names sort by submission time.
+    job_name = f'{time.time_ns():020d}-{os.getpid()}-{target_name}.json'
+    job = Job(name=job_name, target_name=target_name,
+              output_dir=os.path.abspath(output_dir), submit_time=submit_time)
+    _write_json(self._path(_PENDING, job_name), dataclasses.asdict(job))
+    return job
+
+  def claim(self) -> Optional[Job]:
+    """Claims the oldest pending job, returns None if there is none.
+
+    The claimed job file records the host and process ID of the worker. Job
+    files that cannot be read are moved to failed/ and skipped.
+
+    Returns:
+      The claimed job, or None if no job is pending.
+    """
+    for job_name in self._job_names(_PENDING):
+      running_path = self._path(_RUNNING, job_name)
+      try:
+        os.rename(self._path(_PENDING, job_name), running_path)
+      except FileNotFoundError:
+        # Claimed by another worker.
+        continue
+      try:
+        job = _read_job(running_path)
+        _write_json(running_path, {
+            **dataclasses.asdict(job),
+            'worker_host': socket.gethostname(),
+            'worker_pid': os.getpid(),
+            'claim_time': time.time(),
+        })
+      except (OSError, ValueError, TypeError, KeyError) as e:
+        _write_json(self._path(_FAILED, job_name), {
+            'name': job_name,
+            'error': f'Could not read the job file: {e!r}',
+            'end_time': time.time(),
+            'host': socket.gethostname(),
+        })
+        os.remove(running_path)
+        continue
+      return job
+    return None
+
+  def requeue_stale_jobs(self, claim_timeout: Optional[float] = None
+                         ) -> List[str]:
+    """Moves claimed jobs whose worker is gone back to pending/.
+
+    A job is stale if its worker ran on this host and has exited, or, if
+    claim_timeout is set, if it was claimed more than claim_timeout seconds
+    ago. The timeout is the only way to tell that a worker on another host is
+    gone, so it must be longer than any job takes.
+
+    Args:
+      claim_timeout: If set, how many seconds a job may stay claimed.
+
+    Returns:
+      The names of the re-queued jobs.
+    """
+    host = socket.gethostname()
+    requeued = []
+    for job_name in self._job_names(_RUNNING):
+      try:
+        with open(self._path(_RUNNING, job_name)) as f:
+          record = json.load(f)
+      except (OSError, ValueError):
+        # Completed meanwhile, or its claim is being written.
+        continue
+      if 'worker_pid' not in record:
+        continue
+      if record['worker_host'] == host:
+        stale = not _process_exists(record['worker_pid'])
+      else:
+        stale = False
+      if claim_timeout is not None:
+        stale = stale or time.time() - record['claim_time'] > claim_timeout
+      if not stale:
+        continue
+      try:
+        os.rename(self._path(_RUNNING, job_name),
+                  self._path(_PENDING, job_name))
+      except FileNotFoundError:
+        # Completed or re-queued meanwhile.
+        continue
+      requeued.append(job_name)
+    return requeued
+
+  def _complete(self, job: Job, state: str, **details):
+    record = dataclasses.asdict(job)
+    record.update(details, end_time=time.time(), host=socket.gethostname())
+    _write_json(self._path(state, job.name), record)
+    try:
+      os.remove(self._path(_RUNNING, job.name))
+    except FileNotFoundError:
+      # Re-queued by requeue_stale_jobs meanwhile.
+      pass
+
+  def finish(self, job: Job, timings: Mapping[str, Any]):
+    """Moves a claimed job to done/, with its timings."""
+    self._complete(job, _DONE, timings=dict(timings))
+
+  def fail(self, job: Job, error: str):
+    """Moves a claimed job to failed/, with its error."""
+    self._complete(job, _FAILED, error=error)
+
+  def job_state(self, job: Job) -> Optional[str]:
+    """Returns pending, running, done or failed, None if the job is gone."""
+    for state in (_DONE, _FAILED, _RUNNING, _PENDING):
+      if os.path.exists(self._path(state, job.name)):
+        return state
+    return None
+
+  def close(self):
+    """Marks that no more jobs will be submitted."""
+    with open(os.path.join(self.spool_dir, _CLOSED_FILE), 'w'):
+      pass
+
+  def reopen(self):
+    """Marks that jobs will be submitted again, after close."""
+    closed_path = os.path.join(self.spool_dir, _CLOSED_FILE)
+    if os.path.exists(closed_path):
+      os.remove(closed_path)
+
+  def is_closed(self) -> bool:
+    """Whether no more jobs will be submitted."""
+    return os.path.exists(os.path.join(self.spool_dir, _CLOSED_FILE))
+
+  def queue_depth(self) -> int:
+    """Returns the number of pending jobs."""
+    return len(self._job_names(_PENDING))
+
+  def write_status(self, **details):
+    """Writes status.json with the job counts and the given details."""
+    status = {
+        'queue_depth': self.queue_depth(),
+        'running': len(self._job_names(_RUNNING)),
+        'done': len(self._job_names(_DONE)),
+        'failed': len(self._job_names(_FAILED)),
+        'update_time': time.time(),
+    }
+    status.update(details)
+    _write_json(os.path.join(self.spool_dir, _STATUS_FILE), status)
+
+  def read_status(self) -> Dict[str, Any]:
+    """Reads status.json, empty if no worker has written it yet."""
+    status_path = os.path.join(self.spool_dir, _STATUS_FILE)
+    if not os.path.exists(status_path):
+      return {}
+    with open(status_path) as f:
+      return json.load(f)
@@ -0,0 +1,122 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for job_spool."""
+
+import json
+import os
+import subprocess
+import tempfile
+
+from absl.testing import absltest
+from alphafold.common import job_spool
+
+
+class JobSpoolTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.spool_dir = tempfile.mkdtemp(dir=absltest.get_default_test_tmpdir())
+
+  def test_jobs_are_claimed_in_submission_order(self):
+    submitter = job_spool.JobSpool(self.spool_dir)
+    worker = job_spool.JobSpool(self.spool_dir)
+    submitter.submit('a', '/out')
+    submitter.submit('b', '/out')
+    self.assertEqual(worker.queue_depth(), 2)
+
+    job = worker.claim()
+    self.assertEqual(job.target_name, 'a')
+    self.assertEqual(job.output_dir, '/out')
+    self.assertEqual(worker.claim().target_name, 'b')
+    self.assertIsNone(worker.claim())
+    self.assertEqual(worker.queue_depth(), 0)
+
+  def test_job_files_have_mode_of_new_files(self):
+    job = job_spool.JobSpool(self.spool_dir).submit('a', '/out')
+    umask = os.umask(0)
+    os.umask(umask)
+    job_path = os.path.join(self.spool_dir, 'pending', job.name)
+    self.assertEqual(os.stat(job_path).st_mode & 0o777, 0o666 & ~umask)
+
+  def test_finish_and_fail(self):
+    spool = job_spool.JobSpool(self.spool_dir)
+    job_a = spool.submit('a', '/out')
+    job_b = spool.submit('b', '/out')
+    self.assertEqual(spool.job_state(job_a), 'pending')
+    spool.finish(spool.claim(), {'predict': 1.5})
+    self.assertEqual(spool.job_state(job_b), 'pending')
+    self.assertEqual(spool.job_state(spool.claim()), 'running')
+    spool.fail(job_b, 'Features not found')
+    self.assertEqual(spool.job_state(job_a), 'done')
+    self.assertEqual(spool.job_state(job_b), 'failed')
+
+    spool.write_status(current_job=None)
+    status = spool.read_status()
+    self.assertEqual(status['queue_depth'], 0)
+    self.assertEqual(status['running'], 0)
+    self.assertEqual(status['done'], 1)
+    self.assertEqual(status['failed'], 1)
+    self.assertIsNone(status['current_job'])
+    self.assertEmpty(os.listdir(os.path.join(self.spool_dir, 'running')))
+
+  def test_unreadable_job_is_failed(self):
+    spool = job_spool.JobSpool(self.spool_dir)
+    with open(os.path.join(self.spool_dir, 'pending', '0-bad.json'), 'w') as f:
+      f.write('{')
+    spool.submit('a', '/out')
+
+    self.assertEqual(spool.claim().target_name, 'a')
+    self.assertIsNone(spool.claim())
+    with open(os.path.join(self.spool_dir, 'failed', '0-bad.json')) as f:
+      self.assertIn('Could not read', json.load(f)['error'])
+
+  def test_requeue_jobs_of_exited_worker(self):
+    spool = job_spool.JobSpool(self.spool_dir)
+    job = spool.submit('a', '/out')
+    spool.claim()
+    running_path = os.path.join(self.spool_dir, 'running', job.name)
+    with open(running_path) as f:
+      record = json.load(f)
+    self.assertEqual(record['worker_pid'], os.getpid())
+    # This worker is alive.
+    self.assertEmpty(spool.requeue_stale_jobs())
+
+    exited = subprocess.Popen(['true'])
+    exited.wait()
+    record['worker_pid'] = exited.pid
+    with open(running_path, 'w') as f:
+      json.dump(record, f)
+    self.assertEqual(spool.requeue_stale_jobs(), [job.name])
+    self.assertEqual(spool.claim(), job)
+
+  def test_requeue_jobs_claimed_before_timeout(self):
+    spool = job_spool.JobSpool(self.spool_dir)
+    job = spool.submit('a', '/out')
+    spool.claim()
+    self.assertEmpty(spool.requeue_stale_jobs(claim_timeout=60.))
+    self.assertEqual(spool.requeue_stale_jobs(claim_timeout=-1.), [job.name])
+    self.assertEqual(spool.queue_depth(), 1)
+
+  def test_close_and_reopen(self):
+    spool = job_spool.JobSpool(self.spool_dir)
+    self.assertFalse(spool.is_closed())
+    spool.close()
+    self.assertTrue(job_spool.JobSpool(self.spool_dir).is_closed())
+    spool.reopen()
+    self.assertFalse(spool.is_closed())
+
+
+if __name__ == '__main__':
+  absltest.main()
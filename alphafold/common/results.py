@@ -0,0 +1,151 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact storage of prediction results in .npz files.
+
+The nested result dict of a model is flattened into one array per output,
+named by its path, e.g. 'structure_module/final_atom_positions'. Large float
+outputs, like the logits and representations, can be stored in float16, and
+the arrays are compressed. The arrays of a stored result are only read when
+they are accessed.
+"""
+
+import collections.abc
+import json
+from typing import Any, Dict, Iterator, Mapping, Optional, Sequence
+
+import numpy as np
+
+_SEPARATOR = '/'
+# The original dtypes of the arrays stored in float16, by path.
+_DTYPES_KEY = '__dtypes__'
+# Float arrays with fewer elements are always stored in full precision.
+_MIN_FLOAT16_SIZE = 4096
+# Outputs always stored in full precision, by path prefix.
+_FULL_PRECISION_OUTPUTS = ('structure_module',)
+
+
+def _flatten(result: Mapping[str, Any], prefix: str = '') -> Dict[str, Any]:
+  flat = {}
+  for k, v in result.items():
+    if isinstance(v, collections.abc.Mapping):
+      flat.update(_flatten(v, prefix + k + _SEPARATOR))
+    else:
+      flat[prefix + k] = v
+  return flat
+
+
+def _is_selected(path: str, fields: Optional[Sequence[str]]) -> bool:
+  """Whether the path is one of the fields or in one of them."""
+  if fields is None:
+    return True
+  return any(path == f or path.startswith(f + _SEPARATOR) for f in fields)
+
+
+def save_result(
+    path: str,
+    prediction_result: Mapping[str, Any],
+    fields: Optional[Sequence[str]] = None,
+    float16: bool = False,
+    compress: bool = True):
+  """Saves a prediction result to an .npz file.
+
+  Args:
+    path: The path of the file.
+    prediction_result: The nested dict of model outputs, as NumPy arrays or
+      scalars.
+    fields: If set, only these outputs are stored, given as top-level keys of
+      the result or as paths, e.g. 'distogram/logits'.
+    float16: Whether to store large float arrays in float16. The structure and
+      small arrays like the confidence metrics keep their precision.
+    compress: Whether to compress the arrays.
+  """
+  arrays = {}
+  dtypes = {}
+  for key, value in _flatten(prediction_result).items():
+    if not _is_selected(key, fields):
+      continue
+    value = np.asarray(value)
+    if value.dtype == object:
+      raise ValueError(f'Cannot store the object array {key}.')
+    if (float16 and value.dtype in (np.float32, np.float64) and
+        value.size >= _MIN_FLOAT16_SIZE and
+        not _is_selected(key, _FULL_PRECISION_OUTPUTS)):
+      dtypes[key] = value.dtype.name
+      value = value.astype(np.float16)
+    arrays[key] = value
+  arrays[_DTYPES_KEY] = np.asarray(json.dumps(dtypes))
+
+  with open(path, 'wb') as f:
+    if compress:
+      np.savez_compressed(f, **arrays)
+    else:
+      np.savez(f, **arrays)
+
+
+class LazyResult(collections.abc.Mapping):
+  """A stored prediction result, read array by array on access.
+
+  It behaves like the nested result dict: result['structure_module'] is a
+  LazyResult of the structure module outputs, and arrays are read, and
+  converted back to their original dtype, when they are accessed.
+  """
+
+  def __init__(self, npz: Any, dtypes: Mapping[str, str], prefix: str = ''):
+    self._npz = npz
+    self._dtypes = dtypes
+    self._prefix = prefix
+    self._keys = []
+    for name in npz.files:
+      if name != _DTYPES_KEY and name.startswith(prefix):
+        key = name[len(prefix):].split(_SEPARATOR, 1)[0]
+        if key not in self._keys:
+          self._keys.append(key)
+
+  def __getitem__(self, key: str) -> Any:
+    name = self._prefix + key
+    if name in self._npz.files:
+      value = self._npz[name]
+      if name in self._dtypes:
+        value = value.astype(self._dtypes[name])
+      return value
+    if key in self._keys:
+      return LazyResult(self._npz, self._dtypes, name + _SEPARATOR)
+    raise KeyError(key)
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._keys)
+
+  def __len__(self) -> int:
+    return len(self._keys)
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Reads all arrays into a nested dict, like the stored result."""
+    return {k: v.to_dict() if isinstance(v, LazyResult) else v
+            for k, v in self.items()}
+
+
+def load_result(path: str) -> LazyResult:
+  """Opens a prediction result saved by save_result.
+
+  Args:
+    path: The path of the .npz file.
+
+  Returns:
+    The result, whose arrays are read when they are accessed. The file stays
+    open while the result is referenced.
+  """
+  npz = np.load(path, allow_pickle=False)
+  dtypes = json.loads(str(npz[_DTYPES_KEY])) if _DTYPES_KEY in npz else {}
+  return LazyResult(npz, dtypes)
@@ -0,0 +1,82 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for results."""
+
+import os
+
+from absl.testing import absltest
+from alphafold.common import results
+import numpy as np
+
+
+def _prediction_result():
+  rng = np.random.default_rng(0)
+  return {
+      'distogram': {
+          'bin_edges': np.linspace(2., 22., 63, dtype=np.float32),
+          'logits': rng.normal(size=(40, 40, 64)).astype(np.float32),
+      },
+      'plddt': rng.uniform(0, 100, size=40),
+      'ptm': np.asarray(0.75),
+      'ranking_confidence': np.float64(81.5),
+      'structure_module': {
+          'final_atom_positions': rng.normal(
+              size=(40, 37, 3)).astype(np.float32) * 100,
+          'final_atom_mask': np.ones((40, 37), np.float32),
+      },
+      'num_recycles': np.asarray(3, np.int32),
+  }
+
+
+class ResultsTest(absltest.TestCase):
+
+  def test_round_trip(self):
+    path = os.path.join(absltest.get_default_test_tmpdir(), 'result.npz')
+    prediction_result = _prediction_result()
+    results.save_result(path, prediction_result)
+
+    loaded = results.load_result(path)
+    self.assertSameElements(prediction_result, loaded)
+    self.assertSameElements(prediction_result['distogram'],
+                            loaded['distogram'])
+    np.testing.assert_array_equal(loaded['distogram']['logits'],
+                                  prediction_result['distogram']['logits'])
+    self.assertEqual(float(loaded['ranking_confidence']), 81.5)
+    self.assertEqual(int(loaded['num_recycles']), 3)
+    np.testing.assert_array_equal(
+        loaded.to_dict()['structure_module']['final_atom_positions'],
+        prediction_result['structure_module']['final_atom_positions'])
+
+  def test_float16_and_fields(self):
+    path = os.path.join(absltest.get_default_test_tmpdir(), 'result16.npz')
+    prediction_result = _prediction_result()
+    results.save_result(path, prediction_result, float16=True,
+                        fields=['distogram/logits', 'structure_module', 'ptm'])
+
+    loaded = results.load_result(path)
+    self.assertSameElements(['distogram', 'structure_module', 'ptm'], loaded)
+    self.assertSameElements(['logits'], loaded['distogram'])
+    logits = loaded['distogram']['logits']
+    self.assertEqual(logits.dtype, np.float32)
+    np.testing.assert_allclose(
+        logits, prediction_result['distogram']['logits'], atol=5e-3)
+    # The structure keeps its precision.
+    np.testing.assert_array_equal(
+        loaded['structure_module']['final_atom_positions'],
+        prediction_result['structure_module']['final_atom_positions'])
+
+
+if __name__ == '__main__':
+  absltest.main()
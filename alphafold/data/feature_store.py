@@ -0,0 +1,238 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An on-disk format for feature dicts with one memory-mapped file per array.
+
+Features are passed from preprocessing to inference either pickled, in
+features.pkl, or in a feature store directory, features/. A store is read by
+memory-mapping the arrays of the requested features only, so that loading is
+fast, the pages of large arrays like the MSA are only read when used, and
+workers reading the same target share the page cache.
+
+Layout of a store directory:
+  metadata.json: The format version and the dtype, shape and file of every
+    feature.
+  <feature>.npy: The array of a feature.
+  <feature>.npy.gz: The array of a feature, if the store is compressed.
+    Compressed arrays are read into memory instead of memory-mapped.
+"""
+
+import gzip
+import json
+import os
+import pickle
+import shutil
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+_FORMAT_VERSION = 1
+_METADATA_FILE = 'metadata.json'
+
+FEATURES_PKL = 'features.pkl'
+FEATURE_STORE_DIR = 'features'
+FEATURE_FORMATS = ('pkl', 'npy', 'npy_compressed')
+
+
+def save_features(
+    store_dir: str,
+    feature_dict: Mapping[str, Any],
+    compress: bool = False):
+  """Saves a feature dict as a feature store directory.
+
+  The store is written next to store_dir and then moved into place, so that
+  readers never see a partially written store.
+
+  Args:
+    store_dir: The path of the store directory, replaced if it exists.
+    feature_dict: The features, as NumPy arrays or scalars.
+    compress: Whether to gzip the arrays. Compressed stores are smaller, but
+      their arrays cannot be memory-mapped.
+  """
+  tmp_dir = f'{store_dir}.tmp-{os.getpid()}'
+  if os.path.exists(tmp_dir):
+    shutil.rmtree(tmp_dir)
+  os.makedirs(tmp_dir)
+
+  features = {}
+  for name, value in feature_dict.items():
+    value = np.asarray(value)
+    filename = f'{name}.npy.gz' if compress else f'{name}.npy'
+    # Object arrays, like the sequence and domain names, are small.
+    allow_pickle = value.dtype == object
+    if compress:
+      with gzip.open(os.path.join(tmp_dir, filename), 'wb') as f:
+        np.save(f, value, allow_pickle=allow_pickle)
+    else:
+      np.save(os.path.join(tmp_dir, filename), value,
+              allow_pickle=allow_pickle)
+    features[name] = {
+        'dtype': value.dtype.str,
+        'shape': list(value.shape),
+        'file': filename,
+    }
+
+  with open(os.path.join(tmp_dir, _METADATA_FILE), 'w') as f:
+    json.dump({'format_version': _FORMAT_VERSION, 'features': features}, f,
+              indent=2)
+
+  if os.path.exists(store_dir):
+    shutil.rmtree(store_dir)
+  os.rename(tmp_dir, store_dir)
+
+
+def read_metadata(store_dir: str) -> Dict[str, Any]:
+  """Reads the metadata of a feature store.
+
+  Args:
+    store_dir: The path of the store directory.
+
+  Returns:
+    The metadata, with the dtype, shape and file of every feature under
+    'features'.
+
+  Raises:
+    ValueError: If the store was written in a newer format.
+  """
+  with open(os.path.join(store_dir, _METADATA_FILE)) as f:
+    metadata = json.load(f)
+  if metadata['format_version'] > _FORMAT_VERSION:
+    raise ValueError(
+        f'Feature store {store_dir} has format version '
+        f'{metadata["format_version"]}, this reader supports up to '
+        f'{_FORMAT_VERSION}.')
+  return metadata
+
+
+def load_features(
+    store_dir: str,
+    fields: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+  """Loads features from a feature store.
+
+  Args:
+    store_dir: The path of the store directory.
+    fields: If set, only these features are loaded. Features that are not in
+      the store are skipped.
+
+  Returns:
+    The feature dict. Uncompressed arrays are memory-mapped copy-on-write:
+    their pages are read when accessed and writes are not saved.
+  """
+  metadata = read_metadata(store_dir)
+  feature_dict = {}
+  for name, info in metadata['features'].items():
+    if fields is not None and name not in fields:
+      continue
+    path = os.path.join(store_dir, info['file'])
+    allow_pickle = np.dtype(info['dtype']) == object
+    if path.endswith('.gz'):
+      with gzip.open(path, 'rb') as f:
+        feature_dict[name] = np.load(f, allow_pickle=allow_pickle)
+    elif allow_pickle or not np.prod(info['shape']):
+      # Object and empty arrays cannot be memory-mapped.
+      feature_dict[name] = np.load(path, allow_pickle=allow_pickle)
+    else:
+      feature_dict[name] = np.load(path, mmap_mode='c')
+  return feature_dict
+
+
+def read_feature_shapes(output_dir: str) -> Dict[str, Tuple[int, ...]]:
+  """Reads the shapes of the features of a target.
+
+  Only the metadata of a feature store is read; a features.pkl has to be
+  loaded as a whole.
+
+  Args:
+    output_dir: The output directory of the target.
+
+  Returns:
+    The shape of each feature.
+  """
+  store_dir = os.path.join(output_dir, FEATURE_STORE_DIR)
+  if os.path.exists(os.path.join(store_dir, _METADATA_FILE)):
+    return {name: tuple(info['shape']) for name, info in
+            read_metadata(store_dir)['features'].items()}
+  return {name: np.shape(value)
+          for name, value in read_features(output_dir).items()}
+
+
+def has_features(output_dir: str) -> bool:
+  """Whether the output directory of a target has its features."""
+  return (os.path.exists(os.path.join(output_dir, FEATURE_STORE_DIR,
+                                      _METADATA_FILE)) or
+          os.path.exists(os.path.join(output_dir, FEATURES_PKL)))
+
+
+def write_features(
+    output_dir: str,
+    feature_dict: Mapping[str, Any],
+    features_format: str = 'pkl') -> str:
+  """Writes the features of a target to its output directory.
+
+  Args:
+    output_dir: The output directory of the target.
+    feature_dict: The features.
+    features_format: One of FEATURE_FORMATS: 'pkl' pickles the features to
+      features.pkl, 'npy' and 'npy_compressed' write a feature store to
+      features/. Features of the other format are removed, so that readers
+      do not pick up stale features.
+
+  Returns:
+    The path of the written features.
+  """
+  if features_format not in FEATURE_FORMATS:
+    raise ValueError(f'Unknown features format {features_format}, expected '
+                     f'one of {FEATURE_FORMATS}.')
+  pkl_path = os.path.join(output_dir, FEATURES_PKL)
+  store_dir = os.path.join(output_dir, FEATURE_STORE_DIR)
+  if features_format == 'pkl':
+    with open(pkl_path, 'wb') as f:
+      pickle.dump(feature_dict, f, protocol=4)
+    if os.path.exists(store_dir):
+      shutil.rmtree(store_dir)
+    return pkl_path
+
+  save_features(store_dir, feature_dict,
+                compress=features_format == 'npy_compressed')
+  if os.path.exists(pkl_path):
+    os.remove(pkl_path)
+  return store_dir
+
+
+def read_features(
+    output_dir: str,
+    fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+  """Reads the features of a target from its output directory.
+
+  Args:
+    output_dir: The output directory of the target, with a feature store or a
+      features.pkl.
+    fields: If set, only these features are read from a feature store, and
+      only these are kept from a features.pkl.
+
+  Returns:
+    The feature dict.
+
+  Raises:
+    FileNotFoundError: If the directory has no features.
+  """
+  store_dir = os.path.join(output_dir, FEATURE_STORE_DIR)
+  if os.path.exists(os.path.join(store_dir, _METADATA_FILE)):
+    return load_features(store_dir, fields)
+
+  with open(os.path.join(output_dir, FEATURES_PKL), 'rb') as f:
+    feature_dict = pickle.load(f)
+  if fields is not None:
+    feature_dict = {k: v for k, v in feature_dict.items() if k in fields}
+  return feature_dict
@@ -0,0 +1,83 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for feature_store."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from alphafold.data import feature_store
+import numpy as np
+
+
+def _feature_dict():
+  rng = np.random.default_rng(0)
+  return {
+      'aatype': np.eye(21, dtype=np.int32)[rng.integers(0, 21, 30)],
+      'msa': rng.integers(0, 22, (128, 30)).astype(np.int32),
+      'deletion_matrix_int': rng.integers(0, 3, (128, 30)).astype(np.int32),
+      'seq_length': np.full(30, 30, np.int32),
+      'sequence': np.array([b'A' * 30], dtype=object),
+      'template_aatype': np.zeros((0, 30, 22), np.float32),
+  }
+
+
+class FeatureStoreTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.output_dir = tempfile.mkdtemp(dir=absltest.get_default_test_tmpdir())
+
+  @parameterized.parameters('pkl', 'npy', 'npy_compressed')
+  def test_round_trip(self, features_format):
+    feature_dict = _feature_dict()
+    self.assertFalse(feature_store.has_features(self.output_dir))
+    feature_store.write_features(self.output_dir, feature_dict,
+                                 features_format)
+    self.assertTrue(feature_store.has_features(self.output_dir))
+
+    loaded = feature_store.read_features(self.output_dir)
+    self.assertSameElements(feature_dict, loaded)
+    for name, value in feature_dict.items():
+      self.assertEqual(loaded[name].dtype, value.dtype)
+      np.testing.assert_array_equal(loaded[name], value)
+
+    shapes = feature_store.read_feature_shapes(self.output_dir)
+    self.assertEqual(shapes['msa'], (128, 30))
+    self.assertEqual(shapes['template_aatype'], (0, 30, 22))
+
+  def test_reads_only_requested_fields(self):
+    feature_store.write_features(self.output_dir, _feature_dict(), 'npy')
+    loaded = feature_store.read_features(
+        self.output_dir, fields=['msa', 'seq_length', 'not_a_feature'])
+    self.assertSameElements(['msa', 'seq_length'], loaded)
+    self.assertIsInstance(loaded['msa'], np.memmap)
+    # Writes are not saved to the store.
+    loaded['msa'][0, 0] = 99
+    self.assertNotEqual(
+        feature_store.read_features(self.output_dir)['msa'][0, 0], 99)
+
+  def test_replaces_features_of_other_format(self):
+    feature_store.write_features(self.output_dir, _feature_dict(), 'pkl')
+    feature_store.write_features(self.output_dir, {'msa': np.zeros(3)}, 'npy')
+    self.assertFalse(os.path.exists(
+        os.path.join(self.output_dir, feature_store.FEATURES_PKL)))
+    self.assertSameElements(['msa'],
+                            feature_store.read_features(self.output_dir))
+
+
+if __name__ == '__main__':
+  absltest.main()
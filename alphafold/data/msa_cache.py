@@ -0,0 +1,231 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A content-addressed cache of MSA search results."""
+
+import glob
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Mapping, Optional, Tuple
+
+from absl import logging
+from alphafold.common import file_utils
+from alphafold.data import parsers
+
+# Runner attributes that do not change the search results.
+_IGNORED_RUNNER_ATTRIBUTES = frozenset({
+    'binary_path',
+    'database_path',
+    'databases',
+    'n_cpu',
+    'num_streamed_chunks',
+    'shared_scan_chunk_size',
+    'shared_scan_dir',
+    'streaming_callback',
+    'use_database_shards',
+})
+
+# The query is stored under this name and renamed to the name of the query of
+# each lookup, so that the same sequence is shared between differently named
+# inputs.
+_CACHED_QUERY_NAME = 'cached_query'
+
+
+def _runner_parameters(msa_runner) -> Mapping[str, Any]:
+  """Returns the search parameters of an MSA tool runner."""
+  parameters = {}
+  for name, value in sorted(vars(msa_runner).items()):
+    if name.startswith('_') or name in _IGNORED_RUNNER_ATTRIBUTES:
+      continue
+    if value is None or isinstance(value, (bool, int, float, str)):
+      parameters[name] = value
+  return parameters
+
+
+def _database_identity(msa_runner) -> Mapping[str, Any]:
+  """Returns the names and sizes of the database files of an MSA runner.
+
+  The database files are identified by their name and size rather than their
+  full path and modification time, so that the cache stays valid for copies of
+  the same database, e.g. on node-local storage.
+
+  Args:
+    msa_runner: A jackhmmer or HHblits runner.
+
+  Returns:
+    A mapping from the base name of each database file to its size.
+  """
+  database_paths = getattr(msa_runner, 'databases', None)
+  if database_paths is None:
+    database_paths = [msa_runner.database_path]
+  identity = {}
+  for database_path in database_paths:
+    # HHblits databases and database shards consist of several files that
+    # share the database path as a prefix.
+    for path in sorted(glob.glob(glob.escape(database_path) + '*')):
+      if os.path.isfile(path):
+        identity[os.path.basename(path)] = os.path.getsize(path)
+  return identity
+
+
+def _rename_query(msa: str, msa_format: str, query_name: str,
+                  new_query_name: str) -> str:
+  """Renames the query of a Stockholm or A3M MSA."""
+  lines = msa.splitlines(keepends=True)
+  if msa_format == 'a3m':
+    # The query is the first sequence. Its description is the whole header.
+    for i, line in enumerate(lines):
+      if line.startswith('>'):
+        lines[i] = f'>{new_query_name}\n'
+        break
+    return ''.join(lines)
+  if msa_format != 'sto':
+    raise ValueError(f'Unsupported MSA format: {msa_format}')
+
+  for i, line in enumerate(lines):
+    if line.startswith(('#=GS ', '#=GR ')):
+      prefix, rest = line[:5], line[5:]
+      name, sep, rest = rest.partition(' ')
+      if name == query_name:
+        lines[i] = f'{prefix}{new_query_name}{sep}{rest}'
+    elif line.strip() and not line.startswith(('#', '//')):
+      name, sep, rest = line.partition(' ')
+      if name == query_name:
+        lines[i] = f'{new_query_name}{sep}{rest}'
+  return ''.join(lines)
+
+
+def _read_query(input_fasta_path: str, msa_format: str) -> Tuple[str, str]:
+  """Returns the sequence and its name in the MSA of a single-sequence FASTA."""
+  with open(input_fasta_path) as f:
+    sequences, descriptions = parsers.parse_fasta(f.read())
+  if len(sequences) != 1:
+    raise ValueError(
+        f'Expected a single sequence in {input_fasta_path}, got '
+        f'{len(sequences)}.')
+  description = descriptions[0]
+  if msa_format == 'sto':
+    # Stockholm names end at the first whitespace.
+    query_name = description.split(maxsplit=1)[0] if description else ''
+  else:
+    query_name = description
+  return sequences[0], query_name
+
+
+class MsaCache:
+  """A size-bounded, content-addressed cache of MSAs in a local directory.
+
+  MSAs are keyed by the query sequence, the identity of the searched databases,
+  the search parameters of the tool and the maximum number of sequences kept.
+  The query name is not part of the key, so identical chains of different
+  inputs share a cache entry. Entries are evicted in least recently used order
+  once the cache grows beyond max_size_bytes. Entries are written atomically,
+  so a cache directory can be shared by several processes.
+  """
+
+  def __init__(self, cache_dir: str, max_size_bytes: Optional[int] = None):
+    """Initializes the cache.
+
+    Args:
+      cache_dir: The directory in which the cache entries are stored.
+      max_size_bytes: If set, the maximum total size of the cache entries.
+    """
+    self.cache_dir = cache_dir
+    self.max_size_bytes = max_size_bytes
+    os.makedirs(cache_dir, exist_ok=True)
+    self._eviction_lock = threading.Lock()
+
+  def _key(self, msa_runner, sequence: str, msa_format: str,
+           max_sequences: Optional[int]) -> str:
+    key = {
+        'sequence': sequence,
+        'tool': type(msa_runner).__name__,
+        'parameters': _runner_parameters(msa_runner),
+        'databases': _database_identity(msa_runner),
+        'msa_format': msa_format,
+        'max_sequences': max_sequences,
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+  def _entry_path(self, key: str, msa_format: str) -> str:
+    return os.path.join(self.cache_dir, key[:2], f'{key}.{msa_format}')
+
+  def get(self,
+          msa_runner,
+          input_fasta_path: str,
+          msa_format: str,
+          max_sequences: Optional[int] = None) -> Optional[str]:
+    """Returns the cached MSA for the query, or None if it is not cached."""
+    sequence, query_name = _read_query(input_fasta_path, msa_format)
+    key = self._key(msa_runner, sequence, msa_format, max_sequences)
+    entry_path = self._entry_path(key, msa_format)
+    try:
+      with open(entry_path) as f:
+        msa = f.read()
+      # The modification time is the last use for the LRU eviction.
+      os.utime(entry_path)
+    except FileNotFoundError:
+      return None
+    logging.info('Found cached MSA %s for %s.', entry_path, input_fasta_path)
+    return _rename_query(msa, msa_format, _CACHED_QUERY_NAME, query_name)
+
+  def put(self,
+          msa_runner,
+          input_fasta_path: str,
+          msa_format: str,
+          msa: str,
+          max_sequences: Optional[int] = None):
+    """Stores the MSA of the query in the cache."""
+    sequence, query_name = _read_query(input_fasta_path, msa_format)
+    key = self._key(msa_runner, sequence, msa_format, max_sequences)
+    entry_path = self._entry_path(key, msa_format)
+    msa = _rename_query(msa, msa_format, query_name, _CACHED_QUERY_NAME)
+
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    with file_utils.atomic_write(entry_path) as f:
+      f.write(msa)
+    logging.info('Cached MSA of %s as %s.', input_fasta_path, entry_path)
+
+    if self.max_size_bytes is not None:
+      self._evict()
+
+  def _evict(self):
+    """Removes the least recently used entries until the cache fits."""
+    with self._eviction_lock:
+      entries = []
+      total_size = 0
+      for entry_path in glob.glob(os.path.join(self.cache_dir, '*', '*')):
+        if entry_path.endswith('.tmp'):
+          continue
+        try:
+          stat = os.stat(entry_path)
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total_size += stat.st_size
+
+      entries.sort()
+      for _, size, entry_path in entries:
+        if total_size <= self.max_size_bytes:
+          break
+        try:
+          os.remove(entry_path)
+        except FileNotFoundError:
+          # Already evicted by another process.
+          pass
+        total_size -= size
+        logging.info('Evicted cached MSA %s.', entry_path)
@@ -0,0 +1,121 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for msa_cache."""
+
+import glob
+import os
+import tempfile
+import time
+
+from absl.testing import absltest
+from alphafold.data import msa_cache
+from alphafold.data import parsers
+
+_STOCKHOLM_MSA = """# STOCKHOLM 1.0
+
+#=GS hit1/1-4 DE A hit
+
+{query}     ACDE
+hit1/1-4 AC-E
+#=GR {query} PP 9999
+//
+"""
+
+
+class _FakeRunner:
+
+  def __init__(self, database_path, e_value=0.0001, n_cpu=8):
+    self.binary_path = '/usr/bin/jackhmmer'
+    self.database_path = database_path
+    self.e_value = e_value
+    self.n_cpu = n_cpu
+
+
+class MsaCacheTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.database_path = os.path.join(self.tmp_dir, 'db.fasta')
+    with open(self.database_path, 'w') as f:
+      f.write('>hit1\nACE\n')
+    self.cache = msa_cache.MsaCache(os.path.join(self.tmp_dir, 'cache'))
+
+  def _write_fasta(self, name, sequence):
+    fasta_path = os.path.join(self.tmp_dir, f'{name}.fasta')
+    with open(fasta_path, 'w') as f:
+      f.write(f'>{name} some description\n{sequence}\n')
+    return fasta_path
+
+  def test_hit_renames_query(self):
+    runner = _FakeRunner(self.database_path)
+    self.cache.put(runner, self._write_fasta('first', 'ACDE'), 'sto',
+                   _STOCKHOLM_MSA.format(query='first'))
+
+    # Same sequence and database but other tool resources and query name.
+    cached = self.cache.get(_FakeRunner(self.database_path, n_cpu=2),
+                            self._write_fasta('second', 'ACDE'), 'sto')
+    self.assertEqual(_STOCKHOLM_MSA.format(query='second'), cached)
+    self.assertEqual(['second', 'hit1/1-4'],
+                     parsers.parse_stockholm(cached).descriptions)
+
+  def test_entries_have_mode_of_new_files(self):
+    self.cache.put(_FakeRunner(self.database_path),
+                   self._write_fasta('first', 'ACDE'), 'sto',
+                   _STOCKHOLM_MSA.format(query='first'))
+    entry_path, = glob.glob(os.path.join(self.cache.cache_dir, '*', '*.sto'))
+    umask = os.umask(0)
+    os.umask(umask)
+    self.assertEqual(os.stat(entry_path).st_mode & 0o777, 0o666 & ~umask)
+
+  def test_miss_on_changed_sequence_parameters_or_database(self):
+    runner = _FakeRunner(self.database_path)
+    fasta_path = self._write_fasta('query', 'ACDE')
+    self.cache.put(runner, fasta_path, 'sto',
+                   _STOCKHOLM_MSA.format(query='query'))
+
+    self.assertIsNone(self.cache.get(
+        runner, self._write_fasta('other', 'ACDF'), 'sto'))
+    self.assertIsNone(self.cache.get(
+        _FakeRunner(self.database_path, e_value=1.0), fasta_path, 'sto'))
+    self.assertIsNone(self.cache.get(runner, fasta_path, 'sto',
+                                     max_sequences=10))
+    with open(self.database_path, 'a') as f:
+      f.write('>hit2\nACDE\n')
+    self.assertIsNone(self.cache.get(runner, fasta_path, 'sto'))
+
+  def test_evicts_least_recently_used(self):
+    runner = _FakeRunner(self.database_path)
+    msa = _STOCKHOLM_MSA.format(query='query')
+    cache = msa_cache.MsaCache(os.path.join(self.tmp_dir, 'small_cache'),
+                               max_size_bytes=2 * len(msa))
+    fasta_paths = [self._write_fasta(f'query{i}', sequence)
+                   for i, sequence in enumerate(('AAAA', 'CCCC', 'DDDD'))]
+
+    cache.put(runner, fasta_paths[0], 'sto', msa)
+    cache.put(runner, fasta_paths[1], 'sto', msa)
+    # Makes the first entry the most recently used one.
+    time.sleep(0.01)
+    self.assertIsNotNone(cache.get(runner, fasta_paths[0], 'sto'))
+    time.sleep(0.01)
+    cache.put(runner, fasta_paths[2], 'sto', msa)
+
+    self.assertIsNotNone(cache.get(runner, fasta_paths[0], 'sto'))
+    self.assertIsNone(cache.get(runner, fasta_paths[1], 'sto'))
+    self.assertIsNotNone(cache.get(runner, fasta_paths[2], 'sto'))
+
+
+if __name__ == '__main__':
+  absltest.main()
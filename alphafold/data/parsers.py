@@ -15,20 +15,30 @@
 """Functions for parsing various file formats."""
 import collections
 import dataclasses
+import hashlib
 import itertools
+import os
 import re
 import string
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Set
+import tempfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Set
+import numpy as np
 
 # Internal import (7716).
 
 
-DeletionMatrix = Sequence[Sequence[int]]
+# An int32 array of shape [num_sequences, num_residues].
+DeletionMatrix = np.ndarray
 
 
 @dataclasses.dataclass(frozen=True)
 class Msa:
-  """Class representing a parsed MSA file."""
+  """Class representing a parsed MSA file.
+
+  The deletion matrix is an int32 array of shape [num_sequences, num_residues],
+  as returned by the parsers. The element at `deletion_matrix[i][j]` is the
+  number of residues deleted from the aligned sequence i at residue position j.
+  """
   sequences: Sequence[str]
   deletion_matrix: DeletionMatrix
   descriptions: Sequence[str]
@@ -105,9 +115,10 @@ def parse_stockholm(stockholm_string: str) -> Msa:
     A tuple of:
       * A list of sequences that have been aligned to the query. These
         might contain duplicates.
-      * The deletion matrix for the alignment as a list of lists. The element
-        at `deletion_matrix[i][j]` is the number of residues deleted from
-        the aligned sequence i at residue position j.
+      * The deletion matrix for the alignment as an int32 array of shape
+        [num_sequences, num_residues]. The element at `deletion_matrix[i][j]`
+        is the number of residues deleted from the aligned sequence i at
+        residue position j.
       * The names of the targets matched, including the jackhmmer subsequence
         suffix.
   """
@@ -118,40 +129,48 @@ def parse_stockholm(stockholm_string: str) -> Msa:
       continue
     name, sequence = line.split()
     if name not in name_to_sequence:
-      name_to_sequence[name] = ''
-    name_to_sequence[name] += sequence
-
-  msa = []
-  deletion_matrix = []
-
-  query = ''
-  keep_columns = []
-  for seq_index, sequence in enumerate(name_to_sequence.values()):
-    if seq_index == 0:
-      # Gather the columns with gaps from the query
-      query = sequence
-      keep_columns = [i for i, res in enumerate(query) if res != '-']
-
-    # Remove the columns with gaps in the query from all sequences.
-    aligned_sequence = ''.join([sequence[c] for c in keep_columns])
-
-    msa.append(aligned_sequence)
-
-    # Count the number of deletions w.r.t. query.
-    deletion_vec = []
-    deletion_count = 0
-    for seq_res, query_res in zip(sequence, query):
-      if seq_res != '-' or query_res != '-':
-        if query_res == '-':
-          deletion_count += 1
-        else:
-          deletion_vec.append(deletion_count)
-          deletion_count = 0
-    deletion_matrix.append(deletion_vec)
+      name_to_sequence[name] = []
+    name_to_sequence[name].append(sequence)
+
+  descriptions = list(name_to_sequence.keys())
+  if not descriptions:
+    return Msa(sequences=[],
+               deletion_matrix=np.zeros((0, 0), dtype=np.int32),
+               descriptions=[])
+
+  # Work on the sequences as an array of bytes, one row each. Columns beyond
+  # the end of the query are ignored.
+  sequences = [''.join(parts) for parts in name_to_sequence.values()]
+  query = sequences[0]
+  num_columns = len(query)
+  num_query_columns = len(query.rstrip('-'))
+  for name, sequence in zip(descriptions, sequences):
+    if len(sequence) < num_query_columns:
+      raise ValueError(f'Sequence {name} is shorter than the query.')
+  msa_array = np.frombuffer(
+      ''.join(s[:num_columns].ljust(num_columns, '-') for s in sequences
+              ).encode('ascii'),
+      dtype=np.uint8).reshape(len(sequences), num_columns)
+
+  # Remove the columns with gaps in the query from all sequences.
+  gap = ord('-')
+  keep_columns = msa_array[0] != gap
+  aligned_array = np.ascontiguousarray(msa_array[:, keep_columns])
+  row_length = aligned_array.shape[1]
+  aligned_bytes = aligned_array.tobytes()
+  msa = [aligned_bytes[i * row_length:(i + 1) * row_length].decode('ascii')
+         for i in range(len(descriptions))]
+
+  # Count the number of deletions w.r.t. query, i.e. the residues in the
+  # columns with gaps in the query since the previous kept column.
+  deletions = (msa_array != gap) & ~keep_columns
+  deletion_cumsum = np.cumsum(deletions, axis=1, dtype=np.int32)
+  deletion_matrix = np.diff(
+      deletion_cumsum[:, keep_columns], axis=1, prepend=0).astype(np.int32)
 
   return Msa(sequences=msa,
              deletion_matrix=deletion_matrix,
-             descriptions=list(name_to_sequence.keys()))
+             descriptions=descriptions)
 
 
 def parse_a3m(a3m_string: str) -> Msa:
@@ -165,27 +184,52 @@ def parse_a3m(a3m_string: str) -> Msa:
     A tuple of:
       * A list of sequences that have been aligned to the query. These
         might contain duplicates.
-      * The deletion matrix for the alignment as a list of lists. The element
-        at `deletion_matrix[i][j]` is the number of residues deleted from
-        the aligned sequence i at residue position j.
+      * The deletion matrix for the alignment as an int32 array of shape
+        [num_sequences, num_residues]. The element at `deletion_matrix[i][j]`
+        is the number of residues deleted from the aligned sequence i at
+        residue position j.
       * A list of descriptions, one per sequence, from the a3m file.
+
+  Raises:
+    ValueError: If the sequences have different numbers of aligned (i.e. not
+      lowercase) residues, so that they do not form an alignment.
   """
   sequences, descriptions = parse_fasta(a3m_string)
-  deletion_matrix = []
-  for msa_sequence in sequences:
-    deletion_vec = []
-    deletion_count = 0
-    for j in msa_sequence:
-      if j.islower():
-        deletion_count += 1
-      else:
-        deletion_vec.append(deletion_count)
-        deletion_count = 0
-    deletion_matrix.append(deletion_vec)
 
   # Make the MSA matrix out of aligned (deletion-free) sequences.
   deletion_table = str.maketrans('', '', string.ascii_lowercase)
   aligned_sequences = [s.translate(deletion_table) for s in sequences]
+
+  # Work on all sequences concatenated, with deletions as lowercase residues.
+  flat = np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8)
+  is_deletion = (flat >= ord('a')) & (flat <= ord('z'))
+  deletion_cumsum = np.cumsum(is_deletion, dtype=np.int32)
+  sequence_starts = np.cumsum([0] + [len(s) for s in sequences[:-1]])
+  aligned_positions = np.flatnonzero(~is_deletion)
+  aligned_sequence_index = np.searchsorted(
+      sequence_starts, aligned_positions, side='right') - 1
+
+  # The number of deletions before each aligned residue is the increase of the
+  # cumulative deletion count since the previous aligned residue, or since the
+  # start of the sequence for its first aligned residue.
+  aligned_cumsum = deletion_cumsum[aligned_positions]
+  previous_cumsum = np.empty_like(aligned_cumsum)
+  previous_cumsum[1:] = aligned_cumsum[:-1]
+  is_first = np.ones(len(aligned_positions), dtype=bool)
+  is_first[1:] = aligned_sequence_index[1:] != aligned_sequence_index[:-1]
+  cumsum_before_sequence = np.concatenate([[0], deletion_cumsum])[
+      sequence_starts]
+  previous_cumsum[is_first] = cumsum_before_sequence[
+      aligned_sequence_index[is_first]]
+  deletion_counts = aligned_cumsum - previous_cumsum
+
+  num_aligned = {len(s) for s in aligned_sequences}
+  if len(num_aligned) > 1:
+    raise ValueError('All sequences of an a3m MSA must have the same number '
+                     f'of aligned residues, got {sorted(num_aligned)}.')
+  deletion_matrix = deletion_counts.reshape(
+      len(sequences), num_aligned.pop() if sequences else 0)
+
   return Msa(sequences=aligned_sequences,
              deletion_matrix=deletion_matrix,
              descriptions=descriptions)
@@ -274,11 +318,10 @@ def _keep_line(line: str, seqnames: Set[str]) -> bool:
     return seqname in seqnames
 
 
-def truncate_stockholm_msa(stockholm_msa_path: str, max_sequences: int) -> str:
-  """Reads + truncates a Stockholm file while preventing excessive RAM usage."""
+def _iter_truncated_stockholm_lines(stockholm_msa_path: str,
+                                    max_sequences: int) -> Iterator[str]:
+  """Yields the lines of a Stockholm file truncated to max_sequences."""
   seqnames = set()
-  filtered_lines = []
-
   with open(stockholm_msa_path) as f:
     for line in f:
       if line.strip() and not line.startswith(('#', '//')):
@@ -292,9 +335,13 @@ def truncate_stockholm_msa(stockholm_msa_path: str, max_sequences: int) -> str:
     f.seek(0)
     for line in f:
       if _keep_line(line, seqnames):
-        filtered_lines.append(line)
+        yield line
 
-  return ''.join(filtered_lines)
+
+def truncate_stockholm_msa(stockholm_msa_path: str, max_sequences: int) -> str:
+  """Reads + truncates a Stockholm file while preventing excessive RAM usage."""
+  return ''.join(
+      _iter_truncated_stockholm_lines(stockholm_msa_path, max_sequences))
 
 
 def remove_empty_columns_from_stockholm_msa(stockholm_msa: str) -> str:
@@ -372,6 +419,353 @@ def deduplicate_stockholm_msa(stockholm_msa: str) -> str:
   return '\n'.join(filtered_lines) + '\n'
 
 
+# The streaming functions below process Stockholm files of any size line by
+# line, holding at most a few values per sequence and one alignment row in
+# memory. Their output matches that of the corresponding string functions.
+
+
+def truncate_stockholm_file(stockholm_msa_path: str, output_path: str,
+                            max_sequences: int):
+  """Writes the first max_sequences sequences of a Stockholm file."""
+  with open(output_path, 'w') as f:
+    f.writelines(
+        _iter_truncated_stockholm_lines(stockholm_msa_path, max_sequences))
+
+
+def _iter_stockholm_alignment_lines(
+    stockholm_msa_path: str) -> Iterator[Tuple[str, str]]:
+  """Yields the sequence name and aligned part of each alignment line."""
+  with open(stockholm_msa_path) as f:
+    for line in f:
+      if line.strip() and not line.startswith(('#', '//')):
+        seqname, aligned_part = line.split()
+        yield seqname, aligned_part
+
+
+def deduplicate_stockholm_file(stockholm_msa_path: str, output_path: str):
+  """Removes duplicate sequences (ignoring insertions wrt query) from a file.
+
+  Streaming version of deduplicate_stockholm_msa. Instead of the full aligned
+  sequences only a running hash of each sequence without insertions is kept.
+
+  Args:
+    stockholm_msa_path: The Stockholm file to deduplicate.
+    output_path: The path to write the deduplicated Stockholm file to.
+  """
+  query_seqname = None
+  query_mask = bytearray()  # Non-zero for the columns without insertions.
+  sequence_hashes = {}
+  sequence_lengths = {}
+  for seqname, aligned_part in _iter_stockholm_alignment_lines(
+      stockholm_msa_path):
+    if query_seqname is None:
+      query_seqname = seqname
+    if seqname == query_seqname:
+      query_mask.extend(res != '-' for res in aligned_part)
+    if seqname not in sequence_hashes:
+      sequence_hashes[seqname] = hashlib.blake2b(digest_size=16)
+      sequence_lengths[seqname] = 0
+    start = sequence_lengths[seqname]
+    sequence_lengths[seqname] += len(aligned_part)
+    sequence_hashes[seqname].update(''.join(itertools.compress(
+        aligned_part, query_mask[start:start + len(aligned_part)])).encode())
+
+  seen_sequences = set()
+  seqnames = set()
+  for seqname, sequence_hash in sequence_hashes.items():
+    digest = sequence_hash.digest()
+    if digest not in seen_sequences:
+      seen_sequences.add(digest)
+      seqnames.add(seqname)
+  del sequence_hashes
+
+  with open(stockholm_msa_path) as f, open(output_path, 'w') as out_f:
+    for line in f:
+      if _keep_line(line, seqnames):
+        out_f.write(line)
+
+
+def remove_empty_columns_from_stockholm_file(stockholm_msa_path: str,
+                                             output_path: str):
+  """Removes empty columns (dashes-only) from a Stockholm file.
+
+  Streaming version of remove_empty_columns_from_stockholm_msa. The first pass
+  finds the non-empty columns of each block of the alignment, i.e. the lines up
+  to a reference annotation line, the second pass writes the masked lines.
+
+  Args:
+    stockholm_msa_path: The Stockholm file to remove empty columns from.
+    output_path: The path to write the resulting Stockholm file to.
+  """
+  gap = ord('-')
+  block_masks = []
+  block_mask = None
+  with open(stockholm_msa_path) as f:
+    for line in f:
+      if line.startswith('#=GC RF'):
+        block_masks.append(block_mask)
+        block_mask = None
+      elif line.strip() and not line.startswith(('#', '//')):
+        alignment = line.rstrip('\n').rpartition(' ')[2]
+        non_gaps = np.frombuffer(alignment.encode(), dtype=np.uint8) != gap
+        block_mask = non_gaps if block_mask is None else block_mask | non_gaps
+
+  with open(stockholm_msa_path) as f, open(output_path, 'w') as out_f:
+    block_index = 0
+    for line in f:
+      is_reference_annotation = line.startswith('#=GC RF')
+      if block_index < len(block_masks) and (
+          is_reference_annotation or
+          (line.strip() and not line.startswith(('#', '//')))):
+        mask = block_masks[block_index]
+        if mask is None or not mask.any():
+          # All columns were empty. Output an empty line.
+          line = '\n'
+        else:
+          prefix, _, alignment = line.rstrip('\n').rpartition(' ')
+          masked_alignment = np.frombuffer(
+              alignment.encode(), dtype=np.uint8)[mask].tobytes().decode()
+          line = f'{prefix} {masked_alignment}\n'
+        if is_reference_annotation:
+          block_index += 1
+      out_f.write(line)
+
+
+def _make_lowercase_table() -> np.ndarray:
+  table = np.arange(256, dtype=np.uint8)
+  table[ord('A'):ord('Z') + 1] += ord('a') - ord('A')
+  return table
+
+
+_LOWERCASE_TABLE = _make_lowercase_table()
+
+
+def convert_stockholm_file_to_a3m(stockholm_msa_path: str,
+                                  output_path: str,
+                                  max_sequences: Optional[int] = None,
+                                  remove_first_row_gaps: bool = True):
+  """Converts a Stockholm file to an A3M file.
+
+  Streaming version of convert_stockholm_to_a3m. The aligned parts of the
+  sequences are converted as they are read and spooled to one temporary file
+  per block of the alignment. The A3M sequences are then assembled from the
+  block files read in lockstep.
+
+  Args:
+    stockholm_msa_path: The Stockholm file to convert.
+    output_path: The path to write the A3M file to.
+    max_sequences: If set, only the first max_sequences sequences are kept.
+    remove_first_row_gaps: Whether to remove the columns with gaps in the
+      first sequence, the query, and lowercase the residues in them.
+  """
+  # First pass: the names of the kept sequences and the query mask.
+  seqnames = set()
+  query_seqname = None
+  query_non_gaps = bytearray()
+  for seqname, aligned_part in _iter_stockholm_alignment_lines(
+      stockholm_msa_path):
+    if query_seqname is None:
+      query_seqname = seqname
+    if seqname == query_seqname:
+      query_non_gaps.extend(res != '-' for res in aligned_part)
+    if seqname not in seqnames and not (
+        max_sequences and len(seqnames) >= max_sequences):
+      seqnames.add(seqname)
+  query_non_gaps = np.frombuffer(query_non_gaps, dtype=bool)
+
+  # Second pass: descriptions and the converted aligned parts of each block.
+  descriptions = {}
+  sequence_lengths = {}
+  gap = ord('-')
+  with tempfile.TemporaryDirectory() as spool_dir:
+    block_paths = []
+    block_file = None
+    with open(stockholm_msa_path) as f:
+      for line in f:
+        if line[:4] == '#=GS':
+          columns = line.split(maxsplit=3)
+          if (len(columns) >= 3 and columns[2] == 'DE' and
+              columns[1] in seqnames):
+            descriptions[columns[1]] = (
+                columns[3].rstrip('\n') if len(columns) == 4 else '')
+          continue
+        if not line.strip() or line.startswith(('#', '//')):
+          continue
+        seqname, aligned_part = line.split(maxsplit=1)
+        if seqname not in seqnames:
+          continue
+        if seqname == query_seqname:
+          # The query is the first sequence of every block.
+          if block_file is not None:
+            block_file.close()
+          block_paths.append(
+              os.path.join(spool_dir, f'block_{len(block_paths)}.txt'))
+          block_file = open(block_paths[-1], 'w')
+        # Dots are optional in a3m format and are commonly removed.
+        out_part = aligned_part.rstrip().replace('.', '')
+        if remove_first_row_gaps:
+          start = sequence_lengths.get(seqname, 0)
+          sequence_lengths[seqname] = start + len(out_part)
+          residues = np.frombuffer(out_part.encode(), dtype=np.uint8)
+          non_gaps = query_non_gaps[start:start + len(residues)]
+          residues = residues[:len(non_gaps)]
+          residues = np.where(non_gaps, residues, _LOWERCASE_TABLE[residues])
+          out_part = residues[non_gaps | (residues != gap)].tobytes().decode()
+        block_file.write(f'{seqname}\t{out_part}\n')
+    if block_file is not None:
+      block_file.close()
+
+    # Assemble the sequences from the blocks.
+    block_files = [open(block_path) for block_path in block_paths]
+    try:
+      with open(output_path, 'w') as out_f:
+        for lines in zip(*block_files):
+          seqname = lines[0].partition('\t')[0]
+          out_f.write(f'>{seqname} {descriptions.get(seqname, "")}\n')
+          for line in lines:
+            block_seqname, _, out_part = line.rstrip('\n').partition('\t')
+            if block_seqname != seqname:
+              raise ValueError(
+                  f'Sequence {block_seqname} is not in the same order in all '
+                  f'blocks of {stockholm_msa_path}.')
+            out_f.write(out_part)
+          out_f.write('\n')
+    finally:
+      for block_file in block_files:
+        block_file.close()
+
+
+def _parse_stockholm_sequences(
+    stockholm_msa: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+  """Returns the aligned sequences and descriptions of a Stockholm MSA."""
+  sequences = collections.OrderedDict()
+  descriptions = {}
+  for line in stockholm_msa.splitlines():
+    if line[:4] == '#=GS':
+      columns = line.split(maxsplit=3)
+      if len(columns) >= 3 and columns[2] == 'DE':
+        descriptions[columns[1]] = columns[3] if len(columns) == 4 else ''
+    elif line.strip() and not line.startswith(('#', '//')):
+      seqname, aligned_seq = line.split(maxsplit=1)
+      sequences[seqname] = sequences.get(seqname, '') + aligned_seq.strip()
+  return sequences, descriptions
+
+
+def merge_stockholm_msas(
+    stockholm_msas: Sequence[str],
+    sort_key: Optional[Callable[[str], Any]] = None,
+    hit_filter: Optional[Callable[[str], bool]] = None,
+    max_sequences: Optional[int] = None) -> str:
+  """Merges Stockholm MSAs of one query searched against different databases.
+
+  The first sequence of every MSA must be the query. The query of the first
+  non-empty MSA is kept as the first sequence of the output and the queries of
+  the other MSAs are dropped. Insert columns (gaps in the query) are merged so
+  that every hit keeps both its alignment to the query and its insertions, i.e.
+  parse_stockholm and convert_stockholm_to_a3m give the same sequence and
+  deletions for a hit as they do on the MSA it came from.
+
+  Args:
+    stockholm_msas: The Stockholm MSAs to merge, e.g. the results of searching
+      the chunks of a database.
+    sort_key: If set, hits are stably sorted by this function of the hit name.
+      Otherwise the hits keep their input order.
+    hit_filter: If set, only hits for which this function of the hit name
+      returns True are kept.
+    max_sequences: If set, the maximum number of sequences (including the
+      query) in the output.
+
+  Returns:
+    A Stockholm MSA with a single alignment block and an RF annotation marking
+    the match columns.
+  """
+  query_name = None
+  query_sequence = ''
+  # Hit name -> (aligned query columns, {match index: inserted residues}).
+  hits = collections.OrderedDict()
+  descriptions = {}
+  for stockholm_msa in stockholm_msas:
+    sequences, msa_descriptions = _parse_stockholm_sequences(stockholm_msa)
+    if not sequences:
+      continue
+    seqnames = iter(sequences)
+    msa_query_name = next(seqnames)
+    msa_query = sequences[msa_query_name]
+    match_columns = [i for i, res in enumerate(msa_query) if res not in '-.']
+    # (match index, first column, end column) of each run of insert columns.
+    insert_runs = []
+    previous_column = -1
+    for match_index, column in enumerate(match_columns + [len(msa_query)]):
+      if column > previous_column + 1:
+        insert_runs.append((match_index, previous_column + 1, column))
+      previous_column = column
+    if query_name is None:
+      query_name = msa_query_name
+      query_sequence = ''.join(msa_query[c] for c in match_columns)
+      if query_name in msa_descriptions:
+        descriptions[query_name] = msa_descriptions[query_name]
+
+    for seqname in seqnames:
+      if seqname in hits or seqname == query_name:
+        continue
+      if hit_filter is not None and not hit_filter(seqname):
+        continue
+      sequence = sequences[seqname]
+      matches = ''.join(sequence[c] for c in match_columns)
+      inserts = {}
+      for match_index, start, end in insert_runs:
+        inserted = sequence[start:end].replace('-', '').replace('.', '')
+        if inserted:
+          inserts[match_index] = inserted
+      hits[seqname] = (matches, inserts)
+      if seqname in msa_descriptions:
+        descriptions[seqname] = msa_descriptions[seqname]
+
+  if query_name is None:
+    return ''
+
+  seqnames = list(hits)
+  if sort_key is not None:
+    seqnames.sort(key=sort_key)
+  if max_sequences is not None:
+    seqnames = seqnames[:max(max_sequences - 1, 0)]
+
+  insert_widths = collections.defaultdict(int)
+  for seqname in seqnames:
+    for match_index, inserted in hits[seqname][1].items():
+      insert_widths[match_index] = max(
+          insert_widths[match_index], len(inserted))
+  insert_positions = sorted(insert_widths)
+
+  def merged_row(matches: str, inserts: Dict[int, str], pad: str) -> str:
+    pieces = []
+    previous_index = 0
+    for match_index in insert_positions:
+      pieces.append(matches[previous_index:match_index])
+      pieces.append(
+          inserts.get(match_index, '').ljust(insert_widths[match_index], pad))
+      previous_index = match_index
+    pieces.append(matches[previous_index:])
+    return ''.join(pieces)
+
+  rows = [(query_name, merged_row(query_sequence, {}, '-'))]
+  rows.extend((seqname, merged_row(*hits[seqname], '-'))
+              for seqname in seqnames)
+  reference_annotation = merged_row('x' * len(query_sequence), {}, '.')
+
+  name_width = max(len(name) for name, _ in rows + [('#=GC RF', '')])
+  lines = ['# STOCKHOLM 1.0', '']
+  for seqname, _ in rows:
+    if seqname in descriptions:
+      lines.append(f'#=GS {seqname} DE {descriptions[seqname]}'.rstrip())
+  lines.append('')
+  for seqname, row in rows:
+    lines.append(f'{seqname.ljust(name_width)} {row}')
+  lines.append(f'{"#=GC RF".ljust(name_width)} {reference_annotation}')
+  lines.append('//')
+  return '\n'.join(lines) + '\n'
+
+
 def _get_hhr_line_regex_groups(
     regex_pattern: str, line: str) -> Sequence[Optional[str]]:
   match = re.match(regex_pattern, line)
@@ -0,0 +1,196 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for parsers."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from alphafold.data import parsers
+import numpy as np
+
+_STOCKHOLM_CHUNK_1 = """# STOCKHOLM 1.0
+
+#=GS query DE The query
+#=GS hit1/1-6 DE First hit
+#=GS hit2/2-5 DE Second hit
+
+query    AC--DEF
+hit1/1-6 ACklDE-
+hit2/2-5 -C-aDEF
+#=GC RF  xx..xxx
+//
+"""
+
+_STOCKHOLM_CHUNK_2 = """# STOCKHOLM 1.0
+
+#=GS query DE The query
+#=GS hit3/1-7 DE Third hit
+
+query    A-CDE-F
+hit3/1-7 AmCDEyF
+#=GC RF  x.xxx.x
+//
+"""
+
+
+def _msa_rows(msa: parsers.Msa):
+  return {description: (sequence, list(deletions)) for
+          sequence, deletions, description in
+          zip(msa.sequences, msa.deletion_matrix, msa.descriptions)}
+
+
+class ParseMsaTest(absltest.TestCase):
+
+  def test_parse_stockholm_deletion_matrix(self):
+    msa = parsers.parse_stockholm(_STOCKHOLM_CHUNK_1)
+    self.assertEqual(['ACDEF', 'ACDE-', '-CDEF'], msa.sequences)
+    self.assertEqual(['query', 'hit1/1-6', 'hit2/2-5'], msa.descriptions)
+    self.assertEqual(np.int32, msa.deletion_matrix.dtype)
+    np.testing.assert_array_equal(
+        [[0, 0, 0, 0, 0], [0, 0, 2, 0, 0], [0, 0, 1, 0, 0]],
+        msa.deletion_matrix)
+
+  def test_parse_a3m_deletion_matrix(self):
+    msa = parsers.parse_a3m('>query\nACDE\n>hit1\naAcC-dE\n>hit2\nACDEkk\n')
+    self.assertEqual(['ACDE', 'AC-E', 'ACDE'], msa.sequences)
+    self.assertEqual(['query', 'hit1', 'hit2'], msa.descriptions)
+    self.assertEqual(np.int32, msa.deletion_matrix.dtype)
+    np.testing.assert_array_equal(
+        [[0, 0, 0, 0], [1, 1, 0, 1], [0, 0, 0, 0]], msa.deletion_matrix)
+
+  def test_parse_a3m_rejects_unaligned_sequences(self):
+    with self.assertRaisesRegex(ValueError, 'same number of aligned residues'):
+      parsers.parse_a3m('>query\nACDE\n>hit1\nACkkD\n')
+
+  def test_parse_a3m_empty(self):
+    msa = parsers.parse_a3m('')
+    self.assertEmpty(msa)
+    self.assertEqual((0, 0), msa.deletion_matrix.shape)
+
+
+class StockholmFileTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    # Two blocks, a duplicate of hit1 that only differs in an insertion, an
+    # empty column and dots in a hit.
+    self.stockholm_msa = (
+        '# STOCKHOLM 1.0\n'
+        '#=GF ID query-i1\n'
+        '#=GS hit1/1-6 DE First hit\n'
+        '#=GS hit2/1-6 DE Duplicate of the first hit\n'
+        '#=GS hit3/2-5 DE Third hit\n'
+        '\n'
+        'query    AC--D\n'
+        'hit1/1-6 ACk-l\n'
+        'hit2/1-6 AC-ml\n'
+        'hit3/2-5 -C-.D\n'
+        '#=GR query PP 99..9\n'
+        '#=GC RF  xx..x\n'
+        '\n'
+        'query    EF\n'
+        'hit1/1-6 E-\n'
+        'hit2/1-6 E-\n'
+        'hit3/2-5 aF\n'
+        '#=GC RF  xx\n'
+        '//\n')
+    self.stockholm_path = self._write('msa.sto', self.stockholm_msa)
+
+  def _write(self, name, contents):
+    path = os.path.join(self.tmp_dir, name)
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def _read(self, path):
+    with open(path) as f:
+      return f.read()
+
+  def test_truncate_stockholm_file(self):
+    output_path = os.path.join(self.tmp_dir, 'truncated.sto')
+    parsers.truncate_stockholm_file(self.stockholm_path, output_path, 2)
+    self.assertEqual(
+        parsers.truncate_stockholm_msa(self.stockholm_path, 2),
+        self._read(output_path))
+
+  def test_deduplicate_stockholm_file(self):
+    output_path = os.path.join(self.tmp_dir, 'deduplicated.sto')
+    parsers.deduplicate_stockholm_file(self.stockholm_path, output_path)
+    deduplicated = self._read(output_path)
+    self.assertEqual(
+        parsers.deduplicate_stockholm_msa(self.stockholm_msa), deduplicated)
+    self.assertEqual(['query', 'hit1/1-6', 'hit3/2-5'],
+                     parsers.parse_stockholm(deduplicated).descriptions)
+
+  def test_remove_empty_columns_from_stockholm_file(self):
+    deduplicated = parsers.deduplicate_stockholm_msa(self.stockholm_msa)
+    input_path = self._write('deduplicated.sto', deduplicated)
+    output_path = os.path.join(self.tmp_dir, 'no_empty_columns.sto')
+    parsers.remove_empty_columns_from_stockholm_file(input_path, output_path)
+    self.assertEqual(
+        parsers.remove_empty_columns_from_stockholm_msa(deduplicated) + '\n',
+        self._read(output_path))
+
+  def test_convert_stockholm_file_to_a3m(self):
+    output_path = os.path.join(self.tmp_dir, 'msa.a3m')
+    for max_sequences in (None, 2):
+      for remove_first_row_gaps in (True, False):
+        parsers.convert_stockholm_file_to_a3m(
+            self.stockholm_path, output_path, max_sequences,
+            remove_first_row_gaps)
+        self.assertEqual(
+            parsers.convert_stockholm_to_a3m(
+                self.stockholm_msa, max_sequences, remove_first_row_gaps),
+            self._read(output_path))
+
+
+class MergeStockholmMsasTest(absltest.TestCase):
+
+  def test_merge_keeps_alignments_and_insertions(self):
+    merged = parsers.merge_stockholm_msas(
+        [_STOCKHOLM_CHUNK_1, _STOCKHOLM_CHUNK_2])
+
+    expected_rows = _msa_rows(parsers.parse_stockholm(_STOCKHOLM_CHUNK_1))
+    expected_rows.update(
+        _msa_rows(parsers.parse_stockholm(_STOCKHOLM_CHUNK_2)))
+    merged_msa = parsers.parse_stockholm(merged)
+    self.assertEqual(
+        ['query', 'hit1/1-6', 'hit2/2-5', 'hit3/1-7'],
+        list(merged_msa.descriptions))
+    self.assertEqual(expected_rows, _msa_rows(merged_msa))
+
+    a3m = parsers.convert_stockholm_to_a3m(merged)
+    self.assertIn('>hit2/2-5 Second hit\n-CaDEF\n', a3m)
+    self.assertIn('>hit3/1-7 Third hit\nAmCDEyF\n', a3m)
+
+  def test_merge_sort_filter_and_truncate(self):
+    e_values = {'hit1/1-6': 2.0, 'hit2/2-5': 0.5, 'hit3/1-7': 1.0}
+    merged = parsers.merge_stockholm_msas(
+        [_STOCKHOLM_CHUNK_1, _STOCKHOLM_CHUNK_2],
+        sort_key=e_values.get,
+        hit_filter=lambda name: name != 'hit2/2-5',
+        max_sequences=2)
+    self.assertEqual(
+        ['query', 'hit3/1-7'],
+        list(parsers.parse_stockholm(merged).descriptions))
+
+  def test_merge_of_empty_msas(self):
+    self.assertEqual('', parsers.merge_stockholm_msas(['', '']))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,10 +14,12 @@
 
 """Functions for building the input features for the AlphaFold model."""
 
+from concurrent import futures
 import os
-from typing import Any, Mapping, MutableMapping, Optional, Sequence, Union
+from typing import Any, Mapping, MutableMapping, Optional, Sequence, Tuple, Union
 from absl import logging
 from alphafold.common import residue_constants
+from alphafold.data import msa_cache as msa_cache_lib
 from alphafold.data import msa_identifiers
 from alphafold.data import parsers
 from alphafold.data import templates
@@ -25,6 +27,7 @@ from alphafold.data.tools import hhblits
 from alphafold.data.tools import hhsearch
 from alphafold.data.tools import hmmsearch
 from alphafold.data.tools import jackhmmer
+from alphafold.data.tools import utils
 import numpy as np
 
 # Internal import (7716).
@@ -50,34 +53,65 @@ def make_sequence_features(
   return features
 
 
+def _make_hhblits_aa_lookup_table() -> np.ndarray:
+  """Returns a table from ASCII codes to HHblits amino acid ids, -1 if none."""
+  lookup_table = np.full(256, -1, dtype=np.int32)
+  for res, res_id in residue_constants.HHBLITS_AA_TO_ID.items():
+    lookup_table[ord(res)] = res_id
+  return lookup_table
+
+
+_HHBLITS_AA_LOOKUP_TABLE = _make_hhblits_aa_lookup_table()
+
+
 def make_msa_features(msas: Sequence[parsers.Msa]) -> FeatureDict:
   """Constructs a feature dict of MSA features."""
   if not msas:
     raise ValueError('At least one MSA must be provided.')
+  for msa_index, msa in enumerate(msas):
+    if not msa:
+      raise ValueError(f'MSA {msa_index} must contain at least one sequence.')
 
+  num_res = len(msas[0].sequences[0])
   int_msa = []
   deletion_matrix = []
   species_ids = []
   seen_sequences = set()
-  for msa_index, msa in enumerate(msas):
-    if not msa:
-      raise ValueError(f'MSA {msa_index} must contain at least one sequence.')
+  for msa in msas:
+    kept_indices = []
     for sequence_index, sequence in enumerate(msa.sequences):
       if sequence in seen_sequences:
         continue
       seen_sequences.add(sequence)
-      int_msa.append(
-          [residue_constants.HHBLITS_AA_TO_ID[res] for res in sequence])
-      deletion_matrix.append(msa.deletion_matrix[sequence_index])
+      kept_indices.append(sequence_index)
       identifiers = msa_identifiers.get_identifiers(
           msa.descriptions[sequence_index])
       species_ids.append(identifiers.species_id.encode('utf-8'))
 
-  num_res = len(msas[0].sequences[0])
-  num_alignments = len(int_msa)
+    if not kept_indices:
+      continue
+
+    # Translate all kept sequences at once with a lookup table on their bytes.
+    kept_sequences = [msa.sequences[i] for i in kept_indices]
+    if any(len(sequence) != num_res for sequence in kept_sequences):
+      raise ValueError(
+          f'All sequences of the MSAs must have length {num_res}.')
+    sequence_bytes = ''.join(kept_sequences).encode('utf-8')
+    int_rows = _HHBLITS_AA_LOOKUP_TABLE[
+        np.frombuffer(sequence_bytes, dtype=np.uint8)]
+    if len(sequence_bytes) != num_res * len(kept_sequences) or np.any(
+        int_rows < 0):
+      raise KeyError(next(res for sequence in kept_sequences
+                          for res in sequence
+                          if res not in residue_constants.HHBLITS_AA_TO_ID))
+    int_msa.append(int_rows.reshape(len(kept_sequences), num_res))
+    deletion_matrix.append(
+        np.asarray(msa.deletion_matrix, dtype=np.int32)[kept_indices])
+
+  num_alignments = len(species_ids)
   features = {}
-  features['deletion_matrix_int'] = np.array(deletion_matrix, dtype=np.int32)
-  features['msa'] = np.array(int_msa, dtype=np.int32)
+  features['deletion_matrix_int'] = np.concatenate(deletion_matrix, axis=0)
+  features['msa'] = np.concatenate(int_msa, axis=0)
   features['num_alignments'] = np.array(
       [num_alignments] * num_res, dtype=np.int32)
   features['msa_species_identifiers'] = np.array(species_ids, dtype=np.object_)
@@ -86,14 +120,33 @@ def make_msa_features(msas: Sequence[parsers.Msa]) -> FeatureDict:
 
 def run_msa_tool(msa_runner, input_fasta_path: str, msa_out_path: str,
                  msa_format: str, use_precomputed_msas: bool,
-                 max_sto_sequences: Optional[int] = None
+                 max_sto_sequences: Optional[int] = None,
+                 msa_cache: Optional[msa_cache_lib.MsaCache] = None
                  ) -> Mapping[str, Any]:
-  """Runs an MSA tool, checking if output already exists first."""
+  """Runs an MSA tool, checking if output already exists first.
+
+  If an MSA cache is given, it is looked up before running the tool and the
+  new MSA is added to it afterwards.
+  """
   if not use_precomputed_msas or not os.path.exists(msa_out_path):
     if msa_format == 'sto' and max_sto_sequences is not None:
-      result = msa_runner.query(input_fasta_path, max_sto_sequences)[0]  # pytype: disable=wrong-arg-count
+      max_sequences = max_sto_sequences
+    else:
+      max_sequences = None
+    cached_msa = None
+    if msa_cache is not None:
+      cached_msa = msa_cache.get(
+          msa_runner, input_fasta_path, msa_format, max_sequences)
+    if cached_msa is not None:
+      result = {msa_format: cached_msa}
     else:
-      result = msa_runner.query(input_fasta_path)[0]
+      if max_sequences is not None:
+        result = msa_runner.query(input_fasta_path, max_sequences)[0]  # pytype: disable=wrong-arg-count
+      else:
+        result = msa_runner.query(input_fasta_path)[0]
+      if msa_cache is not None:
+        msa_cache.put(msa_runner, input_fasta_path, msa_format,
+                      result[msa_format], max_sequences)
     with open(msa_out_path, 'w') as f:
       f.write(result[msa_format])
   else:
@@ -108,6 +161,61 @@ def run_msa_tool(msa_runner, input_fasta_path: str, msa_out_path: str,
   return result
 
 
+def search_msas_batched(
+    msa_runner,
+    queries: Sequence[Tuple[str, str]],
+    use_precomputed_msas: bool,
+    max_sto_sequences: Optional[int] = None,
+    msa_cache: Optional[msa_cache_lib.MsaCache] = None) -> Sequence[str]:
+  """Runs a jackhmmer search for a batch of queries with query_multiple.
+
+  Like run_msa_tool, existing and cached MSAs are used instead of searching.
+
+  Args:
+    msa_runner: The jackhmmer runner.
+    queries: Pairs of the input FASTA path and the Stockholm MSA output path.
+    use_precomputed_msas: Whether to keep existing MSA output files.
+    max_sto_sequences: If set, the maximum number of sequences in each MSA.
+    msa_cache: If set, MSAs are looked up in this cache before searching and
+      new MSAs are added to it.
+
+  Returns:
+    The MSA output paths written.
+  """
+  written_msa_out_paths = []
+  search_queries = []
+  for input_fasta_path, msa_out_path in queries:
+    if use_precomputed_msas and os.path.exists(msa_out_path):
+      logging.warning('Reading MSA from file %s', msa_out_path)
+      continue
+    cached_msa = None
+    if msa_cache is not None:
+      cached_msa = msa_cache.get(
+          msa_runner, input_fasta_path, 'sto', max_sto_sequences)
+    if cached_msa is not None:
+      with open(msa_out_path, 'w') as f:
+        f.write(cached_msa)
+      written_msa_out_paths.append(msa_out_path)
+    else:
+      search_queries.append((input_fasta_path, msa_out_path))
+  if not search_queries:
+    return written_msa_out_paths
+
+  logging.info('Searching %s for %d sequences in one batch.',
+               os.path.basename(msa_runner.database_path), len(search_queries))
+  results = msa_runner.query_multiple(
+      [input_fasta_path for input_fasta_path, _ in search_queries],
+      max_sto_sequences)
+  for (input_fasta_path, msa_out_path), result in zip(search_queries, results):
+    msa = result[0]['sto']
+    if msa_cache is not None:
+      msa_cache.put(msa_runner, input_fasta_path, 'sto', msa, max_sto_sequences)
+    with open(msa_out_path, 'w') as f:
+      f.write(msa)
+    written_msa_out_paths.append(msa_out_path)
+  return written_msa_out_paths
+
+
 class DataPipeline:
   """Runs the alignment tools and assembles the input features."""
 
@@ -124,71 +232,184 @@ class DataPipeline:
                use_small_bfd: bool,
                mgnify_max_hits: int = 501,
                uniref_max_hits: int = 10000,
-               use_precomputed_msas: bool = False):
-    """Initializes the data pipeline."""
+               use_precomputed_msas: bool = False,
+               num_search_workers: int = 1,
+               search_cpu_budget: Optional[int] = None,
+               shared_scan_chunk_size: Optional[int] = None,
+               shared_scan_dir: Optional[str] = None,
+               use_database_shards: bool = False,
+               msa_cache: Optional[msa_cache_lib.MsaCache] = None):
+    """Initializes the data pipeline.
+
+    Args:
+      jackhmmer_binary_path: Location of the jackhmmer binary.
+      hhblits_binary_path: Location of the hhblits binary.
+      uniref90_database_path: Location of the UniRef90 database.
+      mgnify_database_path: Location of the MGnify database.
+      bfd_database_path: Location of the BFD database, used unless
+        use_small_bfd is set.
+      uniref30_database_path: Location of the UniRef30 database, used unless
+        use_small_bfd is set.
+      small_bfd_database_path: Location of the small BFD database, used if
+        use_small_bfd is set.
+      template_searcher: Searcher used to find template hits.
+      template_featurizer: Featurizer used to turn template hits to features.
+      use_small_bfd: Whether to search small BFD with jackhmmer instead of
+        BFD/UniRef30 with HHblits.
+      mgnify_max_hits: The maximum number of hits to keep from MGnify.
+      uniref_max_hits: The maximum number of hits to keep from UniRef90.
+      use_precomputed_msas: Whether to use pre-existing MSAs; see run_alphafold.
+      num_search_workers: The number of MSA database searches to run
+        concurrently. The UniRef90, MGnify and BFD searches are independent of
+        each other; the template search runs after the UniRef90 search in the
+        same worker. With 1 (the default), the searches run one after another.
+      search_cpu_budget: If set, the total number of CPUs to split between the
+        concurrently running MSA tools. This overrides the per-tool defaults.
+      shared_scan_chunk_size: If set, search_msas_batched reads each jackhmmer
+        database only once, in chunks of about this many bytes, for all the
+        queries of a batch. See jackhmmer.Jackhmmer.
+      shared_scan_dir: Directory for the database chunks of a shared scan.
+      use_database_shards: Whether to search the shards of the jackhmmer
+        databases written by scripts/shard_database.py in parallel instead of
+        the databases themselves. See jackhmmer.Jackhmmer.
+      msa_cache: If set, MSAs are looked up in this cache before searching and
+        new MSAs are added to it.
+    """
+    if num_search_workers < 1:
+      raise ValueError(
+          f'num_search_workers must be at least 1, got {num_search_workers}.')
     self._use_small_bfd = use_small_bfd
     self.jackhmmer_uniref90_runner = jackhmmer.Jackhmmer(
         binary_path=jackhmmer_binary_path,
-        database_path=uniref90_database_path)
+        database_path=uniref90_database_path,
+        shared_scan_chunk_size=shared_scan_chunk_size,
+        shared_scan_dir=shared_scan_dir,
+        use_database_shards=use_database_shards)
     if use_small_bfd:
       self.jackhmmer_small_bfd_runner = jackhmmer.Jackhmmer(
           binary_path=jackhmmer_binary_path,
-          database_path=small_bfd_database_path)
+          database_path=small_bfd_database_path,
+          shared_scan_chunk_size=shared_scan_chunk_size,
+          shared_scan_dir=shared_scan_dir,
+          use_database_shards=use_database_shards)
     else:
       self.hhblits_bfd_uniref_runner = hhblits.HHBlits(
           binary_path=hhblits_binary_path,
           databases=[bfd_database_path, uniref30_database_path])
     self.jackhmmer_mgnify_runner = jackhmmer.Jackhmmer(
         binary_path=jackhmmer_binary_path,
-        database_path=mgnify_database_path)
+        database_path=mgnify_database_path,
+        shared_scan_chunk_size=shared_scan_chunk_size,
+        shared_scan_dir=shared_scan_dir,
+        use_database_shards=use_database_shards)
     self.template_searcher = template_searcher
     self.template_featurizer = template_featurizer
     self.mgnify_max_hits = mgnify_max_hits
     self.uniref_max_hits = uniref_max_hits
     self.use_precomputed_msas = use_precomputed_msas
+    self.msa_cache = msa_cache
+    self._num_search_workers = num_search_workers
+    if search_cpu_budget is not None:
+      self._split_search_cpu_budget(search_cpu_budget)
+    # MSA output paths written by search_msas_batched.
+    self._batched_msa_out_paths = set()
 
-  def process(self, input_fasta_path: str, msa_output_dir: str) -> FeatureDict:
-    """Runs alignment tools on the input sequence and creates features."""
-    with open(input_fasta_path) as f:
-      input_fasta_str = f.read()
-    input_seqs, input_descs = parsers.parse_fasta(input_fasta_str)
-    if len(input_seqs) != 1:
-      raise ValueError(
-          f'More than one input sequence found in {input_fasta_path}.')
-    input_sequence = input_seqs[0]
-    input_description = input_descs[0]
-    num_res = len(input_sequence)
+  def _use_precomputed_msa(self, msa_out_path: str) -> bool:
+    """Whether to read the MSA at msa_out_path instead of searching."""
+    return (self.use_precomputed_msas or
+            msa_out_path in self._batched_msa_out_paths)
 
+  def search_msas_batched(self,
+                          input_fasta_paths: Sequence[str],
+                          msa_output_dirs: Sequence[str]):
+    """Runs the jackhmmer searches for a batch of sequences together.
+
+    Each jackhmmer database is searched once for all the sequences, see the
+    shared_scan_chunk_size argument. The MSAs are written to the MSA output
+    directories, and `process` then reads them from there instead of searching
+    again.
+
+    Args:
+      input_fasta_paths: FASTA files with a single sequence each.
+      msa_output_dirs: The MSA output directory of each of the sequences.
+    """
+    if len(input_fasta_paths) != len(msa_output_dirs):
+      raise ValueError('input_fasta_paths and msa_output_dirs must have equal '
+                       f'length. Got {len(input_fasta_paths)} != '
+                       f'{len(msa_output_dirs)}.')
+    searches = [
+        (self.jackhmmer_uniref90_runner, 'uniref90_hits.sto',
+         self.uniref_max_hits),
+        (self.jackhmmer_mgnify_runner, 'mgnify_hits.sto',
+         self.mgnify_max_hits),
+    ]
+    if self._use_small_bfd:
+      searches.append(
+          (self.jackhmmer_small_bfd_runner, 'small_bfd_hits.sto', None))
+
+    for msa_runner, msa_out_name, max_sto_sequences in searches:
+      queries = [
+          (input_fasta_path, os.path.join(msa_output_dir, msa_out_name))
+          for input_fasta_path, msa_output_dir in zip(
+              input_fasta_paths, msa_output_dirs)]
+      self._batched_msa_out_paths.update(search_msas_batched(
+          msa_runner, queries, self.use_precomputed_msas, max_sto_sequences,
+          self.msa_cache))
+
+  def _split_search_cpu_budget(self, search_cpu_budget: int):
+    """Splits the CPU budget between the MSA tools that can run together."""
+    if self._use_small_bfd:
+      bfd_runner = self.jackhmmer_small_bfd_runner
+    else:
+      bfd_runner = self.hhblits_bfd_uniref_runner
+    msa_runners = (self.jackhmmer_uniref90_runner,
+                   self.jackhmmer_mgnify_runner,
+                   bfd_runner)
+    num_concurrent = min(self._num_search_workers, len(msa_runners))
+    n_cpu = max(1, search_cpu_budget // num_concurrent)
+    logging.info('Giving %d CPUs to each of %d concurrent MSA searches.',
+                 n_cpu, num_concurrent)
+    for msa_runner in msa_runners:
+      msa_runner.n_cpu = n_cpu
+
+  def _search_uniref90_and_templates(
+      self,
+      input_fasta_path: str,
+      input_sequence: str,
+      msa_output_dir: str) -> Tuple[parsers.Msa,
+                                    Sequence[parsers.TemplateHit]]:
+    """Searches UniRef90 and then PDB templates with the UniRef90 MSA."""
     uniref90_out_path = os.path.join(msa_output_dir, 'uniref90_hits.sto')
     jackhmmer_uniref90_result = run_msa_tool(
         msa_runner=self.jackhmmer_uniref90_runner,
         input_fasta_path=input_fasta_path,
         msa_out_path=uniref90_out_path,
         msa_format='sto',
-        use_precomputed_msas=self.use_precomputed_msas,
-        max_sto_sequences=self.uniref_max_hits)
-    mgnify_out_path = os.path.join(msa_output_dir, 'mgnify_hits.sto')
-    jackhmmer_mgnify_result = run_msa_tool(
-        msa_runner=self.jackhmmer_mgnify_runner,
-        input_fasta_path=input_fasta_path,
-        msa_out_path=mgnify_out_path,
-        msa_format='sto',
-        use_precomputed_msas=self.use_precomputed_msas,
-        max_sto_sequences=self.mgnify_max_hits)
-
-    msa_for_templates = jackhmmer_uniref90_result['sto']
-    msa_for_templates = parsers.deduplicate_stockholm_msa(msa_for_templates)
-    msa_for_templates = parsers.remove_empty_columns_from_stockholm_msa(
-        msa_for_templates)
-
-    if self.template_searcher.input_format == 'sto':
-      pdb_templates_result = self.template_searcher.query(msa_for_templates)
-    elif self.template_searcher.input_format == 'a3m':
-      uniref90_msa_as_a3m = parsers.convert_stockholm_to_a3m(msa_for_templates)
-      pdb_templates_result = self.template_searcher.query(uniref90_msa_as_a3m)
-    else:
+        use_precomputed_msas=self._use_precomputed_msa(uniref90_out_path),
+        max_sto_sequences=self.uniref_max_hits,
+        msa_cache=self.msa_cache)
+
+    if self.template_searcher.input_format not in ('sto', 'a3m'):
       raise ValueError('Unrecognized template input format: '
                        f'{self.template_searcher.input_format}')
+    # The MSA for the template search is prepared file to file, so that the
+    # intermediate MSAs are never held in memory as a whole.
+    with utils.tmpdir_manager() as query_tmp_dir:
+      truncated_path = os.path.join(query_tmp_dir, 'truncated.sto')
+      deduplicated_path = os.path.join(query_tmp_dir, 'deduplicated.sto')
+      msa_for_templates_path = os.path.join(query_tmp_dir, 'templates.sto')
+      parsers.truncate_stockholm_file(
+          uniref90_out_path, truncated_path, self.uniref_max_hits)
+      parsers.deduplicate_stockholm_file(truncated_path, deduplicated_path)
+      parsers.remove_empty_columns_from_stockholm_file(
+          deduplicated_path, msa_for_templates_path)
+      if self.template_searcher.input_format == 'a3m':
+        uniref90_a3m_path = os.path.join(query_tmp_dir, 'templates.a3m')
+        parsers.convert_stockholm_file_to_a3m(
+            msa_for_templates_path, uniref90_a3m_path)
+        msa_for_templates_path = uniref90_a3m_path
+      with open(msa_for_templates_path) as f:
+        pdb_templates_result = self.template_searcher.query(f.read())
 
     pdb_hits_out_path = os.path.join(
         msa_output_dir, f'pdb_hits.{self.template_searcher.output_format}')
@@ -196,11 +417,27 @@ class DataPipeline:
       f.write(pdb_templates_result)
 
     uniref90_msa = parsers.parse_stockholm(jackhmmer_uniref90_result['sto'])
-    mgnify_msa = parsers.parse_stockholm(jackhmmer_mgnify_result['sto'])
-
     pdb_template_hits = self.template_searcher.get_template_hits(
         output_string=pdb_templates_result, input_sequence=input_sequence)
+    return uniref90_msa, pdb_template_hits
 
+  def _search_mgnify(self, input_fasta_path: str,
+                     msa_output_dir: str) -> parsers.Msa:
+    """Searches MGnify with jackhmmer."""
+    mgnify_out_path = os.path.join(msa_output_dir, 'mgnify_hits.sto')
+    jackhmmer_mgnify_result = run_msa_tool(
+        msa_runner=self.jackhmmer_mgnify_runner,
+        input_fasta_path=input_fasta_path,
+        msa_out_path=mgnify_out_path,
+        msa_format='sto',
+        use_precomputed_msas=self._use_precomputed_msa(mgnify_out_path),
+        max_sto_sequences=self.mgnify_max_hits,
+        msa_cache=self.msa_cache)
+    return parsers.parse_stockholm(jackhmmer_mgnify_result['sto'])
+
+  def _search_bfd(self, input_fasta_path: str,
+                  msa_output_dir: str) -> parsers.Msa:
+    """Searches either small BFD with jackhmmer or BFD/UniRef30 with HHblits."""
     if self._use_small_bfd:
       bfd_out_path = os.path.join(msa_output_dir, 'small_bfd_hits.sto')
       jackhmmer_small_bfd_result = run_msa_tool(
@@ -208,8 +445,9 @@ class DataPipeline:
           input_fasta_path=input_fasta_path,
           msa_out_path=bfd_out_path,
           msa_format='sto',
-          use_precomputed_msas=self.use_precomputed_msas)
-      bfd_msa = parsers.parse_stockholm(jackhmmer_small_bfd_result['sto'])
+          use_precomputed_msas=self._use_precomputed_msa(bfd_out_path),
+          msa_cache=self.msa_cache)
+      return parsers.parse_stockholm(jackhmmer_small_bfd_result['sto'])
     else:
       bfd_out_path = os.path.join(msa_output_dir, 'bfd_uniref_hits.a3m')
       hhblits_bfd_uniref_result = run_msa_tool(
@@ -217,8 +455,37 @@ class DataPipeline:
           input_fasta_path=input_fasta_path,
           msa_out_path=bfd_out_path,
           msa_format='a3m',
-          use_precomputed_msas=self.use_precomputed_msas)
-      bfd_msa = parsers.parse_a3m(hhblits_bfd_uniref_result['a3m'])
+          use_precomputed_msas=self.use_precomputed_msas,
+          msa_cache=self.msa_cache)
+      return parsers.parse_a3m(hhblits_bfd_uniref_result['a3m'])
+
+  def process(self, input_fasta_path: str, msa_output_dir: str) -> FeatureDict:
+    """Runs alignment tools on the input sequence and creates features."""
+    with open(input_fasta_path) as f:
+      input_fasta_str = f.read()
+    input_seqs, input_descs = parsers.parse_fasta(input_fasta_str)
+    if len(input_seqs) != 1:
+      raise ValueError(
+          f'More than one input sequence found in {input_fasta_path}.')
+    input_sequence = input_seqs[0]
+    input_description = input_descs[0]
+    num_res = len(input_sequence)
+
+    # The searches are independent of each other, except for the template
+    # search which needs the UniRef90 MSA. With a single worker they run one
+    # after another.
+    with futures.ThreadPoolExecutor(
+        max_workers=self._num_search_workers) as executor:
+      uniref90_future = executor.submit(
+          self._search_uniref90_and_templates,
+          input_fasta_path, input_sequence, msa_output_dir)
+      mgnify_future = executor.submit(
+          self._search_mgnify, input_fasta_path, msa_output_dir)
+      bfd_future = executor.submit(
+          self._search_bfd, input_fasta_path, msa_output_dir)
+      uniref90_msa, pdb_template_hits = uniref90_future.result()
+      mgnify_msa = mgnify_future.result()
+      bfd_msa = bfd_future.result()
 
     templates_result = self.template_featurizer.get_templates(
         query_sequence=input_sequence,
@@ -21,12 +21,13 @@ import dataclasses
 import json
 import os
 import tempfile
-from typing import Mapping, MutableMapping, Sequence
+from typing import Mapping, MutableMapping, Optional, Sequence
 
 from absl import logging
 from alphafold.common import protein
 from alphafold.common import residue_constants
 from alphafold.data import feature_processing
+from alphafold.data import msa_cache as msa_cache_lib
 from alphafold.data import msa_pairing
 from alphafold.data import parsers
 from alphafold.data import pipeline
@@ -175,7 +176,11 @@ class DataPipeline:
                jackhmmer_binary_path: str,
                uniprot_database_path: str,
                max_uniprot_hits: int = 50000,
-               use_precomputed_msas: bool = False):
+               use_precomputed_msas: bool = False,
+               shared_scan_chunk_size: Optional[int] = None,
+               shared_scan_dir: Optional[str] = None,
+               use_database_shards: bool = False,
+               msa_cache: Optional[msa_cache_lib.MsaCache] = None):
     """Initializes the data pipeline.
 
     Args:
@@ -186,13 +191,86 @@ class DataPipeline:
         will be searched with jackhmmer and used for MSA pairing.
       max_uniprot_hits: The maximum number of hits to return from uniprot.
       use_precomputed_msas: Whether to use pre-existing MSAs; see run_alphafold.
+      shared_scan_chunk_size: If set, search_msas_batched reads the uniprot
+        database only once, in chunks of about this many bytes, for all the
+        chains of a batch. See jackhmmer.Jackhmmer.
+      shared_scan_dir: Directory for the database chunks of a shared scan.
+      use_database_shards: Whether to search the shards of the uniprot database
+        written by scripts/shard_database.py in parallel instead of the
+        database itself. See jackhmmer.Jackhmmer.
+      msa_cache: If set, uniprot MSAs are looked up in this cache before
+        searching and new MSAs are added to it. The MSAs of the monomer
+        pipeline use the cache of monomer_data_pipeline.
     """
     self._monomer_data_pipeline = monomer_data_pipeline
     self._uniprot_msa_runner = jackhmmer.Jackhmmer(
         binary_path=jackhmmer_binary_path,
-        database_path=uniprot_database_path)
+        database_path=uniprot_database_path,
+        shared_scan_chunk_size=shared_scan_chunk_size,
+        shared_scan_dir=shared_scan_dir,
+        use_database_shards=use_database_shards)
     self._max_uniprot_hits = max_uniprot_hits
     self.use_precomputed_msas = use_precomputed_msas
+    self.msa_cache = msa_cache
+    # MSA output paths written by search_msas_batched.
+    self._batched_msa_out_paths = set()
+
+  def search_msas_batched(self,
+                          input_fasta_paths: Sequence[str],
+                          msa_output_dirs: Sequence[str]):
+    """Runs the jackhmmer searches for the chains of a batch of inputs together.
+
+    See pipeline.DataPipeline.search_msas_batched. The MSAs are written to the
+    per-chain MSA output directories used by `process`.
+
+    Args:
+      input_fasta_paths: FASTA files with the sequences of each input.
+      msa_output_dirs: The MSA output directory of each of the inputs.
+    """
+    if len(input_fasta_paths) != len(msa_output_dirs):
+      raise ValueError('input_fasta_paths and msa_output_dirs must have equal '
+                       f'length. Got {len(input_fasta_paths)} != '
+                       f'{len(msa_output_dirs)}.')
+    with tempfile.TemporaryDirectory() as chain_fasta_dir:
+      chain_fasta_paths = []
+      chain_msa_output_dirs = []
+      pairing_chain_indices = []
+      for input_fasta_path, msa_output_dir in zip(
+          input_fasta_paths, msa_output_dirs):
+        with open(input_fasta_path) as f:
+          input_seqs, input_descs = parsers.parse_fasta(f.read())
+        chain_id_map = _make_chain_id_map(sequences=input_seqs,
+                                          descriptions=input_descs)
+        is_homomer_or_monomer = len(set(input_seqs)) == 1
+        seen_sequences = set()
+        for chain_id, fasta_chain in chain_id_map.items():
+          # Only the first chain with each sequence is searched, see process.
+          if fasta_chain.sequence in seen_sequences:
+            continue
+          seen_sequences.add(fasta_chain.sequence)
+          chain_msa_output_dir = os.path.join(msa_output_dir, chain_id)
+          if not os.path.exists(chain_msa_output_dir):
+            os.makedirs(chain_msa_output_dir)
+          chain_fasta_path = os.path.join(
+              chain_fasta_dir, f'{len(chain_fasta_paths)}.fasta')
+          with open(chain_fasta_path, 'w') as f:
+            f.write(f'>chain_{chain_id}\n{fasta_chain.sequence}\n')
+          if not is_homomer_or_monomer:
+            pairing_chain_indices.append(len(chain_fasta_paths))
+          chain_fasta_paths.append(chain_fasta_path)
+          chain_msa_output_dirs.append(chain_msa_output_dir)
+
+      self._monomer_data_pipeline.search_msas_batched(
+          chain_fasta_paths, chain_msa_output_dirs)
+
+      queries = [
+          (chain_fasta_paths[chain_index],
+           os.path.join(chain_msa_output_dirs[chain_index], 'uniprot_hits.sto'))
+          for chain_index in pairing_chain_indices]
+      self._batched_msa_out_paths.update(pipeline.search_msas_batched(
+          self._uniprot_msa_runner, queries, self.use_precomputed_msas,
+          max_sto_sequences=self._max_uniprot_hits,
+          msa_cache=self.msa_cache))
 
   def _process_single_chain(
       self,
@@ -224,11 +302,14 @@ class DataPipeline:
   def _all_seq_msa_features(self, input_fasta_path, msa_output_dir):
     """Get MSA features for unclustered uniprot, for pairing."""
     out_path = os.path.join(msa_output_dir, 'uniprot_hits.sto')
+    # Only the first max_uniprot_hits sequences are read from the Stockholm
+    # file, so the full uniprot MSA is never held in memory.
     result = pipeline.run_msa_tool(
         self._uniprot_msa_runner, input_fasta_path, out_path, 'sto',
-        self.use_precomputed_msas)
+        self.use_precomputed_msas or out_path in self._batched_msa_out_paths,
+        max_sto_sequences=self._max_uniprot_hits,
+        msa_cache=self.msa_cache)
     msa = parsers.parse_stockholm(result['sto'])
-    msa = msa.truncate(max_seqs=self._max_uniprot_hits)
     all_seq_features = pipeline.make_msa_features([msa])
     valid_feats = msa_pairing.MSA_FEATURES + (
         'msa_species_identifiers',
@@ -0,0 +1,308 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A memory-mapped store of pre-parsed template structures.
+
+The store holds what template featurization needs from each mmCIF file: the
+release date, the seqres of every chain and the atom37 positions and masks of
+every chain. It is built once from the mmCIF mirror (see
+scripts/build_template_store.py) and read by slicing memory-mapped arrays, so
+that template hits do not have to be parsed from mmCIF for every target.
+
+Layout of a store directory:
+  metadata.json: The format version and the numbers of entries and chains.
+  entry_*.npy: Per-entry arrays, sorted by file ID.
+  chain_*.npy: Per-chain arrays, grouped by entry.
+  seqres.bin: The concatenated seqres of all chains.
+  atom_mask.bin: The atom37 masks of all residues, packed to 5 bytes each.
+  atom_positions.bin: float32 positions of the atoms present in the masks.
+  errors.pkl: Parsing and atom extraction errors, for the few entries with
+    errors, so that they can be reported as when parsing the mmCIF files.
+"""
+
+import dataclasses
+import functools
+import json
+import os
+import pickle
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from alphafold.common import residue_constants
+import numpy as np
+
+_FORMAT_VERSION = 1
+_PACKED_MASK_BYTES = (residue_constants.atom_type_num + 7) // 8
+
+
+@dataclasses.dataclass(frozen=True)
+class TemplateChain:
+  """A chain of a template structure.
+
+  Contains:
+    chain_id: The author chain ID.
+    seqres: The seqres sequence of the chain.
+    atom_positions: float32 [num_res, 37, 3] atom positions, None if they
+      could not be extracted.
+    atom_mask: bool [num_res, 37] atom mask, None if the atom positions could
+      not be extracted.
+    error: The exception raised when extracting the atom positions, if any.
+  """
+  chain_id: str
+  seqres: str
+  atom_positions: Optional[np.ndarray]
+  atom_mask: Optional[np.ndarray]
+  error: Optional[Exception] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class TemplateStoreEntry:
+  """A pre-parsed template structure.
+
+  Contains:
+    file_id: The ID of the mmCIF file, i.e. the lowercase PDB ID.
+    has_structure: Whether any chain of the mmCIF file could be parsed.
+    release_date: The release date in YYYY-MM-DD format, None if unknown.
+    parsing_errors: The errors of parsing the mmCIF file.
+    chains: The chains of the structure.
+  """
+  file_id: str
+  has_structure: bool
+  release_date: Optional[str]
+  parsing_errors: Mapping[Tuple[str, str], Any]
+  chains: Sequence[TemplateChain]
+
+
+class StoredTemplate:
+  """A template structure read from a TemplateStore."""
+
+  def __init__(self, store: 'TemplateStore', entry_index: int):
+    self._store = store
+    self.file_id = str(store.entry_ids[entry_index])
+    self.has_structure = bool(store.entry_has_structure[entry_index])
+    release_date = str(store.entry_release_dates[entry_index])
+    self.release_date = release_date or None
+    parsing_errors, self._chain_errors = store.errors.get(
+        self.file_id, ({}, {}))
+    self.parsing_errors = parsing_errors
+
+    chain_start = store.entry_chain_start[entry_index]
+    chain_end = store.entry_chain_start[entry_index + 1]
+    self._chain_indices = {}
+    self.chain_to_seqres = {}
+    for chain_index in range(chain_start, chain_end):
+      chain_id = str(store.chain_ids[chain_index])
+      self._chain_indices[chain_id] = chain_index
+      seqres = store.seqres[store.chain_seqres_start[chain_index]:
+                            store.chain_seqres_start[chain_index + 1]]
+      self.chain_to_seqres[chain_id] = seqres.tobytes().decode('ascii')
+
+  def atom_positions(self, chain_id: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the atom37 positions and mask of a chain.
+
+    The arrays are the same as those extracted from the Biopython structure,
+    before the check of the CA-CA distances.
+
+    Args:
+      chain_id: The author chain ID.
+
+    Returns:
+      A tuple of float64 [num_res, 37, 3] atom positions and int64 [num_res,
+      37] atom mask.
+
+    Raises:
+      KeyError: If the structure has no chain with this ID.
+      Exception: The error raised when the atom positions were extracted from
+        the mmCIF file, if any.
+    """
+    chain_index = self._chain_indices[chain_id]
+    if chain_id in self._chain_errors:
+      raise self._chain_errors[chain_id]
+    store = self._store
+    packed_mask = store.atom_mask[store.chain_residue_start[chain_index]:
+                                  store.chain_residue_start[chain_index + 1]]
+    mask = np.unpackbits(
+        packed_mask, axis=1,
+        count=residue_constants.atom_type_num).astype(bool)
+    positions = np.zeros(mask.shape + (3,))
+    positions[mask] = store.atom_positions[
+        store.chain_atom_start[chain_index]:
+        store.chain_atom_start[chain_index + 1]]
+    return positions, mask.astype(np.int64)
+
+
+class TemplateStore:
+  """Read access to a template store directory."""
+
+  def __init__(self, store_dir: str):
+    self.store_dir = store_dir
+    with open(os.path.join(store_dir, 'metadata.json')) as f:
+      metadata = json.load(f)
+    if metadata['version'] != _FORMAT_VERSION:
+      raise ValueError(
+          f'Unsupported template store version {metadata["version"]} in '
+          f'{store_dir}, expected {_FORMAT_VERSION}. Rebuild the store.')
+    self.num_entries = metadata['num_entries']
+
+    def load(name):
+      return np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r')
+
+    self.entry_ids = load('entry_ids')
+    self.entry_has_structure = load('entry_has_structure')
+    self.entry_release_dates = load('entry_release_dates')
+    self.entry_chain_start = load('entry_chain_start')
+    self.chain_ids = load('chain_ids')
+    self.chain_seqres_start = load('chain_seqres_start')
+    self.chain_residue_start = load('chain_residue_start')
+    self.chain_atom_start = load('chain_atom_start')
+
+    self.seqres = self._memmap('seqres.bin', np.uint8, ())
+    self.atom_mask = self._memmap(
+        'atom_mask.bin', np.uint8, (_PACKED_MASK_BYTES,))
+    self.atom_positions = self._memmap('atom_positions.bin', np.float32, (3,))
+    with open(os.path.join(store_dir, 'errors.pkl'), 'rb') as f:
+      self.errors = pickle.load(f)
+
+  def _memmap(self, name: str, dtype, row_shape: Tuple[int, ...]) -> np.ndarray:
+    path = os.path.join(self.store_dir, name)
+    row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+    num_rows = os.path.getsize(path) // row_bytes
+    if not num_rows:
+      # Empty files can not be memory-mapped.
+      return np.zeros((0,) + row_shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r',
+                     shape=(num_rows,) + row_shape)
+
+  def __contains__(self, file_id: str) -> bool:
+    return self._entry_index(file_id) is not None
+
+  def __len__(self) -> int:
+    return self.num_entries
+
+  def _entry_index(self, file_id: str) -> Optional[int]:
+    index = int(np.searchsorted(self.entry_ids, file_id))
+    if index < self.num_entries and self.entry_ids[index] == file_id:
+      return index
+    return None
+
+  def get(self, file_id: str) -> Optional[StoredTemplate]:
+    """Returns the template structure with this file ID, None if not stored."""
+    entry_index = self._entry_index(file_id)
+    if entry_index is None:
+      return None
+    return StoredTemplate(self, entry_index)
+
+
+@functools.lru_cache(maxsize=None)
+def open_store(store_dir: str) -> TemplateStore:
+  """Returns a TemplateStore, opened once per process and store directory."""
+  return TemplateStore(store_dir)
+
+
+class TemplateStoreWriter:
+  """Writes a template store directory, one entry at a time.
+
+  Entries must be added in increasing order of their file IDs. Only the small
+  per-entry and per-chain index arrays are kept in memory, the sequences and
+  atom data are appended to the store files as the entries are added.
+  """
+
+  def __init__(self, store_dir: str):
+    self.store_dir = store_dir
+    os.makedirs(store_dir, exist_ok=True)
+    self._seqres_file = open(os.path.join(store_dir, 'seqres.bin'), 'wb')
+    self._atom_mask_file = open(os.path.join(store_dir, 'atom_mask.bin'), 'wb')
+    self._atom_positions_file = open(
+        os.path.join(store_dir, 'atom_positions.bin'), 'wb')
+    self._entry_ids: List[str] = []
+    self._entry_has_structure: List[bool] = []
+    self._entry_release_dates: List[str] = []
+    self._entry_chain_start = [0]
+    self._chain_ids: List[str] = []
+    self._chain_seqres_start = [0]
+    self._chain_residue_start = [0]
+    self._chain_atom_start = [0]
+    self._errors: Dict[str, Tuple[Mapping[Tuple[str, str], Any],
+                                  Dict[str, Exception]]] = {}
+
+  def add(self, entry: TemplateStoreEntry):
+    """Appends an entry to the store."""
+    if self._entry_ids and entry.file_id <= self._entry_ids[-1]:
+      raise ValueError(
+          f'Entries must be added in increasing order of their file IDs, got '
+          f'{entry.file_id} after {self._entry_ids[-1]}.')
+    chain_errors = {}
+    for chain in entry.chains:
+      seqres = chain.seqres.encode('ascii')
+      self._seqres_file.write(seqres)
+      num_res = 0
+      num_atoms = 0
+      if chain.error is not None:
+        chain_errors[chain.chain_id] = chain.error
+      else:
+        mask = np.asarray(chain.atom_mask, dtype=bool)
+        num_res = mask.shape[0]
+        num_atoms = int(mask.sum())
+        self._atom_mask_file.write(np.packbits(mask, axis=1).tobytes())
+        self._atom_positions_file.write(np.asarray(
+            chain.atom_positions, dtype=np.float32)[mask].tobytes())
+      self._chain_ids.append(chain.chain_id)
+      self._chain_seqres_start.append(
+          self._chain_seqres_start[-1] + len(seqres))
+      self._chain_residue_start.append(self._chain_residue_start[-1] + num_res)
+      self._chain_atom_start.append(self._chain_atom_start[-1] + num_atoms)
+
+    self._entry_ids.append(entry.file_id)
+    self._entry_has_structure.append(entry.has_structure)
+    self._entry_release_dates.append(entry.release_date or '')
+    self._entry_chain_start.append(len(self._chain_ids))
+    if entry.parsing_errors or chain_errors:
+      self._errors[entry.file_id] = (dict(entry.parsing_errors), chain_errors)
+
+  def close(self):
+    """Writes the index of the store and closes its files."""
+    self._seqres_file.close()
+    self._atom_mask_file.close()
+    self._atom_positions_file.close()
+
+    def save(name, values, dtype=None):
+      np.save(os.path.join(self.store_dir, f'{name}.npy'),
+              np.array(values, dtype=dtype))
+
+    # Unicode arrays of IDs can be searched without decoding them.
+    save('entry_ids', self._entry_ids, dtype=str)
+    save('entry_has_structure', self._entry_has_structure, dtype=bool)
+    save('entry_release_dates', self._entry_release_dates, dtype=str)
+    save('entry_chain_start', self._entry_chain_start, dtype=np.int64)
+    save('chain_ids', self._chain_ids, dtype=str)
+    save('chain_seqres_start', self._chain_seqres_start, dtype=np.int64)
+    save('chain_residue_start', self._chain_residue_start, dtype=np.int64)
+    save('chain_atom_start', self._chain_atom_start, dtype=np.int64)
+    with open(os.path.join(self.store_dir, 'errors.pkl'), 'wb') as f:
+      pickle.dump(self._errors, f)
+    # The metadata is written last and marks the store as complete.
+    with open(os.path.join(self.store_dir, 'metadata.json'), 'w') as f:
+      json.dump({'version': _FORMAT_VERSION,
+                 'num_entries': len(self._entry_ids),
+                 'num_chains': len(self._chain_ids)}, f, indent=2)
+
+  def __enter__(self) -> 'TemplateStoreWriter':
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self._seqres_file.close()
+      self._atom_mask_file.close()
+      self._atom_positions_file.close()
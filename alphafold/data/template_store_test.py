@@ -0,0 +1,100 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for template_store."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from alphafold.data import template_store
+import numpy as np
+
+
+def _random_chain(chain_id, seqres, seed):
+  rng = np.random.default_rng(seed)
+  num_res = len(seqres)
+  mask = rng.random((num_res, 37)) < 0.3
+  positions = np.where(
+      mask[..., None], rng.normal(size=(num_res, 37, 3)), 0).astype(np.float32)
+  return template_store.TemplateChain(
+      chain_id=chain_id, seqres=seqres, atom_positions=positions,
+      atom_mask=mask)
+
+
+class TemplateStoreTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.store_dir = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), 'store')
+    self.chains = [_random_chain('A', 'ACDEFG', 0),
+                   _random_chain('BB', 'MKV', 1)]
+    entries = [
+        template_store.TemplateStoreEntry(
+            file_id='1abc', has_structure=True, release_date='2001-02-03',
+            parsing_errors={}, chains=self.chains + [
+                template_store.TemplateChain(
+                    chain_id='C', seqres='GG', atom_positions=None,
+                    atom_mask=None, error=KeyError('C'))]),
+        template_store.TemplateStoreEntry(
+            file_id='2xyz', has_structure=False, release_date=None,
+            parsing_errors={('2xyz', ''): ValueError('bad')}, chains=()),
+    ]
+    with template_store.TemplateStoreWriter(self.store_dir) as writer:
+      for entry in entries:
+        writer.add(entry)
+
+  def test_round_trip(self):
+    store = template_store.TemplateStore(self.store_dir)
+    self.assertLen(store, 2)
+    self.assertNotIn('1xyz', store)
+    self.assertIsNone(store.get('9zzz'))
+
+    stored = store.get('1abc')
+    self.assertTrue(stored.has_structure)
+    self.assertEqual('2001-02-03', stored.release_date)
+    self.assertEqual({'A': 'ACDEFG', 'BB': 'MKV', 'C': 'GG'},
+                     stored.chain_to_seqres)
+    for chain in self.chains:
+      positions, mask = stored.atom_positions(chain.chain_id)
+      self.assertEqual(np.float64, positions.dtype)
+      self.assertEqual(np.int64, mask.dtype)
+      np.testing.assert_array_equal(chain.atom_positions, positions)
+      np.testing.assert_array_equal(chain.atom_mask, mask)
+    with self.assertRaisesRegex(KeyError, 'C'):
+      stored.atom_positions('C')
+    with self.assertRaises(KeyError):
+      stored.atom_positions('D')
+
+    stored = store.get('2xyz')
+    self.assertFalse(stored.has_structure)
+    self.assertIsNone(stored.release_date)
+    self.assertEqual({}, stored.chain_to_seqres)
+    self.assertEqual([('2xyz', '')], list(stored.parsing_errors))
+
+  def test_entries_must_be_sorted(self):
+    with template_store.TemplateStoreWriter(
+        os.path.join(self.store_dir, 'unsorted')) as writer:
+      writer.add(template_store.TemplateStoreEntry(
+          file_id='2xyz', has_structure=False, release_date=None,
+          parsing_errors={}, chains=()))
+      with self.assertRaises(ValueError):
+        writer.add(template_store.TemplateStoreEntry(
+            file_id='1abc', has_structure=False, release_date=None,
+            parsing_errors={}, chains=()))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -14,18 +14,25 @@
 
 """Functions for getting templates and calculating template features."""
 import abc
+import collections
+from concurrent import futures
+import contextlib
 import dataclasses
 import datetime
 import functools
 import glob
+import itertools
+import multiprocessing
 import os
 import re
-from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+import threading
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Sequence, Tuple
 
 from absl import logging
 from alphafold.common import residue_constants
 from alphafold.data import mmcif_parsing
 from alphafold.data import parsers
+from alphafold.data import template_store
 from alphafold.data.tools import kalign
 import numpy as np
 
@@ -427,10 +434,9 @@ def _check_residue_distances(all_positions: np.ndarray,
     prev_is_unmasked = this_is_unmasked
 
 
-def _get_atom_positions(
+def _get_atom37(
     mmcif_object: mmcif_parsing.MmcifObject,
-    auth_chain_id: str,
-    max_ca_ca_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    auth_chain_id: str) -> Tuple[np.ndarray, np.ndarray]:
   """Gets atom positions and mask from a list of Biopython Residues."""
   num_res = len(mmcif_object.chain_to_seqres[auth_chain_id])
 
@@ -478,11 +484,62 @@ def _get_atom_positions(
 
     all_positions[res_index] = pos
     all_positions_mask[res_index] = mask
+  return all_positions, all_positions_mask
+
+
+def _get_atom_positions(
+    mmcif_object: mmcif_parsing.MmcifObject,
+    auth_chain_id: str,
+    max_ca_ca_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+  """Gets atom positions and mask, checking the CA-CA distances."""
+  all_positions, all_positions_mask = _get_atom37(mmcif_object, auth_chain_id)
   _check_residue_distances(
       all_positions, all_positions_mask, max_ca_ca_distance)
   return all_positions, all_positions_mask
 
 
+def get_template_store_entry(
+    file_id: str, mmcif_string: str) -> template_store.TemplateStoreEntry:
+  """Parses an mmCIF file into an entry of a template store.
+
+  Args:
+    file_id: The ID of the mmCIF file, i.e. the lowercase PDB ID.
+    mmcif_string: The contents of the mmCIF file.
+
+  Returns:
+    The release date, seqres and atom37 positions of all chains, with the
+    errors raised when parsing them, as used by template featurization.
+  """
+  parsing_result = mmcif_parsing.parse(
+      file_id=file_id, mmcif_string=mmcif_string)
+  mmcif_object = parsing_result.mmcif_object
+  if mmcif_object is None:
+    return template_store.TemplateStoreEntry(
+        file_id=file_id, has_structure=False, release_date=None,
+        parsing_errors=parsing_result.errors, chains=())
+
+  chains = []
+  for chain_id, seqres in mmcif_object.chain_to_seqres.items():
+    try:
+      positions, mask = _get_atom37(mmcif_object, chain_id)
+    except (Error, KeyError) as e:
+      chains.append(template_store.TemplateChain(
+          chain_id=chain_id, seqres=seqres, atom_positions=None,
+          atom_mask=None, error=e))
+    else:
+      # The positions are float32 coordinates, so this is lossless.
+      chains.append(template_store.TemplateChain(
+          chain_id=chain_id, seqres=seqres,
+          atom_positions=positions.astype(np.float32),
+          atom_mask=mask.astype(bool)))
+  return template_store.TemplateStoreEntry(
+      file_id=file_id,
+      has_structure=True,
+      release_date=mmcif_object.header.get('release_date'),
+      parsing_errors=parsing_result.errors,
+      chains=chains)
+
+
 def _extract_template_features(
     mmcif_object: mmcif_parsing.MmcifObject,
     pdb_id: str,
@@ -490,7 +547,10 @@ def _extract_template_features(
     template_sequence: str,
     query_sequence: str,
     template_chain_id: str,
-    kalign_binary_path: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    kalign_binary_path: str,
+    atom_positions_getter: Optional[
+        Callable[[str], Tuple[np.ndarray, np.ndarray]]] = None
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
   """Parses atom positions in the target structure and aligns with the query.
 
   Atoms for each residue in the template structure are indexed to coincide
@@ -510,6 +570,9 @@ def _extract_template_features(
       should be used.
     kalign_binary_path: The path to a kalign executable used for template
         realignment.
+    atom_positions_getter: An optional function returning the atom37 positions
+      and mask of a chain, used instead of the Biopython structure of the
+      mmcif object, e.g. when the template comes from a template store.
 
   Returns:
     A tuple with:
@@ -563,8 +626,13 @@ def _extract_template_features(
   try:
     # Essentially set to infinity - we don't want to reject templates unless
     # they're really really bad.
-    all_atom_positions, all_atom_mask = _get_atom_positions(
-        mmcif_object, chain_id, max_ca_ca_distance=150.0)
+    if atom_positions_getter is None:
+      all_atom_positions, all_atom_mask = _get_atom_positions(
+          mmcif_object, chain_id, max_ca_ca_distance=150.0)
+    else:
+      all_atom_positions, all_atom_mask = atom_positions_getter(chain_id)
+      _check_residue_distances(
+          all_atom_positions, all_atom_mask, max_ca_ca_distance=150.0)
   except (CaDistanceError, KeyError) as ex:
     raise NoAtomDataInTemplateError(
         'Could not get atom data (%s_%s): %s' % (pdb_id, chain_id, str(ex))
@@ -684,6 +752,27 @@ def _read_file(path):
   return file_data
 
 
+def _parsing_result_from_store(
+    stored_template: template_store.StoredTemplate
+    ) -> mmcif_parsing.ParsingResult:
+  """Returns a parsing result without the structure for a stored template."""
+  if not stored_template.has_structure:
+    return mmcif_parsing.ParsingResult(
+        mmcif_object=None, errors=stored_template.parsing_errors)
+  header = {}
+  if stored_template.release_date is not None:
+    header['release_date'] = stored_template.release_date
+  mmcif_object = mmcif_parsing.MmcifObject(
+      file_id=stored_template.file_id,
+      header=header,
+      structure=None,
+      chain_to_seqres=stored_template.chain_to_seqres,
+      seqres_to_structure=None,
+      raw_string=None)
+  return mmcif_parsing.ParsingResult(
+      mmcif_object=mmcif_object, errors=stored_template.parsing_errors)
+
+
 def _process_single_hit(
     query_sequence: str,
     hit: parsers.TemplateHit,
@@ -692,7 +781,8 @@ def _process_single_hit(
     release_dates: Mapping[str, datetime.datetime],
     obsolete_pdbs: Mapping[str, Optional[str]],
     kalign_binary_path: str,
-    strict_error_check: bool = False) -> SingleHitResult:
+    strict_error_check: bool = False,
+    template_store_dir: Optional[str] = None) -> SingleHitResult:
   """Tries to extract template features from a single HHSearch hit."""
   # Fail hard if we can't get the PDB ID and chain name from the hit.
   hit_pdb_code, hit_chain_id = _get_pdb_id_and_chain(hit)
@@ -731,14 +821,27 @@ def _process_single_hit(
   # remove gaps (which regardless have a missing confidence score).
   template_sequence = hit.hit_sequence.replace('-', '')
 
-  cif_path = os.path.join(mmcif_dir, hit_pdb_code + '.cif')
-  logging.debug('Reading PDB entry from %s. Query: %s, template: %s', cif_path,
-                query_sequence, template_sequence)
-  # Fail if we can't find the mmCIF file.
-  cif_string = _read_file(cif_path)
+  stored_template = None
+  if template_store_dir:
+    stored_template = template_store.open_store(template_store_dir).get(
+        hit_pdb_code)
+  atom_positions_getter = None
+  if stored_template is not None:
+    logging.debug('Reading PDB entry %s from the template store. Query: %s, '
+                  'template: %s', hit_pdb_code, query_sequence,
+                  template_sequence)
+    parsing_result = _parsing_result_from_store(stored_template)
+    atom_positions_getter = stored_template.atom_positions
+  else:
+    # Entries newer than the template store are read from the mmCIF files.
+    cif_path = os.path.join(mmcif_dir, hit_pdb_code + '.cif')
+    logging.debug('Reading PDB entry from %s. Query: %s, template: %s',
+                  cif_path, query_sequence, template_sequence)
+    # Fail if we can't find the mmCIF file.
+    cif_string = _read_file(cif_path)
 
-  parsing_result = mmcif_parsing.parse(
-      file_id=hit_pdb_code, mmcif_string=cif_string)
+    parsing_result = mmcif_parsing.parse(
+        file_id=hit_pdb_code, mmcif_string=cif_string)
 
   if parsing_result.mmcif_object is not None:
     hit_release_date = datetime.datetime.strptime(
@@ -760,7 +863,8 @@ def _process_single_hit(
         template_sequence=template_sequence,
         query_sequence=query_sequence,
         template_chain_id=hit_chain_id,
-        kalign_binary_path=kalign_binary_path)
+        kalign_binary_path=kalign_binary_path,
+        atom_positions_getter=atom_positions_getter)
     if hit.sum_probs is None:
       features['template_sum_probs'] = [0]
     else:
@@ -791,6 +895,21 @@ def _process_single_hit(
     return SingleHitResult(features=None, error=error, warning=None)
 
 
+# The hit processor of a template featurization worker process.
+_worker_hit_processor: Optional[Callable[..., SingleHitResult]] = None
+
+
+def _init_hit_processing_worker(
+    hit_processor: Callable[..., SingleHitResult]):
+  global _worker_hit_processor
+  _worker_hit_processor = hit_processor
+
+
+def _process_hit_in_worker(query_sequence: str,
+                           hit: parsers.TemplateHit) -> SingleHitResult:
+  return _worker_hit_processor(query_sequence=query_sequence, hit=hit)
+
+
 @dataclasses.dataclass(frozen=True)
 class TemplateSearchResult:
   features: Mapping[str, Any]
@@ -809,7 +928,9 @@ class TemplateHitFeaturizer(abc.ABC):
       kalign_binary_path: str,
       release_dates_path: Optional[str],
       obsolete_pdbs_path: Optional[str],
-      strict_error_check: bool = False):
+      strict_error_check: bool = False,
+      num_workers: int = 1,
+      template_store_dir: Optional[str] = None):
     """Initializes the Template Search.
 
     Args:
@@ -832,7 +953,15 @@ class TemplateHitFeaturizer(abc.ABC):
         * If any template has identical PDB ID to the query.
         * If any template is a duplicate of the query.
         * Any feature computation errors.
+      num_workers: The number of processes in which hits are featurized. With
+        more than one, the next best hits are featurized speculatively while
+        the results are consumed in order, so the same templates are picked.
+      template_store_dir: An optional path to a template store built from
+        mmcif_dir with scripts/build_template_store.py. Templates in the store
+        are read from it instead of being parsed from their mmCIF files.
     """
+    if num_workers < 1:
+      raise ValueError(f'num_workers must be at least 1, got {num_workers}.')
     self._mmcif_dir = mmcif_dir
     if not glob.glob(os.path.join(self._mmcif_dir, '*.cif')):
       logging.error('Could not find CIFs in %s', self._mmcif_dir)
@@ -847,6 +976,16 @@ class TemplateHitFeaturizer(abc.ABC):
     self._max_hits = max_hits
     self._kalign_binary_path = kalign_binary_path
     self._strict_error_check = strict_error_check
+    self._num_workers = num_workers
+    # The pool of hit processing workers, started on first use and shared by
+    # all get_templates calls.
+    self._executor = None
+    self._executor_lock = threading.Lock()
+    self._template_store_dir = template_store_dir
+    if template_store_dir:
+      logging.info('Using template store %s with %d entries.',
+                   template_store_dir,
+                   len(template_store.open_store(template_store_dir)))
 
     if release_dates_path:
       logging.info('Using precomputed release dates %s.', release_dates_path)
@@ -860,6 +999,87 @@ class TemplateHitFeaturizer(abc.ABC):
     else:
       self._obsolete_pdbs = {}
 
+  def _hit_processor(self) -> Callable[..., SingleHitResult]:
+    """Returns _process_single_hit with the state shared by all queries."""
+    return functools.partial(
+        _process_single_hit,
+        mmcif_dir=self._mmcif_dir,
+        max_template_date=self._max_template_date,
+        release_dates=self._release_dates,
+        obsolete_pdbs=self._obsolete_pdbs,
+        strict_error_check=self._strict_error_check,
+        kalign_binary_path=self._kalign_binary_path,
+        template_store_dir=self._template_store_dir)
+
+  def _get_executor(self) -> futures.ProcessPoolExecutor:
+    """Returns the pool of hit processing workers, starting it if needed."""
+    with self._executor_lock:
+      if self._executor is None:
+        # Spawned workers are safe to start from a multithreaded process. The
+        # state shared by all queries, with the release dates, is sent to each
+        # worker only once.
+        self._executor = futures.ProcessPoolExecutor(
+            max_workers=self._num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_hit_processing_worker,
+            initargs=(self._hit_processor(),))
+      return self._executor
+
+  def close(self):
+    """Shuts down the hit processing workers, if they were started."""
+    with self._executor_lock:
+      if self._executor is not None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+  def _process_hits(
+      self,
+      query_sequence: str,
+      hits: Sequence[parsers.TemplateHit]
+      ) -> Iterator[Tuple[parsers.TemplateHit, SingleHitResult]]:
+    """Yields the hits with their features, in order.
+
+    With a single worker each hit is processed when it is requested. Otherwise
+    up to two hits per worker ahead of the requested one are processed in a
+    process pool, which is started on the first call and reused by the later
+    ones. Hits processed speculatively are discarded once the caller stops
+    iterating, so callers see the same results either way.
+
+    Args:
+      query_sequence: The query sequence.
+      hits: The hits, in the order in which they are to be processed.
+
+    Yields:
+      Pairs of a hit and the result of processing it.
+    """
+    if self._max_hits <= 0:
+      return
+    if self._num_workers == 1:
+      hit_processor = self._hit_processor()
+      for hit in hits:
+        yield hit, hit_processor(query_sequence=query_sequence, hit=hit)
+      return
+
+    hits = iter(hits)
+    executor = self._get_executor()
+    pending = collections.deque(
+        (hit, executor.submit(_process_hit_in_worker, query_sequence, hit))
+        for hit in itertools.islice(hits, 2 * self._num_workers))
+    try:
+      while pending:
+        hit, future = pending.popleft()
+        result = future.result()
+        next_hit = next(hits, None)
+        if next_hit is not None:
+          pending.append((next_hit, executor.submit(
+              _process_hit_in_worker, query_sequence, next_hit)))
+        yield hit, result
+    finally:
+      # Don't wait for the speculatively processed hits. Those that already
+      # run finish in the background and are discarded.
+      for _, future in pending:
+        future.cancel()
+
   @abc.abstractmethod
   def get_templates(
       self,
@@ -886,37 +1106,30 @@ class HhsearchHitFeaturizer(TemplateHitFeaturizer):
     errors = []
     warnings = []
 
-    for hit in sorted(hits, key=lambda x: x.sum_probs, reverse=True):
-      # We got all the templates we wanted, stop processing hits.
-      if num_hits >= self._max_hits:
-        break
-
-      result = _process_single_hit(
-          query_sequence=query_sequence,
-          hit=hit,
-          mmcif_dir=self._mmcif_dir,
-          max_template_date=self._max_template_date,
-          release_dates=self._release_dates,
-          obsolete_pdbs=self._obsolete_pdbs,
-          strict_error_check=self._strict_error_check,
-          kalign_binary_path=self._kalign_binary_path)
-
-      if result.error:
-        errors.append(result.error)
-
-      # There could be an error even if there are some results, e.g. thrown by
-      # other unparsable chains in the same mmCIF file.
-      if result.warning:
-        warnings.append(result.warning)
-
-      if result.features is None:
-        logging.info('Skipped invalid hit %s, error: %s, warning: %s',
-                     hit.name, result.error, result.warning)
-      else:
-        # Increment the hit counter, since we got features out of this hit.
-        num_hits += 1
-        for k in template_features:
-          template_features[k].append(result.features[k])
+    sorted_hits = sorted(hits, key=lambda x: x.sum_probs, reverse=True)
+    with contextlib.closing(
+        self._process_hits(query_sequence, sorted_hits)) as hit_results:
+      for hit, result in hit_results:
+        if result.error:
+          errors.append(result.error)
+
+        # There could be an error even if there are some results, e.g. thrown
+        # by other unparsable chains in the same mmCIF file.
+        if result.warning:
+          warnings.append(result.warning)
+
+        if result.features is None:
+          logging.info('Skipped invalid hit %s, error: %s, warning: %s',
+                       hit.name, result.error, result.warning)
+        else:
+          # Increment the hit counter, since we got features out of this hit.
+          num_hits += 1
+          for k in template_features:
+            template_features[k].append(result.features[k])
+
+        # We got all the templates we wanted, stop processing hits.
+        if num_hits >= self._max_hits:
+          break
 
     for name in template_features:
       if num_hits > 0:
@@ -953,40 +1166,32 @@ class HmmsearchHitFeaturizer(TemplateHitFeaturizer):
     else:
       sorted_hits = sorted(hits, key=lambda x: x.sum_probs, reverse=True)
 
-    for hit in sorted_hits:
-      # We got all the templates we wanted, stop processing hits.
-      if len(already_seen) >= self._max_hits:
-        break
-
-      result = _process_single_hit(
-          query_sequence=query_sequence,
-          hit=hit,
-          mmcif_dir=self._mmcif_dir,
-          max_template_date=self._max_template_date,
-          release_dates=self._release_dates,
-          obsolete_pdbs=self._obsolete_pdbs,
-          strict_error_check=self._strict_error_check,
-          kalign_binary_path=self._kalign_binary_path)
-
-      if result.error:
-        errors.append(result.error)
-
-      # There could be an error even if there are some results, e.g. thrown by
-      # other unparsable chains in the same mmCIF file.
-      if result.warning:
-        warnings.append(result.warning)
-
-      if result.features is None:
-        logging.debug('Skipped invalid hit %s, error: %s, warning: %s',
-                      hit.name, result.error, result.warning)
-      else:
-        already_seen_key = result.features['template_sequence']
-        if already_seen_key in already_seen:
-          continue
-        # Increment the hit counter, since we got features out of this hit.
-        already_seen.add(already_seen_key)
-        for k in template_features:
-          template_features[k].append(result.features[k])
+    with contextlib.closing(
+        self._process_hits(query_sequence, sorted_hits)) as hit_results:
+      for hit, result in hit_results:
+        if result.error:
+          errors.append(result.error)
+
+        # There could be an error even if there are some results, e.g. thrown
+        # by other unparsable chains in the same mmCIF file.
+        if result.warning:
+          warnings.append(result.warning)
+
+        if result.features is None:
+          logging.debug('Skipped invalid hit %s, error: %s, warning: %s',
+                        hit.name, result.error, result.warning)
+        else:
+          already_seen_key = result.features['template_sequence']
+          if already_seen_key in already_seen:
+            continue
+          # Increment the hit counter, since we got features out of this hit.
+          already_seen.add(already_seen_key)
+          for k in template_features:
+            template_features[k].append(result.features[k])
+
+        # We got all the templates we wanted, stop processing hits.
+        if len(already_seen) >= self._max_hits:
+          break
 
     if already_seen:
       for name in template_features:
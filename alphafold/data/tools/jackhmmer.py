@@ -16,9 +16,12 @@
 
 from concurrent import futures
 import glob
+import itertools
+import json
+import math
 import os
 import subprocess
-from typing import Any, Callable, Mapping, Optional, Sequence
+from typing import Any, BinaryIO, Callable, Mapping, Optional, Sequence
 from urllib import request
 
 from absl import logging
@@ -28,6 +31,108 @@ from alphafold.data.tools import utils
 # Internal import (7716).
 
 
+_READ_BLOCK_SIZE = 1 << 24
+
+
+class _FastaChunkReader:
+  """Copies a FASTA file in chunks of whole records."""
+
+  def __init__(self, fasta_file: BinaryIO, chunk_size: int):
+    self._fasta_file = fasta_file
+    self._chunk_size = chunk_size
+    self._pending = b''
+
+  def copy_chunk(self, chunk_file: BinaryIO) -> int:
+    """Copies the next records of at least chunk_size bytes in total.
+
+    Args:
+      chunk_file: The file to write the records to.
+
+    Returns:
+      The number of records copied, 0 at the end of the FASTA file.
+    """
+    num_bytes = 0
+    num_records = 0
+    at_line_start = True
+    while True:
+      data = self._pending or self._fasta_file.read(_READ_BLOCK_SIZE)
+      self._pending = b''
+      if not data:
+        return num_records
+      # The chunk ends at the first record start at or after this offset.
+      min_cut = max(self._chunk_size - num_bytes, 0)
+      if num_bytes and not min_cut and at_line_start and data[:1] == b'>':
+        cut = 0
+      else:
+        cut = data.find(b'\n>', max(min_cut - 1, 0))
+        cut = cut + 1 if cut != -1 else len(data)
+      data, self._pending = data[:cut], data[cut:]
+      chunk_file.write(data)
+      num_records += data.count(b'\n>') + (at_line_start and data[:1] == b'>')
+      num_bytes += len(data)
+      if data:
+        at_line_start = data.endswith(b'\n')
+      if self._pending:
+        return num_records
+
+
+def _write_fasta_chunk(reader: _FastaChunkReader,
+                       chunk_path: str) -> Optional[int]:
+  """Writes the next FASTA chunk, returns its number of sequences or None."""
+  with open(chunk_path, 'wb') as f:
+    num_sequences = reader.copy_chunk(f)
+  return num_sequences or None
+
+
+def _shard_manifest_path(database_path: str) -> str:
+  return f'{database_path}.shards.json'
+
+
+def shard_database(database_path: str,
+                   num_shards: int,
+                   output_prefix: Optional[str] = None) -> Mapping[str, Any]:
+  """Splits a FASTA database into shards of about equal size.
+
+  The shards are written to <output_prefix>.1 ... <output_prefix>.K, next to a
+  <output_prefix>.shards.json manifest with the number of sequences in each
+  shard. Jackhmmer with use_database_shards=True and database_path set to
+  output_prefix then searches the shards in parallel.
+
+  Args:
+    database_path: The path to the FASTA database.
+    num_shards: The number of shards to split the database into. Fewer shards
+      are written if the database has fewer records.
+    output_prefix: The path prefix of the shards, ideally on fast local
+      storage. Defaults to database_path.
+
+  Returns:
+    The manifest of the shards.
+  """
+  output_prefix = output_prefix or database_path
+  shard_size = math.ceil(os.path.getsize(database_path) / num_shards)
+  shard_num_sequences = []
+  with open(database_path, 'rb') as database_file:
+    reader = _FastaChunkReader(database_file, shard_size)
+    for shard_index in range(1, num_shards + 1):
+      shard_path = f'{output_prefix}.{shard_index}'
+      with utils.timing(f'Writing database shard {shard_path}'):
+        num_sequences = _write_fasta_chunk(reader, shard_path)
+      if num_sequences is None:
+        os.remove(shard_path)
+        break
+      shard_num_sequences.append(num_sequences)
+
+  manifest = {
+      'database_path': database_path,
+      'num_shards': len(shard_num_sequences),
+      'num_sequences': sum(shard_num_sequences),
+      'shard_num_sequences': shard_num_sequences,
+  }
+  with open(_shard_manifest_path(output_prefix), 'w') as f:
+    json.dump(manifest, f, indent=4)
+  return manifest
+
+
 class Jackhmmer:
   """Python wrapper of the Jackhmmer binary."""
 
@@ -46,7 +151,10 @@ class Jackhmmer:
                incdom_e: Optional[float] = None,
                dom_e: Optional[float] = None,
                num_streamed_chunks: Optional[int] = None,
-               streaming_callback: Optional[Callable[[int], None]] = None):
+               streaming_callback: Optional[Callable[[int], None]] = None,
+               shared_scan_chunk_size: Optional[int] = None,
+               shared_scan_dir: Optional[str] = None,
+               use_database_shards: bool = False):
     """Initializes the Python Jackhmmer wrapper.
 
     Args:
@@ -66,12 +174,39 @@ class Jackhmmer:
       num_streamed_chunks: Number of database chunks to stream over.
       streaming_callback: Callback function run after each chunk iteration with
         the iteration number as argument.
+      shared_scan_chunk_size: If set, query_multiple reads the local database
+        only once, in chunks of about this many bytes, and searches every
+        query against each chunk before moving on to the next one. The
+        per-chunk hits of each query are merged back into a single result.
+        Only supported with n_iter=1.
+      shared_scan_dir: Directory in which the database chunks of a shared scan
+        are stored while they are searched, ideally on fast local storage.
+        Defaults to the system temporary directory.
+      use_database_shards: Whether to search the shards written by
+        shard_database for database_path instead of the database itself. The
+        shards are searched in parallel, splitting n_cpu between them, and
+        their hits are merged. Unless z_value is set, the total number of
+        sequences from the shard manifest is used as Z, so that E-values match
+        those of a search of the whole database. Only supported with n_iter=1.
     """
     self.binary_path = binary_path
     self.database_path = database_path
     self.num_streamed_chunks = num_streamed_chunks
+    self.use_database_shards = use_database_shards
 
-    if not os.path.exists(self.database_path) and num_streamed_chunks is None:
+    if use_database_shards:
+      manifest_path = _shard_manifest_path(database_path)
+      if not os.path.exists(manifest_path):
+        logging.error('Could not find Jackhmmer database shards %s',
+                      manifest_path)
+        raise ValueError(
+            f'Could not find Jackhmmer database shards {manifest_path}')
+      with open(manifest_path) as f:
+        self._shard_manifest = json.load(f)
+      if z_value is None:
+        z_value = self._shard_manifest['num_sequences']
+    elif (not os.path.exists(self.database_path) and
+          num_streamed_chunks is None):
       logging.error('Could not find Jackhmmer database %s', database_path)
       raise ValueError(f'Could not find Jackhmmer database {database_path}')
 
@@ -86,12 +221,28 @@ class Jackhmmer:
     self.dom_e = dom_e
     self.get_tblout = get_tblout
     self.streaming_callback = streaming_callback
+    self.shared_scan_chunk_size = shared_scan_chunk_size
+    self.shared_scan_dir = shared_scan_dir
+
+    if shared_scan_chunk_size is not None and use_database_shards:
+      raise ValueError('Shared database scans and database shards cannot be '
+                       'combined.')
+    if (shared_scan_chunk_size is not None or use_database_shards) and (
+        n_iter != 1):
+      raise ValueError('Shared database scans and database shards only '
+                       f'support n_iter=1, got n_iter={n_iter}.')
 
   def _query_chunk(self,
                    input_fasta_path: str,
                    database_path: str,
-                   max_sequences: Optional[int] = None) -> Mapping[str, Any]:
+                   max_sequences: Optional[int] = None,
+                   get_tblout: Optional[bool] = None,
+                   n_cpu: Optional[int] = None) -> Mapping[str, Any]:
     """Queries the database chunk using Jackhmmer."""
+    if get_tblout is None:
+      get_tblout = self.get_tblout
+    if n_cpu is None:
+      n_cpu = self.n_cpu
     with utils.tmpdir_manager() as query_tmp_dir:
       sto_path = os.path.join(query_tmp_dir, 'output.sto')
 
@@ -111,10 +262,10 @@ class Jackhmmer:
           '--incE', str(self.e_value),
           # Report only sequences with E-values <= x in per-sequence output.
           '-E', str(self.e_value),
-          '--cpu', str(self.n_cpu),
+          '--cpu', str(n_cpu),
           '-N', str(self.n_iter)
       ]
-      if self.get_tblout:
+      if get_tblout:
         tblout_path = os.path.join(query_tmp_dir, 'tblout.txt')
         cmd_flags.extend(['--tblout', tblout_path])
 
@@ -144,7 +295,7 @@ class Jackhmmer:
 
       # Get e-values for each target name
       tbl = ''
-      if self.get_tblout:
+      if get_tblout:
         with open(tblout_path) as f:
           tbl = f.read()
 
@@ -175,6 +326,14 @@ class Jackhmmer:
       max_sequences: Optional[int] = None,
     ) -> Sequence[Sequence[Mapping[str, Any]]]:
     """Queries the database for multiple queries using Jackhmmer."""
+    if self.use_database_shards:
+      return [[result] for result in self._query_shards(
+          input_fasta_paths, max_sequences)]
+
+    if self.num_streamed_chunks is None and self.shared_scan_chunk_size:
+      return [[result] for result in self._query_shared_scan(
+          input_fasta_paths, max_sequences)]
+
     if self.num_streamed_chunks is None:
       single_chunk_results = []
       for input_fasta_path in input_fasta_paths:
@@ -219,3 +378,121 @@ class Jackhmmer:
         if self.streaming_callback:
           self.streaming_callback(i)
     return chunked_outputs
+
+  def _query_shards(
+      self,
+      input_fasta_paths: Sequence[str],
+      max_sequences: Optional[int] = None) -> Sequence[Mapping[str, Any]]:
+    """Searches all queries against the database shards in parallel."""
+    num_shards = self._shard_manifest['num_shards']
+    shard_paths = [f'{self.database_path}.{i}'
+                   for i in range(1, num_shards + 1)]
+    tasks = list(itertools.product(input_fasta_paths, shard_paths))
+    num_workers = max(1, min(len(tasks), self.n_cpu))
+    n_cpu = max(1, self.n_cpu // num_workers)
+    logging.info('Searching %d queries against %d shards of %s with %d '
+                 'parallel Jackhmmer processes of %d CPUs each.',
+                 len(input_fasta_paths), num_shards, self.database_path,
+                 num_workers, n_cpu)
+    with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+      results = list(executor.map(
+          lambda task: self._query_chunk(*task, get_tblout=True, n_cpu=n_cpu),
+          tasks))
+    return [
+        self._merge_chunk_results(
+            results[i * num_shards:(i + 1) * num_shards],
+            max_sequences=max_sequences)
+        for i in range(len(input_fasta_paths))]
+
+  def _query_shared_scan(
+      self,
+      input_fasta_paths: Sequence[str],
+      max_sequences: Optional[int] = None) -> Sequence[Mapping[str, Any]]:
+    """Searches all queries against each database chunk, reading it once."""
+    chunk_results = [[] for _ in input_fasta_paths]
+    chunk_num_sequences = []
+    with utils.tmpdir_manager(base_dir=self.shared_scan_dir) as chunk_dir, \
+        open(self.database_path, 'rb') as database_file, \
+        futures.ThreadPoolExecutor(max_workers=1) as executor:
+      reader = _FastaChunkReader(database_file, self.shared_scan_chunk_size)
+      # The chunks alternate between two files, so that the (i+1)-th chunk is
+      # copied while Jackhmmer is running on the i-th chunk.
+      chunk_path = lambda i: os.path.join(chunk_dir, f'chunk.{i % 2}.fasta')
+
+      future = executor.submit(_write_fasta_chunk, reader, chunk_path(0))
+      for i in itertools.count():
+        num_sequences = future.result()
+        if num_sequences is None:
+          break
+        future = executor.submit(_write_fasta_chunk, reader, chunk_path(i + 1))
+        logging.info('Shared scan of %s: searching %d queries against chunk %d '
+                     '(%d sequences).', os.path.basename(self.database_path),
+                     len(input_fasta_paths), i + 1, num_sequences)
+        chunk_num_sequences.append(num_sequences)
+        for query_results, input_fasta_path in zip(
+            chunk_results, input_fasta_paths):
+          query_results.append(self._query_chunk(
+              input_fasta_path, chunk_path(i), get_tblout=True))
+        if self.streaming_callback:
+          self.streaming_callback(i + 1)
+
+    if self.z_value:
+      # All chunks were already searched with the full database Z.
+      chunk_num_sequences = None
+    return [self._merge_chunk_results(query_results, chunk_num_sequences,
+                                      max_sequences)
+            for query_results in chunk_results]
+
+  def _merge_chunk_results(
+      self,
+      chunk_results: Sequence[Mapping[str, Any]],
+      chunk_num_sequences: Optional[Sequence[int]] = None,
+      max_sequences: Optional[int] = None) -> Mapping[str, Any]:
+    """Merges the per-chunk hits of a query into a single result.
+
+    Args:
+      chunk_results: The per-chunk Jackhmmer results of a single query, which
+        must include the tblout.
+      chunk_num_sequences: The number of sequences in each of the chunks, if
+        the chunks were searched with their own size as Z. The E-value of each
+        hit is then rescaled to the size of the full database and hits that no
+        longer pass the E-value threshold are dropped. If None, the chunks were
+        searched with the Z of the full database.
+      max_sequences: If set, the maximum number of sequences in the merged MSA.
+
+    Returns:
+      A Jackhmmer result for the whole database. The tblout is the
+      concatenation of the per-chunk tblouts, with the E-values the chunks were
+      searched with.
+    """
+    e_values = {}
+    for chunk_index, result in enumerate(chunk_results):
+      if chunk_num_sequences is None:
+        scale = 1.0
+      else:
+        scale = sum(chunk_num_sequences) / chunk_num_sequences[chunk_index]
+      for target_name, e_value in parsers.parse_e_values_from_tblout(
+          result['tbl']).items():
+        e_values[target_name] = e_value * scale
+
+    # Jackhmmer lists sequences as <sequence name>/<residue from>-<residue to>.
+    hit_e_value = lambda seqname: e_values.get(
+        seqname.partition('/')[0], math.inf)
+    if chunk_num_sequences is None:
+      hit_filter = None
+    else:
+      hit_filter = lambda seqname: hit_e_value(seqname) <= self.e_value
+
+    sto = parsers.merge_stockholm_msas(
+        [result['sto'] for result in chunk_results],
+        sort_key=hit_e_value,
+        hit_filter=hit_filter,
+        max_sequences=max_sequences)
+    tbl = ''.join(result['tbl'] for result in chunk_results)
+    stderr = b''.join(result['stderr'] for result in chunk_results)
+    return dict(
+        sto=sto,
+        tbl=tbl,
+        stderr=stderr,
+        n_iter=self.n_iter,
+        e_value=self.e_value)
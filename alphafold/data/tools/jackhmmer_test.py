@@ -0,0 +1,282 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for jackhmmer."""
+
+import glob
+import io
+import json
+import os
+import tempfile
+import threading
+
+from absl.testing import absltest
+from alphafold.data import parsers
+from alphafold.data.tools import jackhmmer
+import mock
+import numpy as np
+
+
+def _random_fasta(num_records: int, seed: int = 0) -> bytes:
+  """Returns FASTA records of random length, with sequences over many lines."""
+  rng = np.random.default_rng(seed)
+  records = []
+  for i in range(num_records):
+    sequence = ''.join(rng.choice(list('ACDEFGHIKLMNPQRSTVWY'),
+                                  rng.integers(1, 200)))
+    lines = [sequence[j:j + 60] for j in range(0, len(sequence), 60)]
+    records.append(f'>seq{i} description {i}\n' + '\n'.join(lines) + '\n')
+  return ''.join(records).encode()
+
+
+def _stockholm(query_name: str, hit_names) -> str:
+  lines = ['# STOCKHOLM 1.0', '', f'{query_name} ACDE']
+  lines.extend(f'{name}/1-4 ACDE' for name in hit_names)
+  lines.append('//')
+  return '\n'.join(lines) + '\n'
+
+
+def _tblout(query_name: str, e_values) -> str:
+  lines = ['# target name accession query name accession E-value ...']
+  lines.extend(f'{name} - {query_name} - {e_value:g} 50.0 0.1 - - -'
+               for name, e_value in e_values.items())
+  return '\n'.join(lines) + '\n'
+
+
+def _hit_names(result):
+  return parsers.parse_stockholm(result['sto']).descriptions[1:]
+
+
+class ShardDatabaseTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = tempfile.mkdtemp(dir=absltest.get_default_test_tmpdir())
+    self.database_path = os.path.join(self.tmp_dir, 'database.fasta')
+
+  def _write_database(self, data: bytes):
+    with open(self.database_path, 'wb') as f:
+      f.write(data)
+
+  def test_shards_concatenate_to_database(self):
+    data = _random_fasta(num_records=100)
+    self._write_database(data)
+    output_prefix = os.path.join(self.tmp_dir, 'shards', 'database')
+    os.makedirs(os.path.dirname(output_prefix))
+
+    manifest = jackhmmer.shard_database(
+        self.database_path, num_shards=4, output_prefix=output_prefix)
+
+    self.assertEqual(manifest['num_shards'], 4)
+    self.assertLen(glob.glob(output_prefix + '.[0-9]*'), 4)
+    shards = []
+    for i in range(1, 5):
+      with open(f'{output_prefix}.{i}', 'rb') as f:
+        shards.append(f.read())
+    self.assertEqual(b''.join(shards), data)
+    for shard, num_sequences in zip(shards, manifest['shard_num_sequences']):
+      self.assertTrue(shard.startswith(b'>'))
+      self.assertEqual(num_sequences, shard.count(b'>'))
+    self.assertEqual(manifest['num_sequences'], 100)
+    with open(output_prefix + '.shards.json') as f:
+      self.assertEqual(json.load(f), manifest)
+
+  def test_fewer_records_than_shards(self):
+    self._write_database(_random_fasta(num_records=2))
+
+    manifest = jackhmmer.shard_database(self.database_path, num_shards=5)
+
+    self.assertEqual(manifest['num_shards'], 2)
+    self.assertEqual(manifest['shard_num_sequences'], [1, 1])
+    self.assertEqual(
+        sorted(glob.glob(self.database_path + '.[0-9]*')),
+        [self.database_path + '.1', self.database_path + '.2'])
+
+  def test_z_value_defaults_to_number_of_sequences(self):
+    self._write_database(_random_fasta(num_records=30))
+    jackhmmer.shard_database(self.database_path, num_shards=3)
+
+    runner = jackhmmer.Jackhmmer(binary_path='jackhmmer',
+                                 database_path=self.database_path,
+                                 use_database_shards=True)
+    self.assertEqual(runner.z_value, 30)
+    runner = jackhmmer.Jackhmmer(binary_path='jackhmmer',
+                                 database_path=self.database_path,
+                                 z_value=1000, use_database_shards=True)
+    self.assertEqual(runner.z_value, 1000)
+
+  def test_missing_shards_raise(self):
+    self._write_database(_random_fasta(num_records=3))
+    with self.assertRaisesRegex(ValueError, 'database shards'):
+      jackhmmer.Jackhmmer(binary_path='jackhmmer',
+                          database_path=self.database_path,
+                          use_database_shards=True)
+
+  def test_query_shards(self):
+    self._write_database(_random_fasta(num_records=30))
+    jackhmmer.shard_database(self.database_path, num_shards=3)
+    runner = jackhmmer.Jackhmmer(binary_path='jackhmmer',
+                                 database_path=self.database_path,
+                                 n_cpu=12, use_database_shards=True)
+    calls = []
+    lock = threading.Lock()
+
+    def query_chunk(input_fasta_path, database_path, get_tblout, n_cpu):
+      with lock:
+        calls.append((input_fasta_path, database_path, get_tblout, n_cpu))
+      query_name = os.path.basename(input_fasta_path)
+      shard_index = int(database_path.rsplit('.', 1)[1])
+      # Later shards have better hits.
+      e_values = {f'{query_name}_shard{shard_index}_hit{i}':
+                      10.0**-(2 * shard_index + i) for i in range(2)}
+      return dict(sto=_stockholm(query_name, e_values),
+                  tbl=_tblout(query_name, e_values),
+                  stderr=f'{query_name} {shard_index}\n'.encode(),
+                  n_iter=1, e_value=runner.e_value)
+
+    with mock.patch.object(runner, '_query_chunk', side_effect=query_chunk):
+      results = runner.query_multiple(['/queries/a', '/queries/b'])
+
+    # 6 parallel searches split the 12 CPUs.
+    self.assertCountEqual(
+        calls, [(f'/queries/{query}', f'{self.database_path}.{shard}', True, 2)
+                for query in 'ab' for shard in range(1, 4)])
+    self.assertLen(results, 2)
+    for query_name, (result,) in zip('ab', results):
+      self.assertEqual(
+          _hit_names(result),
+          [f'{query_name}_shard{shard}_hit{i}/1-4'
+           for shard, i in [(3, 1), (3, 0), (2, 1), (2, 0), (1, 1), (1, 0)]])
+      self.assertEqual(
+          result['stderr'],
+          b''.join(f'{query_name} {shard}\n'.encode() for shard in (1, 2, 3)))
+
+
+class SharedScanTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = tempfile.mkdtemp(dir=absltest.get_default_test_tmpdir())
+    self.database_path = os.path.join(self.tmp_dir, 'database.fasta')
+    with open(self.database_path, 'wb') as f:
+      f.write(_random_fasta(num_records=40))
+
+  def _runner(self, **kwargs):
+    return jackhmmer.Jackhmmer(binary_path='jackhmmer',
+                               database_path=self.database_path,
+                               e_value=1e-3, **kwargs)
+
+  def _chunk_result(self, e_values):
+    return dict(sto=_stockholm('query', e_values),
+                tbl=_tblout('query', e_values),
+                stderr=b'', n_iter=1, e_value=1e-3)
+
+  def test_merge_rescales_e_values_to_database_size(self):
+    chunk_results = [
+        self._chunk_result({'a': 1e-5, 'b': 5e-4}),
+        self._chunk_result({'c': 2e-5, 'd': 1e-4}),
+    ]
+
+    # Rescaled by 400 / 100 and 400 / 300: a 4e-5, b 2e-3, c 2.7e-5, d 1.3e-4.
+    result = self._runner()._merge_chunk_results(
+        chunk_results, chunk_num_sequences=[100, 300])
+
+    self.assertEqual(_hit_names(result), ['c/1-4', 'a/1-4', 'd/1-4'])
+    self.assertEqual(result['tbl'], ''.join(r['tbl'] for r in chunk_results))
+    self.assertEqual(result['e_value'], 1e-3)
+
+    result = self._runner()._merge_chunk_results(
+        chunk_results, chunk_num_sequences=[100, 300], max_sequences=3)
+    self.assertEqual(_hit_names(result), ['c/1-4', 'a/1-4'])
+
+  def test_merge_keeps_e_values_searched_with_database_size(self):
+    chunk_results = [
+        self._chunk_result({'a': 1e-5, 'b': 5e-4}),
+        self._chunk_result({'c': 2e-5, 'd': 1e-4}),
+    ]
+
+    result = self._runner(z_value=400)._merge_chunk_results(chunk_results)
+
+    self.assertEqual(_hit_names(result),
+                     ['a/1-4', 'c/1-4', 'd/1-4', 'b/1-4'])
+
+  def test_shared_scan_matches_whole_database_search(self):
+    # The E-value of a hit scales with the Z of its search, which defaults to
+    # the number of sequences searched, as with Jackhmmer.
+    rng = np.random.default_rng(1)
+    e_values_per_sequence = {f'seq{i}': e_value for i, e_value in enumerate(
+        10.0**rng.uniform(-9, -3, size=40))}
+
+    def search(runner, chunk_size, max_sequences=None):
+      def query_chunk(input_fasta_path, database_path, get_tblout):
+        del input_fasta_path
+        self.assertTrue(get_tblout)
+        with open(database_path) as f:
+          names = [line[1:].split()[0] for line in f if line.startswith('>')]
+        z_value = runner.z_value or len(names)
+        e_values = {name: e_values_per_sequence[name] * z_value
+                    for name in names}
+        # Jackhmmer reports the hits within its E-value threshold.
+        return self._chunk_result({name: e_value
+                                   for name, e_value in e_values.items()
+                                   if e_value <= runner.e_value})
+
+      runner.shared_scan_chunk_size = chunk_size
+      with mock.patch.object(runner, '_query_chunk', side_effect=query_chunk):
+        (result,), = runner.query_multiple(['/queries/query'], max_sequences)
+      return _hit_names(result)
+
+    # A single chunk is searched like the whole database.
+    expected = search(self._runner(), chunk_size=1 << 30)
+    self.assertBetween(len(expected), 11, 39)
+    for chunk_size in (1, 500, 2000):
+      with self.subTest(chunk_size):
+        self.assertEqual(search(self._runner(), chunk_size), expected)
+        self.assertEqual(
+            search(self._runner(z_value=40), chunk_size), expected)
+        self.assertEqual(
+            search(self._runner(), chunk_size, max_sequences=11),
+            expected[:10])
+
+  def test_chunk_reader_cuts_at_record_starts(self):
+    rng = np.random.default_rng(0)
+    for case in range(300):
+      data = _random_fasta(num_records=rng.integers(1, 20), seed=case)
+      chunk_size = int(rng.integers(1, 2 * len(data)))
+      read_block_size = int(rng.integers(1, 300))
+      with self.subTest(case=case, chunk_size=chunk_size,
+                        read_block_size=read_block_size), \
+          mock.patch.object(jackhmmer, '_READ_BLOCK_SIZE', read_block_size):
+        reader = jackhmmer._FastaChunkReader(io.BytesIO(data), chunk_size)
+        chunks = []
+        while True:
+          chunk_file = io.BytesIO()
+          num_records = reader.copy_chunk(chunk_file)
+          chunk = chunk_file.getvalue()
+          if not num_records:
+            self.assertEmpty(chunk)
+            break
+          chunks.append(chunk)
+          self.assertTrue(chunk.startswith(b'>'))
+          self.assertEqual(num_records, chunk.count(b'>'))
+          # The chunk ends at the first record start at or after chunk_size.
+          self.assertLess(chunk.rfind(b'\n>') + 1, chunk_size)
+
+        self.assertEqual(b''.join(chunks), data)
+        for chunk in chunks[:-1]:
+          self.assertGreaterEqual(len(chunk), chunk_size)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,169 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pads model inputs to bucketed shapes and crops the outputs back.
+
+The model is compiled for every new shape of its inputs. Padding the residue
+and MSA row dimensions up to a few bucket sizes lets targets of different
+sizes share compiled models. The padding is masked out, the same way the
+monomer input pipeline already pads MSA clusters and templates to fixed sizes.
+"""
+
+from typing import Any, Mapping, MutableMapping, Optional, Sequence
+
+from alphafold.model.tf import shape_placeholders
+import ml_collections
+import numpy as np
+import tree
+
+NUM_RES = shape_placeholders.NUM_RES
+NUM_MSA_SEQ = shape_placeholders.NUM_MSA_SEQ
+
+# Padding for every 256 residues up to 2048 and every 512 beyond that.
+DEFAULT_RESIDUE_BUCKETS = (
+    tuple(range(256, 2048, 256)) + tuple(range(2048, 5121, 512)))
+DEFAULT_MSA_BUCKETS = (512, 1024, 2048, 4096, 8192, 16384)
+
+# The dimensions of the multimer model inputs. Monomer inputs are described by
+# the eval feature schema of the data config instead.
+_MULTIMER_FEATURE_SCHEMA = {
+    'aatype': [NUM_RES],
+    'all_atom_mask': [NUM_RES, None],
+    'all_atom_positions': [NUM_RES, None, None],
+    'asym_id': [NUM_RES],
+    'bert_mask': [NUM_MSA_SEQ, NUM_RES],
+    'cluster_bias_mask': [NUM_MSA_SEQ],
+    'deletion_matrix': [NUM_MSA_SEQ, NUM_RES],
+    'deletion_mean': [NUM_RES],
+    'entity_id': [NUM_RES],
+    'entity_mask': [NUM_RES],
+    'msa': [NUM_MSA_SEQ, NUM_RES],
+    'msa_mask': [NUM_MSA_SEQ, NUM_RES],
+    'residue_index': [NUM_RES],
+    'seq_mask': [NUM_RES],
+    'sym_id': [NUM_RES],
+    'template_aatype': [None, NUM_RES],
+    'template_all_atom_mask': [None, NUM_RES, None],
+    'template_all_atom_positions': [None, NUM_RES, None, None],
+}
+
+# Outputs with the MSA rows before the residue dimension, and outputs with two
+# residue dimensions, including the pairwise confidence metrics. All other
+# outputs start with one residue dimension.
+_MSA_OUTPUTS = frozenset({
+    ('masked_msa', 'logits'),
+    ('representations', 'msa'),
+})
+_PAIR_OUTPUTS = frozenset({
+    ('aligned_confidence_probs',),
+    ('distogram', 'logits'),
+    ('predicted_aligned_error',),
+    ('predicted_aligned_error', 'logits'),
+    ('representations', 'pair'),
+})
+# Outputs without residue dimensions.
+_UNPADDED_OUTPUTS = frozenset({'bin_edges', 'breaks'})
+
+
+def get_bucket_size(size: int, bucket_sizes: Optional[Sequence[int]]) -> int:
+  """Returns the smallest bucket that fits size, or size if none does."""
+  for bucket_size in sorted(bucket_sizes or ()):
+    if bucket_size >= size:
+      return bucket_size
+  return size
+
+
+def _feature_schema(
+    config: ml_collections.ConfigDict,
+    multimer_mode: bool) -> Mapping[str, Sequence[Optional[str]]]:
+  if multimer_mode:
+    return _MULTIMER_FEATURE_SCHEMA
+  # Processed monomer features have a leading ensemble dimension.
+  return {k: [None] + list(v) for k, v in config.data.eval.feat.items()}
+
+
+def pad_features(
+    feat: Mapping[str, np.ndarray],
+    config: ml_collections.ConfigDict,
+    multimer_mode: bool,
+    residue_buckets: Optional[Sequence[int]],
+    msa_buckets: Optional[Sequence[int]] = None
+    ) -> Mapping[str, np.ndarray]:
+  """Zero-pads the residue and MSA row dimensions of the features to buckets.
+
+  Masks, e.g. seq_mask and msa_mask, are padded with zeros, so the padding is
+  ignored by the model. The monomer input pipeline already pads the MSA rows
+  and templates to the sizes in the config, so only the residues of monomer
+  features are padded. Multimer features always have the same number of
+  templates, so their residues and MSA rows are padded.
+
+  Args:
+    feat: The model inputs, as returned by RunModel.process_features.
+    config: The model config.
+    multimer_mode: Whether the features are multimer model inputs.
+    residue_buckets: The sizes the residue dimension may be padded to.
+    msa_buckets: The sizes the MSA row dimension of multimer inputs may be
+      padded to.
+
+  Returns:
+    The padded features. Features without dimensions to pad are returned
+    unchanged.
+  """
+  schema = _feature_schema(config, multimer_mode)
+  num_res = feat['aatype'].shape[-1]
+  pad_sizes = {NUM_RES: get_bucket_size(num_res, residue_buckets)}
+  if multimer_mode and 'msa' in feat:
+    pad_sizes[NUM_MSA_SEQ] = get_bucket_size(
+        feat['msa'].shape[0], msa_buckets)
+
+  padded = {}
+  for k, v in feat.items():
+    v = np.asarray(v)
+    dims = schema.get(k)
+    if dims is None or len(dims) != v.ndim:
+      padded[k] = v
+      continue
+    padding = [(0, pad_sizes.get(dim, size) - size)
+               for dim, size in zip(dims, v.shape)]
+    if any(after for _, after in padding):
+      v = np.pad(v, padding)
+    padded[k] = v
+  return padded
+
+
+def crop_prediction(
+    prediction_result: MutableMapping[str, Any],
+    num_res: int,
+    padded_num_res: int) -> MutableMapping[str, Any]:
+  """Crops the residue dimensions of padded model outputs to num_res."""
+  if num_res == padded_num_res:
+    return prediction_result
+
+  def crop(path, value):
+    path = tuple(path)
+    if not getattr(value, 'ndim', 0) or path[-1] in _UNPADDED_OUTPUTS:
+      return value
+    if path in _MSA_OUTPUTS:
+      residue_axes = (1,)
+    elif path in _PAIR_OUTPUTS:
+      residue_axes = (0, 1)
+    else:
+      residue_axes = (0,)
+    index = [slice(None)] * value.ndim
+    for axis in residue_axes:
+      if axis < value.ndim and value.shape[axis] == padded_num_res:
+        index[axis] = slice(0, num_res)
+    return value[tuple(index)]
+
+  return tree.map_structure_with_path(crop, prediction_result)
@@ -0,0 +1,92 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bucketing."""
+
+from absl.testing import absltest
+from alphafold.model import bucketing
+from alphafold.model import config
+import numpy as np
+
+
+class BucketingTest(absltest.TestCase):
+
+  def test_get_bucket_size(self):
+    self.assertEqual(16, bucketing.get_bucket_size(13, [32, 16]))
+    self.assertEqual(16, bucketing.get_bucket_size(16, [16, 32]))
+    self.assertEqual(40, bucketing.get_bucket_size(40, [16, 32]))
+    self.assertEqual(13, bucketing.get_bucket_size(13, None))
+
+  def test_pad_monomer_features(self):
+    model_config = config.model_config('model_1')
+    feat = {
+        'aatype': np.ones((1, 13), np.int32),
+        'seq_mask': np.ones((1, 13), np.float32),
+        'msa_feat': np.ones((1, 508, 13, 49), np.float32),
+        'template_mask': np.ones((1, 4), np.float32),
+        'seq_length': np.full((1,), 13, np.int32),
+    }
+    padded = bucketing.pad_features(
+        feat, model_config, multimer_mode=False, residue_buckets=[16],
+        msa_buckets=[1024])
+    self.assertEqual((1, 16), padded['aatype'].shape)
+    self.assertEqual((1, 508, 16, 49), padded['msa_feat'].shape)
+    self.assertEqual((1, 4), padded['template_mask'].shape)
+    np.testing.assert_array_equal([13], padded['seq_length'])
+    np.testing.assert_array_equal([[1] * 13 + [0] * 3], padded['seq_mask'])
+
+  def test_pad_multimer_features(self):
+    model_config = config.model_config('model_1_multimer_v3')
+    feat = {
+        'aatype': np.ones((13,), np.int32),
+        'msa': np.ones((5, 13), np.int32),
+        'msa_mask': np.ones((5, 13), np.float32),
+        'cluster_bias_mask': np.ones((5,), np.float32),
+        'template_all_atom_mask': np.ones((4, 13, 37), np.float32),
+        'num_alignments': np.asarray(5, np.int32),
+    }
+    padded = bucketing.pad_features(
+        feat, model_config, multimer_mode=True, residue_buckets=[16],
+        msa_buckets=[8])
+    self.assertEqual((16,), padded['aatype'].shape)
+    self.assertEqual((8, 16), padded['msa'].shape)
+    self.assertEqual(65, padded['msa_mask'].sum())
+    self.assertEqual((8,), padded['cluster_bias_mask'].shape)
+    self.assertEqual((4, 16, 37), padded['template_all_atom_mask'].shape)
+    self.assertEqual(5, padded['num_alignments'])
+
+  def test_crop_prediction(self):
+    prediction_result = {
+        'distogram': {'logits': np.zeros((16, 16, 64)),
+                      'bin_edges': np.zeros((16,))},
+        'masked_msa': {'logits': np.zeros((16, 16, 23))},
+        'structure_module': {'final_atom_positions': np.zeros((16, 37, 3))},
+        'predicted_aligned_error': {'asym_id': np.zeros((16,))},
+        'num_recycles': np.asarray(3),
+    }
+    cropped = bucketing.crop_prediction(
+        prediction_result, num_res=13, padded_num_res=16)
+    self.assertEqual((13, 13, 64), cropped['distogram']['logits'].shape)
+    self.assertEqual((16,), cropped['distogram']['bin_edges'].shape)
+    self.assertEqual((16, 13, 23), cropped['masked_msa']['logits'].shape)
+    self.assertEqual(
+        (13, 37, 3),
+        cropped['structure_module']['final_atom_positions'].shape)
+    self.assertEqual(
+        (13,), cropped['predicted_aligned_error']['asym_id'].shape)
+    self.assertEqual(3, cropped['num_recycles'])
+
+
+if __name__ == '__main__':
+  absltest.main()
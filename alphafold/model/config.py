@@ -168,6 +168,7 @@ CONFIG = ml_collections.ConfigDict({
                 'num_alignments', 'seq_length', 'between_segment_residues',
                 'deletion_matrix'
             ],
+            'use_numpy_pipeline': False,
             'use_templates': False,
         },
         'eval': {
@@ -378,6 +379,8 @@ CONFIG = ml_collections.ConfigDict({
             }
         },
         'global_config': {
+            'bfloat16': False,
+            'bfloat16_output': False,
             'deterministic': False,
             'multimer_mode': False,
             'subbatch_size': 4,
@@ -456,6 +459,12 @@ CONFIG = ml_collections.ConfigDict({
             },
         },
         'num_recycle': 3,
+        # A negative value indicates that no early stopping will occur, i.e.
+        # the model will always run `num_recycle` number of recycling
+        # iterations.  A positive value will enable early stopping if the
+        # difference in pairwise distances is less than the tolerance between
+        # recycling steps.
+        'recycle_early_stop_tolerance': -1.0,
         'resample_msa_in_recycling': True
     },
 })
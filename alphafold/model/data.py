@@ -15,18 +15,125 @@
 """Convenience functions for reading data."""
 
 import io
+import json
 import os
+import struct
+from typing import Dict, Mapping, Optional
+from alphafold.common import file_utils
 from alphafold.model import utils
 import haiku as hk
 import numpy as np
 # Internal import (7716).
 
+# Parameter store files start with this magic and the little-endian length of
+# the JSON header that follows. The arrays come after the header, uncompressed
+# and aligned, so that they can be memory-mapped and used without copies.
+_PARAMS_STORE_MAGIC = b'AFPARAM1'
+_PARAMS_STORE_ALIGNMENT = 64
+_PARAMS_STORE_FORMAT_VERSION = 1
 
-def get_model_haiku_params(model_name: str, data_dir: str) -> hk.Params:
-  """Get the Haiku parameters from a model name."""
+
+def _align(offset: int) -> int:
+  return -(-offset // _PARAMS_STORE_ALIGNMENT) * _PARAMS_STORE_ALIGNMENT
+
+
+def save_params_store(path: str, params: Mapping[str, np.ndarray]):
+  """Saves flat parameters as a memory-mappable parameter store file.
+
+  The file is written next to path and then moved into place, so that
+  processes that map the file concurrently never see a partial one.
+
+  Args:
+    path: The path of the parameter store file.
+    params: The flat parameters, as in the params_*.npz files.
+  """
+  # Reads each array of an npz file once.
+  params = {name: np.asarray(array) for name, array in params.items()}
+  arrays = {}
+  offset = 0
+  for name, array in params.items():
+    arrays[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                    'offset': offset}
+    offset = _align(offset + array.nbytes)
+  header = json.dumps({'format_version': _PARAMS_STORE_FORMAT_VERSION,
+                       'arrays': arrays}).encode('utf-8')
+  data_start = _align(len(_PARAMS_STORE_MAGIC) + 8 + len(header))
+
+  with file_utils.atomic_write(path, 'wb') as f:
+    f.write(_PARAMS_STORE_MAGIC)
+    f.write(struct.pack('<Q', len(header)))
+    f.write(header)
+    for name, array in params.items():
+      f.seek(data_start + arrays[name]['offset'])
+      f.write(np.ascontiguousarray(array).tobytes())
+    f.truncate(data_start + offset)
+
+
+def load_params_store(path: str) -> Dict[str, np.ndarray]:
+  """Memory-maps the flat parameters of a parameter store file.
+
+  Args:
+    path: The path of the parameter store file.
+
+  Returns:
+    The flat parameters, as read-only arrays backed by the file. Processes
+    that load the same file share its pages.
+
+  Raises:
+    ValueError: If the file is not a parameter store of a supported version.
+  """
+  data = np.memmap(path, dtype=np.uint8, mode='r')
+  magic_size = len(_PARAMS_STORE_MAGIC)
+  if data[:magic_size].tobytes() != _PARAMS_STORE_MAGIC:
+    raise ValueError(f'{path} is not a parameter store.')
+  header_size, = struct.unpack(
+      '<Q', data[magic_size:magic_size + 8].tobytes())
+  header = json.loads(
+      data[magic_size + 8:magic_size + 8 + header_size].tobytes())
+  if header['format_version'] > _PARAMS_STORE_FORMAT_VERSION:
+    raise ValueError(
+        f'Parameter store {path} has format version '
+        f'{header["format_version"]}, this reader supports up to '
+        f'{_PARAMS_STORE_FORMAT_VERSION}.')
+  data_start = _align(magic_size + 8 + header_size)
+
+  params = {}
+  for name, info in header['arrays'].items():
+    dtype = np.dtype(info['dtype'])
+    start = data_start + info['offset']
+    size = int(np.prod(info['shape'])) * dtype.itemsize
+    params[name] = data[start:start + size].view(dtype).reshape(info['shape'])
+  return params
+
+
+def get_model_haiku_params(
+    model_name: str,
+    data_dir: str,
+    params_store_dir: Optional[str] = None) -> hk.Params:
+  """Get the Haiku parameters from a model name.
+
+  Args:
+    model_name: The name of the model.
+    data_dir: The data directory with the params/params_*.npz files.
+    params_store_dir: If set, the parameters are memory-mapped from a
+      parameter store file in this directory instead of being read from the
+      npz file. The store file is converted from the npz file on first use.
+
+  Returns:
+    The Haiku parameters.
+  """
 
   path = os.path.join(data_dir, 'params', f'params_{model_name}.npz')
 
+  if params_store_dir:
+    store_path = os.path.join(params_store_dir, f'params_{model_name}.bin')
+    if not os.path.exists(store_path):
+      os.makedirs(params_store_dir, exist_ok=True)
+      with open(path, 'rb') as f:
+        save_params_store(
+            store_path, np.load(io.BytesIO(f.read()), allow_pickle=False))
+    return utils.flat_params_to_haiku(load_params_store(store_path))
+
   with open(path, 'rb') as f:
     params = np.load(io.BytesIO(f.read()), allow_pickle=False)
 
@@ -0,0 +1,84 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for data."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+from alphafold.model import data
+import numpy as np
+
+
+def _flat_params():
+  rng = np.random.default_rng(0)
+  return {
+      'alphafold/alphafold_iteration/evoformer//weights': rng.normal(
+          size=(3, 5, 7)).astype(np.float32),
+      'alphafold/alphafold_iteration/evoformer//bias': rng.normal(
+          size=(7,)).astype(np.float32),
+      'alphafold/alphafold_iteration/structure_module//scale': np.float32(2.),
+  }
+
+
+class DataTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.data_dir = tempfile.mkdtemp(dir=absltest.get_default_test_tmpdir())
+    os.makedirs(os.path.join(self.data_dir, 'params'))
+    np.savez(os.path.join(self.data_dir, 'params', 'params_model_1.npz'),
+             **_flat_params())
+
+  def test_params_store_round_trip(self):
+    path = os.path.join(self.data_dir, 'params.bin')
+    data.save_params_store(path, _flat_params())
+    params = data.load_params_store(path)
+
+    self.assertSameElements(_flat_params(), params)
+    for name, value in _flat_params().items():
+      self.assertEqual(params[name].dtype, value.dtype)
+      np.testing.assert_array_equal(params[name], value)
+      self.assertFalse(params[name].flags.writeable)
+      self.assertEqual(params[name].ctypes.data % 64, 0)
+
+  def test_params_store_has_mode_of_new_files(self):
+    path = os.path.join(self.data_dir, 'params.bin')
+    data.save_params_store(path, _flat_params())
+    umask = os.umask(0)
+    os.umask(umask)
+    # Not only readable by the owner, like temporary files.
+    self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+
+  def test_store_is_converted_once(self):
+    store_dir = os.path.join(self.data_dir, 'params_store')
+    expected = data.get_model_haiku_params('model_1', self.data_dir)
+    params = data.get_model_haiku_params('model_1', self.data_dir,
+                                         params_store_dir=store_dir)
+    store_path = os.path.join(store_dir, 'params_model_1.bin')
+    mtime = os.path.getmtime(store_path)
+    params = data.get_model_haiku_params('model_1', self.data_dir,
+                                         params_store_dir=store_dir)
+    self.assertEqual(os.path.getmtime(store_path), mtime)
+
+    self.assertSameElements(expected, params)
+    for scope in expected:
+      for name in expected[scope]:
+        np.testing.assert_array_equal(params[scope][name],
+                                      expected[scope][name])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,187 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Confidence metrics computed on the device, in JAX.
+
+JAX versions of the functions in alphafold.common.confidence, so that the
+metrics are computed where the logits are, and only the metrics have to be
+transferred to the host. The model outputs may be padded: the metrics only
+take the first num_res residues into account.
+"""
+
+import functools
+from typing import Any, Dict, Mapping, Optional
+
+import jax
+import jax.numpy as jnp
+
+
+def compute_plddt(logits: jnp.ndarray) -> jnp.ndarray:
+  """Computes per-residue pLDDT from logits.
+
+  Args:
+    logits: [num_res, num_bins] output from the PredictedLDDTHead.
+
+  Returns:
+    plddt: [num_res] per-residue pLDDT.
+  """
+  num_bins = logits.shape[-1]
+  bin_width = 1.0 / num_bins
+  bin_centers = jnp.arange(start=0.5 * bin_width, stop=1.0, step=bin_width)
+  probs = jax.nn.softmax(logits, axis=-1)
+  predicted_lddt_ca = jnp.sum(probs * bin_centers[None, :], axis=-1)
+  return predicted_lddt_ca * 100
+
+
+def _calculate_bin_centers(breaks: jnp.ndarray) -> jnp.ndarray:
+  """Gets the bin centers from the bin edges, see confidence.py."""
+  step = (breaks[1] - breaks[0])
+  # Add half-step to get the center
+  bin_centers = breaks + step / 2
+  # Add a catch-all bin at the end.
+  return jnp.concatenate([bin_centers, bin_centers[-1:] + step], axis=0)
+
+
+def compute_predicted_aligned_error(
+    logits: jnp.ndarray,
+    breaks: jnp.ndarray) -> Dict[str, jnp.ndarray]:
+  """Computes aligned confidence metrics from logits.
+
+  Args:
+    logits: [num_res, num_res, num_bins] the logits output from
+      PredictedAlignedErrorHead.
+    breaks: [num_bins - 1] the error bin edges.
+
+  Returns:
+    aligned_confidence_probs: [num_res, num_res, num_bins] the predicted
+      aligned error probabilities over bins for each residue pair.
+    predicted_aligned_error: [num_res, num_res] the expected aligned distance
+      error for each pair of residues.
+    max_predicted_aligned_error: The maximum predicted error possible.
+  """
+  aligned_confidence_probs = jax.nn.softmax(logits, axis=-1)
+  bin_centers = _calculate_bin_centers(breaks)
+  return {
+      'aligned_confidence_probs': aligned_confidence_probs,
+      'predicted_aligned_error': jnp.sum(
+          aligned_confidence_probs * bin_centers, axis=-1),
+      'max_predicted_aligned_error': bin_centers[-1],
+  }
+
+
+def predicted_tm_score(
+    logits: jnp.ndarray,
+    breaks: jnp.ndarray,
+    residue_weights: jnp.ndarray,
+    asym_id: Optional[jnp.ndarray] = None,
+    interface: bool = False) -> jnp.ndarray:
+  """Computes predicted TM alignment or predicted interface TM alignment score.
+
+  Args:
+    logits: [num_res, num_res, num_bins] the logits output from
+      PredictedAlignedErrorHead.
+    breaks: [num_bins] the error bins.
+    residue_weights: [num_res] the per residue weights to use for the
+      expectation, zero for padding.
+    asym_id: [num_res] the asymmetric unit ID - the chain ID. Only needed for
+      ipTM calculation, i.e. when interface=True.
+    interface: If True, interface predicted TM score is computed.
+
+  Returns:
+    ptm_score: The predicted TM alignment or the predicted iTM score.
+  """
+  bin_centers = _calculate_bin_centers(breaks)
+
+  num_res = jnp.floor(jnp.sum(residue_weights))
+  # Clip num_res to avoid negative/undefined d0.
+  clipped_num_res = jnp.maximum(num_res, 19)
+
+  # Compute d_0(num_res) as defined by TM-score, eqn. (5) in Yang & Skolnick
+  # "Scoring function for automated assessment of protein structure template
+  # quality", 2004: http://zhanglab.ccmb.med.umich.edu/papers/2004_3.pdf
+  d0 = 1.24 * (clipped_num_res - 15) ** (1./3) - 1.8
+
+  # Convert logits to probs.
+  probs = jax.nn.softmax(logits, axis=-1)
+
+  # TM-Score term for every bin.
+  tm_per_bin = 1. / (1 + jnp.square(bin_centers) / jnp.square(d0))
+  # E_distances tm(distance).
+  predicted_tm_term = jnp.sum(probs * tm_per_bin, axis=-1)
+
+  pair_mask = jnp.ones(predicted_tm_term.shape, dtype=bool)
+  if interface:
+    pair_mask *= asym_id[:, None] != asym_id[None, :]
+
+  predicted_tm_term *= pair_mask
+
+  pair_residue_weights = pair_mask * (
+      residue_weights[None, :] * residue_weights[:, None])
+  normed_residue_mask = pair_residue_weights / (1e-8 + jnp.sum(
+      pair_residue_weights, axis=-1, keepdims=True))
+  per_alignment = jnp.sum(predicted_tm_term * normed_residue_mask, axis=-1)
+  return per_alignment[(per_alignment * residue_weights).argmax()]
+
+
+@functools.partial(jax.jit, static_argnames=('multimer_mode',))
+def get_confidence_metrics(
+    prediction_result: Mapping[str, Any],
+    num_res: jnp.ndarray,
+    multimer_mode: bool) -> Dict[str, jnp.ndarray]:
+  """Computes the confidence metrics of the first num_res residues.
+
+  The same metrics as model.get_confidence_metrics. The per-residue metrics
+  keep the (padded) residue dimensions of the outputs.
+
+  Args:
+    prediction_result: The outputs of the model.
+    num_res: The number of residues of the target. It is traced, so targets
+      of the same bucket share the compiled function.
+    multimer_mode: Whether the outputs are those of the multimer model.
+
+  Returns:
+    The confidence metrics.
+  """
+  logits = prediction_result['predicted_lddt']['logits']
+  residue_weights = (jnp.arange(logits.shape[0]) < num_res).astype(
+      jnp.float32)
+  confidence_metrics = {}
+  confidence_metrics['plddt'] = compute_plddt(logits)
+  if 'predicted_aligned_error' in prediction_result:
+    pae_outputs = prediction_result['predicted_aligned_error']
+    confidence_metrics.update(compute_predicted_aligned_error(
+        logits=pae_outputs['logits'],
+        breaks=pae_outputs['breaks']))
+    confidence_metrics['ptm'] = predicted_tm_score(
+        logits=pae_outputs['logits'],
+        breaks=pae_outputs['breaks'],
+        residue_weights=residue_weights)
+    if multimer_mode:
+      # Compute the ipTM only for the multimer model.
+      confidence_metrics['iptm'] = predicted_tm_score(
+          logits=pae_outputs['logits'],
+          breaks=pae_outputs['breaks'],
+          residue_weights=residue_weights,
+          asym_id=pae_outputs['asym_id'],
+          interface=True)
+      confidence_metrics['ranking_confidence'] = (
+          0.8 * confidence_metrics['iptm'] + 0.2 * confidence_metrics['ptm'])
+
+  if not multimer_mode:
+    # Monomer models use mean pLDDT for model ranking.
+    confidence_metrics['ranking_confidence'] = (
+        jnp.sum(confidence_metrics['plddt'] * residue_weights) /
+        jnp.sum(residue_weights))
+
+  return confidence_metrics
@@ -0,0 +1,64 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for device_confidence."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from alphafold.model import device_confidence
+from alphafold.model import model
+import numpy as np
+
+
+def _random_outputs(num_res, rng):
+  return {
+      'predicted_lddt': {
+          'logits': rng.normal(size=(num_res, 50)).astype(np.float32)},
+      'predicted_aligned_error': {
+          'logits': rng.normal(size=(num_res, num_res, 64)).astype(np.float32),
+          'breaks': np.linspace(0., 31., 63).astype(np.float32),
+          'asym_id': np.repeat([1., 2.], num_res // 2).astype(np.float32),
+      },
+  }
+
+
+class DeviceConfidenceTest(parameterized.TestCase):
+
+  @parameterized.parameters(False, True)
+  def test_matches_host_metrics_on_padded_outputs(self, multimer_mode):
+    num_res, padded_num_res = 20, 32
+    rng = np.random.default_rng(0)
+    outputs = _random_outputs(num_res, rng)
+    padded = _random_outputs(padded_num_res, rng)
+    for head, head_outputs in outputs.items():
+      for k, v in head_outputs.items():
+        if k == 'breaks':
+          padded[head][k] = v
+        else:
+          padded[head][k][tuple(slice(0, n) for n in v.shape)] = v
+
+    expected = model.get_confidence_metrics(outputs, multimer_mode)
+    actual = device_confidence.get_confidence_metrics(
+        padded, num_res=np.int32(num_res), multimer_mode=multimer_mode)
+
+    self.assertSameElements(expected, actual)
+    for k, v in expected.items():
+      actual_value = np.asarray(actual[k])
+      if actual_value.ndim:
+        actual_value = actual_value[tuple(slice(0, n) for n in v.shape)]
+      np.testing.assert_allclose(actual_value, v, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+  absltest.main()
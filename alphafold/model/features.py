@@ -14,14 +14,15 @@
 
 """Code to generate processed features."""
 import copy
-from typing import List, Mapping, Tuple
+from typing import TYPE_CHECKING, List, Mapping, Tuple
 
-from alphafold.model.tf import input_pipeline
-from alphafold.model.tf import proteins_dataset
+from alphafold.model.np import input_pipeline as np_input_pipeline
 
 import ml_collections
 import numpy as np
-import tensorflow.compat.v1 as tf
+
+if TYPE_CHECKING:
+  import tensorflow.compat.v1 as tf  # pylint: disable=g-import-not-at-top
 
 FeatureDict = Mapping[str, np.ndarray]
 
@@ -43,10 +44,24 @@ def make_data_config(
   return cfg, feature_names
 
 
-def tf_example_to_features(tf_example: tf.train.Example,
+def get_input_feature_names(config: ml_collections.ConfigDict) -> List[str]:
+  """Returns the raw features that np_example_to_features reads."""
+  _, feature_names = make_data_config(config, num_res=0)
+  return list(dict.fromkeys(
+      list(feature_names) + ['seq_length', 'deletion_matrix_int']))
+
+
+def tf_example_to_features(tf_example: 'tf.train.Example',
                            config: ml_collections.ConfigDict,
                            random_seed: int = 0) -> FeatureDict:
   """Converts tf_example to numpy feature dictionary."""
+  # TensorFlow is imported on first use, the NumPy pipeline does not need it.
+  # pylint: disable=g-import-not-at-top,redefined-outer-name
+  from alphafold.model.tf import input_pipeline
+  from alphafold.model.tf import proteins_dataset
+  import tensorflow.compat.v1 as tf
+  # pylint: enable=g-import-not-at-top,redefined-outer-name
+
   num_res = int(tf_example.features.feature['seq_length'].int64_list.value[0])
   cfg, feature_names = make_data_config(config, num_res=num_res)
 
@@ -78,7 +93,12 @@ def tf_example_to_features(tf_example: tf.train.Example,
 def np_example_to_features(np_example: FeatureDict,
                            config: ml_collections.ConfigDict,
                            random_seed: int = 0) -> FeatureDict:
-  """Preprocesses NumPy feature dict using TF pipeline."""
+  """Preprocesses NumPy feature dict using TF or NumPy pipeline.
+
+  The NumPy pipeline is used if config.data.common.use_numpy_pipeline is set.
+  It computes the same features without building and running a TensorFlow
+  graph, but draws different random numbers for the same seed.
+  """
   np_example = dict(np_example)
   num_res = int(np_example['seq_length'][0])
   cfg, feature_names = make_data_config(config, num_res=num_res)
@@ -87,6 +107,19 @@ def np_example_to_features(np_example: FeatureDict,
     np_example['deletion_matrix'] = (
         np_example.pop('deletion_matrix_int').astype(np.float32))
 
+  if cfg.common.get('use_numpy_pipeline', False):
+    arrays = np_input_pipeline.np_to_feature_dict(
+        np_example=np_example, features=feature_names)
+    features = np_input_pipeline.process_arrays_from_config(
+        arrays, cfg, random_seed=random_seed)
+    return {k: v for k, v in features.items() if v.dtype != 'O'}
+
+  # pylint: disable=g-import-not-at-top
+  from alphafold.model.tf import input_pipeline
+  from alphafold.model.tf import proteins_dataset
+  import tensorflow.compat.v1 as tf
+  # pylint: enable=g-import-not-at-top
+
   tf_graph = tf.Graph()
   with tf_graph.as_default(), tf.device('/device:CPU:0'):
     tf.compat.v1.set_random_seed(random_seed)
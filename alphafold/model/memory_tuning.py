@@ -0,0 +1,169 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selects the subbatch and chunk sizes of the model for a memory budget.
+
+The subbatch_size and chunk_size fields of the model config trade memory for
+speed: larger values run more of a module at once. The sizes are scaled
+together, from no subbatching at all down to a fraction of their defaults, and
+the largest scale whose estimated peak memory fits the budget is used.
+"""
+
+import copy
+import threading
+from typing import Callable, Dict, Mapping, Optional, Sequence, Tuple
+
+from absl import logging
+import ml_collections
+import numpy as np
+
+# The names of the config fields that are scaled.
+_CHUNK_SIZE_FIELDS = ('subbatch_size', 'chunk_size')
+
+# The scales of the sizes relative to the config, from largest to smallest.
+# None runs the modules without subbatching.
+DEFAULT_SCALES = (None, 64, 32, 16, 8, 4, 2, 1, 0.5, 0.25)
+
+# Estimates the peak memory in bytes of the model with the given config on
+# the given features, run batch_size times at once. Returns None if the
+# memory cannot be estimated.
+EstimateFn = Callable[
+    [ml_collections.ConfigDict, Mapping[str, np.ndarray], int], Optional[int]]
+
+# The selected model configs, by model config, feature shapes, batch size and
+# budget.
+_SELECTED_CONFIGS: Dict[Tuple[str, Tuple[Tuple[str, Tuple[int, ...]], ...],
+                              int, int], ml_collections.ConfigDict] = {}
+_SELECTED_CONFIGS_LOCK = threading.Lock()
+
+
+def _chunk_size_paths(
+    config: ml_collections.ConfigDict,
+    prefix: Tuple[str, ...] = ()) -> Sequence[Tuple[str, ...]]:
+  """Returns the paths of the subbatch and chunk size fields in the config."""
+  paths = []
+  for key, value in config.items():
+    if isinstance(value, ml_collections.ConfigDict):
+      paths.extend(_chunk_size_paths(value, prefix + (key,)))
+    elif key in _CHUNK_SIZE_FIELDS:
+      paths.append(prefix + (key,))
+  return paths
+
+
+def get_chunk_sizes(
+    model_config: ml_collections.ConfigDict) -> Dict[str, Optional[int]]:
+  """Returns the subbatch and chunk sizes of the model, by config path."""
+  chunk_sizes = {}
+  for path in _chunk_size_paths(model_config):
+    value = model_config
+    for key in path:
+      value = value[key]
+    chunk_sizes['.'.join(path)] = value
+  return chunk_sizes
+
+
+def scale_chunk_sizes(
+    model_config: ml_collections.ConfigDict,
+    scale: Optional[float]) -> ml_collections.ConfigDict:
+  """Returns a copy of the model config with scaled subbatch and chunk sizes.
+
+  Args:
+    model_config: The model section of the model config, i.e. config.model.
+    scale: The factor to scale the sizes by, or None to turn subbatching off.
+
+  Returns:
+    The scaled model config. Sizes are at least 1.
+  """
+  model_config = copy.deepcopy(model_config)
+  for path in _chunk_size_paths(model_config):
+    parent = model_config
+    for key in path[:-1]:
+      parent = parent[key]
+    if scale is None or parent[path[-1]] is None:
+      parent[path[-1]] = None
+    else:
+      parent[path[-1]] = max(1, int(parent[path[-1]] * scale))
+  return model_config
+
+
+def select_chunk_sizes(
+    model_config: ml_collections.ConfigDict,
+    feat: Mapping[str, np.ndarray],
+    memory_budget_bytes: int,
+    estimate_fn: EstimateFn,
+    batch_size: int = 1,
+    scales: Sequence[Optional[float]] = DEFAULT_SCALES,
+    ) -> ml_collections.ConfigDict:
+  """Returns the model config with the largest sizes that fit the budget.
+
+  The peak memory decreases with the scale, so the scales are bisected. The
+  selection is cached by model config, feature shapes, batch size and budget.
+
+  Args:
+    model_config: The model section of the model config, i.e. config.model.
+    feat: The features the model runs on, as passed to the model.
+    memory_budget_bytes: The device memory available to the model.
+    estimate_fn: Estimates the peak memory of a model config.
+    batch_size: How many predictions are made at once.
+    scales: The scales to select from, from largest to smallest.
+
+  Returns:
+    The model config with scaled subbatch and chunk sizes. The config is
+    returned unchanged if the memory cannot be estimated, and with the
+    smallest sizes if none fit.
+  """
+  key = (model_config.to_json_best_effort(sort_keys=True),
+         tuple(sorted((k, v.shape) for k, v in feat.items())),
+         batch_size, memory_budget_bytes)
+  with _SELECTED_CONFIGS_LOCK:
+    if key in _SELECTED_CONFIGS:
+      return _SELECTED_CONFIGS[key]
+
+  configs = [scale_chunk_sizes(model_config, scale) for scale in scales]
+  peak_memory = {}
+
+  def fits(i):
+    peak_memory[i] = estimate_fn(configs[i], feat, batch_size)
+    logging.info('Estimated peak memory with subbatch and chunk sizes scaled '
+                 'by %s: %s bytes', scales[i], peak_memory[i])
+    return (peak_memory[i] is not None and
+            peak_memory[i] <= memory_budget_bytes)
+
+  lo, hi = 0, len(configs) - 1
+  if not fits(hi):
+    if peak_memory[hi] is None:
+      logging.warning('The peak memory cannot be estimated on this backend, '
+                      'keeping the configured subbatch and chunk sizes.')
+      selected = model_config
+    else:
+      logging.warning('The model needs an estimated %d bytes even with the '
+                      'smallest subbatch and chunk sizes, more than the '
+                      'budget of %d bytes.', peak_memory[hi],
+                      memory_budget_bytes)
+      selected = configs[hi]
+  else:
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if fits(mid):
+        hi = mid
+      else:
+        lo = mid + 1
+    selected = configs[lo]
+    logging.info('Selected subbatch and chunk sizes %s for an estimated %d of '
+                 '%d bytes.', get_chunk_sizes(selected), peak_memory[lo],
+                 memory_budget_bytes)
+
+  with _SELECTED_CONFIGS_LOCK:
+    _SELECTED_CONFIGS[key] = selected
+  return selected
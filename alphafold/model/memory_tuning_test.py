@@ -0,0 +1,80 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for memory_tuning."""
+
+from absl.testing import absltest
+from alphafold.model import config
+from alphafold.model import memory_tuning
+import numpy as np
+
+
+def _fake_estimate(model_config, feat, batch_size):
+  """Memory grows with the subbatch size, unlimited without subbatching."""
+  del feat
+  subbatch_size = model_config.global_config.subbatch_size
+  if subbatch_size is None:
+    return 10**12
+  return batch_size * 1000 * subbatch_size
+
+
+class MemoryTuningTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.model_config = config.model_config('model_1').model
+    self.feat = {'aatype': np.zeros((1, 16), np.int32)}
+
+  def test_scale_chunk_sizes(self):
+    scaled = memory_tuning.scale_chunk_sizes(self.model_config, 0.5)
+    chunk_sizes = memory_tuning.get_chunk_sizes(scaled)
+    self.assertEqual(chunk_sizes['global_config.subbatch_size'], 2)
+    self.assertEqual(
+        chunk_sizes['embeddings_and_evoformer.evoformer.outer_product_mean.'
+                    'chunk_size'], 64)
+    self.assertEqual(
+        chunk_sizes['embeddings_and_evoformer.template.subbatch_size'], 64)
+    # The config itself is unchanged.
+    self.assertEqual(self.model_config.global_config.subbatch_size, 4)
+
+    unchunked = memory_tuning.scale_chunk_sizes(self.model_config, None)
+    self.assertSameElements(
+        [None], memory_tuning.get_chunk_sizes(unchunked).values())
+
+  def test_selects_largest_fitting_sizes(self):
+    selected = memory_tuning.select_chunk_sizes(
+        self.model_config, self.feat, memory_budget_bytes=20_000,
+        estimate_fn=_fake_estimate)
+    self.assertEqual(selected.global_config.subbatch_size, 16)
+
+    selected = memory_tuning.select_chunk_sizes(
+        self.model_config, self.feat, memory_budget_bytes=20_000,
+        estimate_fn=_fake_estimate, batch_size=2)
+    self.assertEqual(selected.global_config.subbatch_size, 8)
+
+  def test_smallest_sizes_if_nothing_fits(self):
+    selected = memory_tuning.select_chunk_sizes(
+        self.model_config, self.feat, memory_budget_bytes=10,
+        estimate_fn=_fake_estimate)
+    self.assertEqual(selected.global_config.subbatch_size, 1)
+
+  def test_unchanged_without_estimate(self):
+    selected = memory_tuning.select_chunk_sizes(
+        self.model_config, self.feat, memory_budget_bytes=123,
+        estimate_fn=lambda *_: None)
+    self.assertIs(selected, self.model_config)
+
+
+if __name__ == '__main__':
+  absltest.main()
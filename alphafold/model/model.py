@@ -13,20 +13,29 @@
 # limitations under the License.
 
 """Code for constructing the model."""
-from typing import Any, Mapping, Optional, Union
+import collections
+import copy
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 from absl import logging
 from alphafold.common import confidence
+from alphafold.model import bucketing
+from alphafold.model import device_confidence
 from alphafold.model import features
+from alphafold.model import memory_tuning
 from alphafold.model import modules
 from alphafold.model import modules_multimer
 import haiku as hk
 import jax
 import ml_collections
 import numpy as np
-import tensorflow.compat.v1 as tf
 import tree
 
+if TYPE_CHECKING:
+  import tensorflow.compat.v1 as tf  # pylint: disable=g-import-not-at-top
+
 
 def get_confidence_metrics(
     prediction_result: Mapping[str, Any],
@@ -61,33 +70,209 @@ def get_confidence_metrics(
   return confidence_metrics
 
 
+def enable_compilation_cache(cache_dir: str,
+                             min_compile_time_secs: float = 1.0):
+  """Enables the persistent JAX compilation cache in cache_dir.
+
+  Compiled models are stored on disk and reused by later processes. The cache
+  key covers the compiled computation, i.e. the model config and the shapes of
+  the features and parameters, as well as the backend, the devices and the JAX
+  version, so stale entries are never used. Must be called before anything is
+  compiled in this process.
+
+  Args:
+    cache_dir: The cache directory, which may be shared between processes.
+    min_compile_time_secs: Only computations that take at least this long to
+      compile are cached.
+  """
+  os.makedirs(cache_dir, exist_ok=True)
+  jax.config.update('jax_compilation_cache_dir', cache_dir)
+  jax.config.update('jax_persistent_cache_min_compile_time_secs',
+                    min_compile_time_secs)
+  logging.info('Using the persistent compilation cache in %s', cache_dir)
+
+
+# The jitted init and apply functions of the model, by model config. Models
+# that differ only in their parameters share them, so XLA compiles the model
+# once per feature shape rather than once per model.
+_MODEL_FNS: Dict[str, Tuple[Callable[..., Any], Callable[..., Any]]] = {}
+_BATCHED_APPLY_FNS: Dict[Tuple[str, bool], Callable[..., Any]] = {}
+_MODEL_FNS_LOCK = threading.Lock()
+
+
+def get_model_fns(
+    model_config: ml_collections.ConfigDict
+    ) -> Tuple[Callable[..., Any], Callable[..., Any]]:
+  """Returns the jitted (init, apply) functions of the model.
+
+  The functions take the parameters as arguments, so they are shared by all
+  models with the same config. E.g. model_1 and model_2 of the monomer preset
+  share one function and model_3 to model_5, which use no templates, another.
+
+  Args:
+    model_config: The model section of the model config, i.e. config.model.
+
+  Returns:
+    The init and apply functions of the hk.transform of the model.
+  """
+  key = model_config.to_json_best_effort(sort_keys=True)
+  with _MODEL_FNS_LOCK:
+    if key not in _MODEL_FNS:
+      # A copy, so that later changes to the config do not change the model.
+      model_config = copy.deepcopy(model_config)
+      if model_config.global_config.multimer_mode:
+        def _forward_fn(batch):
+          model = modules_multimer.AlphaFold(model_config)
+          return model(
+              batch,
+              is_training=False)
+      else:
+        def _forward_fn(batch):
+          model = modules.AlphaFold(model_config)
+          return model(
+              batch,
+              is_training=False,
+              compute_loss=False,
+              ensemble_representations=True)
+
+      transformed = hk.transform(_forward_fn)
+      _MODEL_FNS[key] = (jax.jit(transformed.init), jax.jit(transformed.apply))
+    return _MODEL_FNS[key]
+
+
+def get_batched_apply_fn(
+    model_config: ml_collections.ConfigDict,
+    batch_features: bool = False) -> Callable[..., Any]:
+  """Returns the jitted apply function of the model, vmapped over PRNG keys.
+
+  The function takes the parameters, a stack of PRNG keys and the features,
+  and returns the outputs for all keys stacked along a new leading axis. Like
+  the functions of get_model_fns, it is shared by all models with the same
+  config.
+
+  Args:
+    model_config: The model section of the model config, i.e. config.model.
+    batch_features: Whether the features are stacked along a leading axis as
+      well, one set of features per PRNG key. Otherwise all keys share the
+      same features.
+  """
+  key = (model_config.to_json_best_effort(sort_keys=True), batch_features)
+  _, apply = get_model_fns(model_config)
+  with _MODEL_FNS_LOCK:
+    if key not in _BATCHED_APPLY_FNS:
+      _BATCHED_APPLY_FNS[key] = jax.jit(jax.vmap(
+          apply, in_axes=(None, 0, 0 if batch_features else None)))
+    return _BATCHED_APPLY_FNS[key]
+
+
+def estimate_peak_memory(
+    model_config: ml_collections.ConfigDict,
+    feat: features.FeatureDict,
+    batch_size: int = 1) -> Optional[int]:
+  """Estimates the peak device memory of a prediction in bytes.
+
+  The model is compiled for the shapes of the features with a single Evoformer
+  and extra MSA block, which needs as much temporary memory as the full stacks
+  since their blocks run one at a time, and the memory analysis of the
+  compiled computation is added to the size of the parameters of the full
+  model. Nothing is run on the device.
+
+  Args:
+    model_config: The model section of the model config, i.e. config.model.
+    feat: The (padded) features, as passed to the model.
+    batch_size: How many predictions run at once, vmapped as in
+      RunModel.predict_batch.
+
+  Returns:
+    The estimated peak memory, or None if the backend does not report the
+    memory usage of compiled computations, like the CPU backend.
+  """
+  reduced_config = copy.deepcopy(model_config)
+  reduced_config.embeddings_and_evoformer.evoformer_num_block = 1
+  reduced_config.embeddings_and_evoformer.extra_msa_stack_num_block = 1
+  init, apply = get_model_fns(reduced_config)
+  rng = jax.random.PRNGKey(0)
+  feat = jax.tree.map(lambda x: jax.ShapeDtypeStruct(x.shape, x.dtype), feat)
+  reduced_params = jax.eval_shape(init, rng, feat)
+  memory_stats = apply.lower(
+      reduced_params, rng, feat).compile().memory_analysis()
+  if memory_stats is None or not memory_stats.temp_size_in_bytes:
+    return None
+
+  full_params = jax.eval_shape(get_model_fns(model_config)[0], rng, feat)
+  def num_bytes(tree):
+    return sum(x.size * x.dtype.itemsize for x in jax.tree.leaves(tree))
+  return (batch_size * (memory_stats.temp_size_in_bytes +
+                        memory_stats.output_size_in_bytes) +
+          memory_stats.argument_size_in_bytes - num_bytes(reduced_params) +
+          num_bytes(full_params))
+
+
 class RunModel:
   """Container for JAX model."""
 
   def __init__(self,
                config: ml_collections.ConfigDict,
-               params: Optional[Mapping[str, Mapping[str, jax.Array]]] = None):
-    self.config = config
+               params: Optional[Mapping[str, Mapping[str, jax.Array]]] = None,
+               residue_buckets: Optional[Sequence[int]] = None,
+               msa_buckets: Optional[Sequence[int]] = None,
+               memory_budget_bytes: Optional[int] = None,
+               output_keys: Optional[Sequence[str]] = None):
+    """Initializes the model.
+
+    Args:
+      config: The model config.
+      params: The model parameters. Randomly initialized if not set.
+      residue_buckets: If set, the features are padded to the smallest of these
+        numbers of residues that fits them, and the outputs are cropped back,
+        so that the model is compiled once per bucket instead of once per
+        sequence length. Longer inputs are not padded.
+      msa_buckets: Like residue_buckets, for the MSA rows of multimer inputs.
+        The monomer input pipeline already pads the MSA to a fixed size.
+      memory_budget_bytes: If set, the device memory available to the model.
+        Before each prediction, the subbatch and chunk sizes of the config are
+        scaled to the largest ones whose estimated peak memory on the features
+        fits, see memory_tuning.select_chunk_sizes.
+      output_keys: If set, only these outputs of the predictions, i.e. keys of
+        the result dicts, are transferred from the device and returned. Large
+        outputs like the representations then stay on the device. By
+        default, all outputs are returned.
+    """
     self.params = params
     self.multimer_mode = config.model.global_config.multimer_mode
+    self.residue_buckets = residue_buckets
+    self.msa_buckets = msa_buckets
+    self.memory_budget_bytes = memory_budget_bytes
+    self.output_keys = (
+        frozenset(output_keys) if output_keys is not None else None)
+    # A copy, as the model section is replaced when tuning the chunk sizes.
+    self.config = copy.deepcopy(config) if memory_budget_bytes else config
+    self._base_model_config = config.model
+    self._set_model_config(config.model)
 
-    if self.multimer_mode:
-      def _forward_fn(batch):
-        model = modules_multimer.AlphaFold(self.config.model)
-        return model(
-            batch,
-            is_training=False)
-    else:
-      def _forward_fn(batch):
-        model = modules.AlphaFold(self.config.model)
-        return model(
-            batch,
-            is_training=False,
-            compute_loss=False,
-            ensemble_representations=True)
+  def _set_model_config(self, model_config: ml_collections.ConfigDict):
+    """Switches to the model functions of model_config."""
+    if model_config is not self.config.model:
+      self.config.model = model_config
+    self.chunk_sizes = memory_tuning.get_chunk_sizes(model_config)
+    self.init, self.apply = get_model_fns(model_config)
+    self.batched_apply = get_batched_apply_fn(model_config)
+    self.multi_target_apply = get_batched_apply_fn(
+        model_config, batch_features=True)
 
-    self.apply = jax.jit(hk.transform(_forward_fn).apply)
-    self.init = jax.jit(hk.transform(_forward_fn).init)
+  def _tune_chunk_sizes(self, feat: features.FeatureDict, batch_size: int = 1):
+    """Selects the chunk sizes for the padded features, given a budget."""
+    if self.memory_budget_bytes:
+      self._set_model_config(memory_tuning.select_chunk_sizes(
+          self._base_model_config, feat, self.memory_budget_bytes,
+          estimate_fn=estimate_peak_memory, batch_size=batch_size))
+
+  def _pad_features(self, feat: features.FeatureDict) -> features.FeatureDict:
+    if self.residue_buckets or self.msa_buckets:
+      return bucketing.pad_features(
+          feat, self.config, self.multimer_mode, self.residue_buckets,
+          self.msa_buckets)
+    return feat
 
   def init_params(self, feat: features.FeatureDict, random_seed: int = 0):
     """Initializes the model parameters.
@@ -108,9 +293,18 @@ class RunModel:
           self.init(rng, feat))
       logging.warning('Initialized parameters randomly')
 
+  def input_feature_names(self) -> Optional[List[str]]:
+    """Returns the raw features process_features reads, None if all of them.
+
+    Feature stores only have to load these features for the model.
+    """
+    if self.multimer_mode:
+      return None
+    return features.get_input_feature_names(self.config)
+
   def process_features(
       self,
-      raw_features: Union[tf.train.Example, features.FeatureDict],
+      raw_features: Union['tf.train.Example', features.FeatureDict],
       random_seed: int) -> features.FeatureDict:
     """Processes features to prepare for feeding them into the model.
 
@@ -146,6 +340,24 @@ class RunModel:
     logging.info('Output shape was %s', shape)
     return shape
 
+  def compile(self, feat: features.FeatureDict):
+    """Compiles the model ahead of time for the shapes of the features.
+
+    With the persistent compilation cache enabled, the compiled model is
+    stored, so later predictions on features of the same shapes, also in other
+    processes, do not compile the model again.
+
+    Args:
+      feat: A dictionary of NumPy feature arrays as output by
+        RunModel.process_features. Only their shapes and dtypes are used.
+    """
+    feat = self._pad_features(feat)
+    self._tune_chunk_sizes(feat)
+    self.init_params(feat)
+    logging.info('Compiling with shape(feat) = %s',
+                 tree.map_structure(lambda x: x.shape, feat))
+    self.apply.lower(self.params, jax.random.PRNGKey(0), feat).compile()
+
   def predict(self,
               feat: features.FeatureDict,
               random_seed: int,
@@ -161,17 +373,169 @@ class RunModel:
     Returns:
       A dictionary of model outputs.
     """
+    num_res = feat['aatype'].shape[-1]
+    feat = self._pad_features(feat)
+    self._tune_chunk_sizes(feat)
     self.init_params(feat)
     logging.info('Running predict with shape(feat) = %s',
                  tree.map_structure(lambda x: x.shape, feat))
     result = self.apply(self.params, jax.random.PRNGKey(random_seed), feat)
-
-    # This block is to ensure benchmark timings are accurate. Some blocking is
-    # already happening when computing get_confidence_metrics, and this ensures
-    # all outputs are blocked on.
-    jax.tree.map(lambda x: x.block_until_ready(), result)
-    result.update(
-        get_confidence_metrics(result, multimer_mode=self.multimer_mode))
+    result = self._finalize_prediction(
+        result, num_res, padded_num_res=feat['aatype'].shape[-1])
     logging.info('Output shape was %s',
                  tree.map_structure(lambda x: x.shape, result))
     return result
+
+  def _finalize_prediction(
+      self,
+      result: Mapping[str, Any],
+      num_res: int,
+      padded_num_res: int) -> Dict[str, Any]:
+    """Adds the confidence metrics and transfers the outputs to the host.
+
+    The metrics are computed on the device, on the residues of the target
+    only. Only the selected outputs are transferred, and they are cropped to
+    num_res on the host. Transferring the outputs blocks on them, which keeps
+    the benchmark timings accurate.
+
+    Args:
+      result: The outputs of the model on the device.
+      num_res: The number of residues of the target.
+      padded_num_res: The number of residues of the (padded) model inputs.
+
+    Returns:
+      The selected outputs and confidence metrics as NumPy arrays.
+    """
+    result = dict(result)
+    result.update(device_confidence.get_confidence_metrics(
+        {k: result[k] for k in ('predicted_lddt', 'predicted_aligned_error')
+         if k in result},
+        num_res=np.int32(num_res),
+        multimer_mode=self.multimer_mode))
+    if self.output_keys is not None:
+      result = {k: v for k, v in result.items() if k in self.output_keys}
+    result = jax.device_get(result)
+    if 'ranking_confidence' in result:
+      # A float, as returned by get_confidence_metrics, e.g. for JSON output.
+      result['ranking_confidence'] = np.float64(result['ranking_confidence'])
+    return bucketing.crop_prediction(
+        result, num_res, padded_num_res=padded_num_res)
+
+  def predict_batch(self,
+                    feat: features.FeatureDict,
+                    random_seeds: Sequence[int],
+                    ) -> List[Mapping[str, Any]]:
+    """Makes one prediction per random seed on the same features at once.
+
+    The model is vmapped over the seeds, so that all predictions run in a
+    single device call. This keeps the device busy on small inputs, but needs
+    about len(random_seeds) times the memory of predict, and the model is
+    compiled once per number of seeds.
+
+    Args:
+      feat: A dictionary of NumPy feature arrays as output by
+        RunModel.process_features.
+      random_seeds: The random seeds to use when running the model, as passed
+        to predict.
+
+    Returns:
+      The model outputs for each of the random seeds, as returned by predict.
+    """
+    num_res = feat['aatype'].shape[-1]
+    feat = self._pad_features(feat)
+    self._tune_chunk_sizes(feat, batch_size=len(random_seeds))
+    self.init_params(feat)
+    logging.info('Running predict_batch of %d seeds with shape(feat) = %s',
+                 len(random_seeds),
+                 tree.map_structure(lambda x: x.shape, feat))
+    rngs = np.stack([jax.random.PRNGKey(seed) for seed in random_seeds])
+    batched_result = self.batched_apply(self.params, rngs, feat)
+    return self._unbatch_prediction(
+        batched_result, [num_res] * len(random_seeds),
+        padded_num_res=feat['aatype'].shape[-1])
+
+  def predict_targets(self,
+                      feats: Sequence[features.FeatureDict],
+                      random_seeds: Sequence[int],
+                      ) -> List[Mapping[str, Any]]:
+    """Makes predictions for several targets at once.
+
+    The features of the targets are padded to their buckets and stacked, and
+    the model is vmapped over them, so that all targets run in a single device
+    call. This keeps the device busy on small targets. All features have to
+    have the same shapes after padding, i.e. fall into the same buckets.
+
+    Args:
+      feats: The features of each target, as output by
+        RunModel.process_features.
+      random_seeds: The random seed to use for each target, as passed to
+        predict.
+
+    Returns:
+      The model outputs for each of the targets, as returned by predict.
+
+    Raises:
+      ValueError: If the features have different shapes after padding.
+    """
+    num_res = [feat['aatype'].shape[-1] for feat in feats]
+    feats = [self._pad_features(feat) for feat in feats]
+    shapes = tree.map_structure(lambda x: x.shape, feats[0])
+    for feat in feats[1:]:
+      if tree.map_structure(lambda x: x.shape, feat) != shapes:
+        raise ValueError('All targets must have the same feature shapes after '
+                         'padding, got '
+                         f'{tree.map_structure(lambda x: x.shape, feat)} and '
+                         f'{shapes}.')
+    self._tune_chunk_sizes(feats[0], batch_size=len(feats))
+    self.init_params(feats[0])
+    logging.info('Running predict_targets of %d targets with '
+                 'shape(feat) = %s', len(feats), shapes)
+    batched_feat = jax.tree.map(lambda *x: np.stack(x), *feats)
+    rngs = np.stack([jax.random.PRNGKey(seed) for seed in random_seeds])
+    batched_result = self.multi_target_apply(self.params, rngs, batched_feat)
+    return self._unbatch_prediction(
+        batched_result, num_res, padded_num_res=feats[0]['aatype'].shape[-1])
+
+  def _unbatch_prediction(
+      self,
+      batched_result: Mapping[str, Any],
+      num_res: Sequence[int],
+      padded_num_res: int) -> List[Mapping[str, Any]]:
+    """Splits batched model outputs and finalizes each of them."""
+    results = []
+    for i, result_num_res in enumerate(num_res):
+      result = jax.tree.map(lambda x: x[i], batched_result)  # pylint: disable=cell-var-from-loop
+      results.append(self._finalize_prediction(
+          result, result_num_res, padded_num_res=padded_num_res))
+    logging.info('Output shape was %s',
+                 tree.map_structure(lambda x: x.shape, results[0]))
+    return results
+
+
+def get_seed_batches(
+    model_runners: Mapping[str, RunModel],
+    seed_batch_size: int) -> Dict[str, List[str]]:
+  """Groups the predictions of each multimer model into batches of seeds.
+
+  The predictions of a multimer model all run on the same features, so
+  several of them can run at once with RunModel.predict_batch.
+
+  Args:
+    model_runners: The model runners, by prediction name.
+    seed_batch_size: The maximum number of predictions in a batch.
+
+  Returns:
+    The batch of each prediction that is part of a batch of several seeds.
+  """
+  predictions_by_runner = collections.defaultdict(list)
+  for model_name, model_runner in model_runners.items():
+    if model_runner.multimer_mode:
+      predictions_by_runner[id(model_runner)].append(model_name)
+  seed_batches = {}
+  for model_names in predictions_by_runner.values():
+    for i in range(0, len(model_names), max(seed_batch_size, 1)):
+      seed_batch = model_names[i:i + seed_batch_size]
+      if len(seed_batch) > 1:
+        for model_name in seed_batch:
+          seed_batches[model_name] = seed_batch
+  return seed_batches
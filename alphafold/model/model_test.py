@@ -0,0 +1,132 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for model."""
+
+from absl.testing import absltest
+from alphafold.common import residue_constants
+from alphafold.data import parsers
+from alphafold.data import pipeline
+from alphafold.model import config
+from alphafold.model import model
+import jax
+import numpy as np
+
+
+def _tiny_monomer_config():
+  """Returns the config of a small monomer model that runs quickly on CPU."""
+  cfg = config.model_config('model_1')
+  cfg.data.common.max_extra_msa = 4
+  cfg.data.common.num_recycle = 0
+  cfg.data.common.use_numpy_pipeline = True
+  cfg.data.eval.max_msa_clusters = 4
+  cfg.data.eval.max_templates = 2
+  cfg.model.num_recycle = 0
+  evoformer = cfg.model.embeddings_and_evoformer
+  evoformer.evoformer_num_block = 1
+  evoformer.extra_msa_stack_num_block = 1
+  evoformer.msa_channel = 8
+  evoformer.pair_channel = 8
+  evoformer.seq_channel = 8
+  evoformer.extra_msa_channel = 8
+  cfg.model.heads.structure_module.num_layer = 1
+  return cfg
+
+
+def _raw_features(sequence):
+  num_res = len(sequence)
+  msa = parsers.Msa(sequences=[sequence, sequence[::-1]],
+                    deletion_matrix=np.array([[0] * num_res, [1] * num_res],
+                                             dtype=np.int32),
+                    descriptions=['query', 'hit'])
+  num_templates = 1
+  return {
+      **pipeline.make_sequence_features(
+          sequence=sequence, description='query', num_res=num_res),
+      **pipeline.make_msa_features([msa]),
+      'template_aatype': np.zeros(
+          (num_templates, num_res,
+           len(residue_constants.restypes_with_x_and_gap)), dtype=np.float32),
+      'template_all_atom_masks': np.ones(
+          (num_templates, num_res, residue_constants.atom_type_num),
+          dtype=np.float32),
+      'template_all_atom_positions': np.random.default_rng(0).normal(
+          size=(num_templates, num_res, residue_constants.atom_type_num, 3)
+          ).astype(np.float32),
+      'template_domain_names': np.array([b'1abc_A'] * num_templates),
+      'template_sum_probs': np.ones([num_templates, 1], dtype=np.float32),
+  }
+
+
+class _FakeRunner:
+
+  def __init__(self, multimer_mode):
+    self.multimer_mode = multimer_mode
+
+
+class GetSeedBatchesTest(absltest.TestCase):
+
+  def test_batches_predictions_of_multimer_models(self):
+    multimer_1 = _FakeRunner(multimer_mode=True)
+    multimer_2 = _FakeRunner(multimer_mode=True)
+    monomer = _FakeRunner(multimer_mode=False)
+    model_runners = {
+        **{f'multimer_1_pred_{i}': multimer_1 for i in range(5)},
+        'multimer_2_pred_0': multimer_2,
+        **{f'monomer_pred_{i}': monomer for i in range(2)},
+    }
+
+    seed_batches = model.get_seed_batches(model_runners, seed_batch_size=2)
+
+    # Batches of one prediction, like the last one of multimer_1, and the
+    # monomer predictions run on their own.
+    self.assertEqual(seed_batches, {
+        'multimer_1_pred_0': ['multimer_1_pred_0', 'multimer_1_pred_1'],
+        'multimer_1_pred_1': ['multimer_1_pred_0', 'multimer_1_pred_1'],
+        'multimer_1_pred_2': ['multimer_1_pred_2', 'multimer_1_pred_3'],
+        'multimer_1_pred_3': ['multimer_1_pred_2', 'multimer_1_pred_3'],
+    })
+    self.assertEmpty(model.get_seed_batches(model_runners, seed_batch_size=1))
+
+
+
+class RunModelTest(absltest.TestCase):
+
+  def test_monomer_model_runs_in_bfloat16(self):
+    cfg = _tiny_monomer_config()
+    cfg.model.global_config.bfloat16 = True
+    runner = model.RunModel(cfg)
+    feat = runner.process_features(
+        _raw_features('MKTAYIAKQRQISFVKSHFSRQ'), random_seed=0)
+    # Random float32 parameters, like the released ones. Initializing them
+    # with runner.init_params would compile the model a second time.
+    rng = np.random.default_rng(0)
+    runner.params = jax.tree_util.tree_map(
+        lambda x: rng.normal(scale=0.1, size=x.shape).astype(np.float32),
+        jax.eval_shape(runner.init, jax.random.PRNGKey(0), feat))
+
+    result = runner.predict(feat, random_seed=0)
+
+    positions = result['structure_module']['final_atom_positions']
+    self.assertEqual(positions.shape, (22, residue_constants.atom_type_num, 3))
+    for name, output in [('plddt', result['plddt']),
+                         ('final_atom_positions', positions),
+                         ('distogram', result['distogram']['logits'])]:
+      with self.subTest(name):
+        self.assertEqual(output.dtype, np.float32)
+        self.assertTrue(np.all(np.isfinite(output)))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,565 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""NumPy versions of the data transforms in alphafold.model.tf.
+
+The transforms compute the same features as their TensorFlow counterparts of
+the same name. Transforms that draw random numbers take a NumPy generator, so
+they are reproducible for a given seed but do not draw the same numbers as
+TensorFlow.
+"""
+
+from alphafold.common import residue_constants
+from alphafold.model.tf import shape_placeholders
+import numpy as np
+
+# Pylint gets confused by the curry1 decorator because it changes the number
+#   of arguments to the function.
+# pylint:disable=no-value-for-parameter
+
+
+NUM_RES = shape_placeholders.NUM_RES
+NUM_MSA_SEQ = shape_placeholders.NUM_MSA_SEQ
+NUM_EXTRA_SEQ = shape_placeholders.NUM_EXTRA_SEQ
+NUM_TEMPLATES = shape_placeholders.NUM_TEMPLATES
+
+_MSA_FEATURE_NAMES = [
+    'msa', 'deletion_matrix', 'msa_mask', 'msa_row_mask', 'bert_mask',
+    'true_msa'
+]
+
+# Extra MSA rows are assigned to clusters in chunks of this many rows, which
+# bounds the size of the one-hot arrays.
+_CLUSTER_CHUNK_SIZE = 1024
+
+
+def curry1(f):
+  """Supply all arguments but the first."""
+
+  def fc(*args, **kwargs):
+    return lambda x: f(x, *args, **kwargs)
+
+  return fc
+
+
+def one_hot(x: np.ndarray, depth: int) -> np.ndarray:
+  """Returns a float32 one-hot encoding, all zeros for indices >= depth."""
+  return (x[..., None] == np.arange(depth)).astype(np.float32)
+
+
+def cast_64bit_ints(protein):
+
+  for k, v in protein.items():
+    if v.dtype == np.int64:
+      protein[k] = v.astype(np.int32)
+  return protein
+
+
+def make_seq_mask(protein):
+  protein['seq_mask'] = np.ones(protein['aatype'].shape, dtype=np.float32)
+  return protein
+
+
+def make_template_mask(protein):
+  protein['template_mask'] = np.ones(
+      protein['template_domain_names'].shape, dtype=np.float32)
+  return protein
+
+
+@curry1
+def add_distillation_flag(protein, distillation):
+  protein['is_distillation'] = np.asarray(float(distillation), np.float32)
+  return protein
+
+
+def fix_templates_aatype(protein):
+  """Fixes aatype encoding of templates."""
+  # Map one-hot to indices.
+  template_aatype = np.argmax(protein['template_aatype'], axis=-1)
+  # Map hhsearch-aatype to our aatype.
+  new_order = np.asarray(
+      residue_constants.MAP_HHBLITS_AATYPE_TO_OUR_AATYPE, dtype=np.int32)
+  protein['template_aatype'] = new_order[template_aatype]
+  return protein
+
+
+def correct_msa_restypes(protein):
+  """Correct MSA restype to have the same order as residue_constants."""
+  new_order_list = residue_constants.MAP_HHBLITS_AATYPE_TO_OUR_AATYPE
+  new_order = np.asarray(new_order_list, dtype=protein['msa'].dtype)
+  protein['msa'] = new_order[protein['msa']]
+
+  perm_matrix = np.zeros((22, 22), dtype=np.float32)
+  perm_matrix[range(len(new_order_list)), new_order_list] = 1.
+
+  for k in protein:
+    if 'profile' in k:  # Include both hhblits and psiblast profiles
+      num_dim = protein[k].shape[-1]
+      assert num_dim in [20, 21, 22], (
+          'num_dim for %s out of expected range: %s' % (k, num_dim))
+      protein[k] = np.tensordot(
+          protein[k], perm_matrix[:num_dim, :num_dim], 1)
+  return protein
+
+
+def squeeze_features(protein):
+  """Remove singleton and repeated dimensions in protein features."""
+  protein['aatype'] = np.argmax(protein['aatype'], axis=-1).astype(np.int32)
+  for k in [
+      'domain_name', 'msa', 'num_alignments', 'seq_length', 'sequence',
+      'superfamily', 'deletion_matrix', 'resolution',
+      'between_segment_residues', 'residue_index', 'template_all_atom_masks']:
+    if k in protein:
+      final_dim = protein[k].shape[-1]
+      if final_dim == 1:
+        protein[k] = np.squeeze(protein[k], axis=-1)
+
+  for k in ['seq_length', 'num_alignments']:
+    if k in protein:
+      protein[k] = protein[k][0]  # Remove fake sequence dimension
+  return protein
+
+
+@curry1
+def make_random_crop_to_size_seed(protein, rng):
+  """Random seed for cropping residues and templates."""
+  protein['random_crop_to_size_seed'] = rng.integers(
+      np.iinfo(np.int32).min, np.iinfo(np.int32).max, size=[2], dtype=np.int32)
+  return protein
+
+
+@curry1
+def sample_msa(protein, max_seq, keep_extra, rng):
+  """Sample MSA randomly, remaining sequences are stored as `extra_*`.
+
+  Args:
+    protein: batch to sample msa from.
+    max_seq: number of sequences to sample.
+    keep_extra: When True sequences not sampled are put into fields starting
+      with 'extra_*'.
+    rng: The random number generator.
+
+  Returns:
+    Protein with sampled msa.
+  """
+  num_seq = protein['msa'].shape[0]
+  shuffled = rng.permutation(np.arange(1, num_seq))
+  index_order = np.concatenate([[0], shuffled]).astype(np.int32)
+  num_sel = min(max_seq, num_seq)
+
+  sel_seq, not_sel_seq = index_order[:num_sel], index_order[num_sel:]
+
+  for k in _MSA_FEATURE_NAMES:
+    if k in protein:
+      if keep_extra:
+        protein['extra_' + k] = protein[k][not_sel_seq]
+      protein[k] = protein[k][sel_seq]
+
+  return protein
+
+
+@curry1
+def crop_extra_msa(protein, max_extra_msa, rng):
+  """MSA features are cropped so only `max_extra_msa` sequences are kept."""
+  num_seq = protein['extra_msa'].shape[0]
+  num_sel = min(max_extra_msa, num_seq)
+  select_indices = rng.permutation(num_seq)[:num_sel]
+  for k in _MSA_FEATURE_NAMES:
+    if 'extra_' + k in protein:
+      protein['extra_' + k] = protein['extra_' + k][select_indices]
+
+  return protein
+
+
+def delete_extra_msa(protein):
+  for k in _MSA_FEATURE_NAMES:
+    if 'extra_' + k in protein:
+      del protein['extra_' + k]
+  return protein
+
+
+@curry1
+def nearest_neighbor_clusters(protein, gap_agreement_weight=0.):
+  """Assign each extra MSA sequence to its nearest neighbor in sampled MSA."""
+
+  # Determine how much weight we assign to each agreement.  In theory, we could
+  # use a full blosum matrix here, but right now let's just down-weight gap
+  # agreement because it could be spurious.
+  # Never put weight on agreeing on BERT mask
+  weights = np.concatenate([
+      np.ones(21, np.float32),
+      gap_agreement_weight * np.ones(1, np.float32),
+      np.zeros(1, np.float32)], 0)
+
+  # Make agreement score as weighted Hamming distance
+  sample_one_hot = (protein['msa_mask'][:, :, None] *
+                    one_hot(protein['msa'], 23))
+  num_seq, num_res, _ = sample_one_hot.shape
+  sample_one_hot = np.reshape(sample_one_hot * weights, [num_seq, -1])
+
+  # Computes einsum('mrc,nrc,c->mn', sample_one_hot, extra_one_hot, weights)
+  # as a matrix product, in chunks of extra sequences to bound the memory.
+  extra_num_seq = protein['extra_msa'].shape[0]
+  assignment = np.zeros([extra_num_seq], dtype=np.int32)
+  for start in range(0, extra_num_seq, _CLUSTER_CHUNK_SIZE):
+    end = start + _CLUSTER_CHUNK_SIZE
+    extra_one_hot = (protein['extra_msa_mask'][start:end, :, None] *
+                     one_hot(protein['extra_msa'][start:end], 23))
+    agreement = np.matmul(
+        np.reshape(extra_one_hot, [-1, num_res * 23]), sample_one_hot.T)
+    # Assign each sequence in the extra sequences to the closest MSA sample
+    assignment[start:end] = np.argmax(agreement, axis=1)
+  protein['extra_cluster_assignment'] = assignment
+
+  return protein
+
+
+def _segment_sum(data, segment_ids, num_segments):
+  """Sums the rows of 2D data with the same segment ID, like TensorFlow."""
+  row_size = data.shape[1]
+  index = segment_ids[:, None] * row_size + np.arange(row_size)
+  result = np.bincount(index.ravel(), weights=data.ravel(),
+                       minlength=num_segments * row_size)
+  return np.reshape(result.astype(data.dtype), [num_segments, row_size])
+
+
+@curry1
+def summarize_clusters(protein):
+  """Produce profile and deletion_matrix_mean within each cluster."""
+  num_seq, num_res = protein['msa'].shape
+  assignment = protein['extra_cluster_assignment']
+  def csum(x):
+    return _segment_sum(x, assignment, num_seq)
+
+  mask = protein['extra_msa_mask']
+  mask_counts = 1e-6 + protein['msa_mask'] + csum(mask)  # Include center
+
+  # The sum of the one-hot extra MSA in each cluster, counted by cluster,
+  # residue and restype instead of summed over a one-hot array.
+  msa_sum_index = ((assignment[:, None] * num_res + np.arange(num_res)) * 23 +
+                   protein['extra_msa'])
+  msa_sum = np.bincount(msa_sum_index.ravel(), weights=mask.ravel(),
+                        minlength=num_seq * num_res * 23)
+  msa_sum = np.reshape(msa_sum.astype(np.float32), [num_seq, num_res, 23])
+  msa_sum += one_hot(protein['msa'], 23)  # Original sequence
+  protein['cluster_profile'] = msa_sum / mask_counts[:, :, None]
+
+  del msa_sum
+
+  del_sum = csum(mask * protein['extra_deletion_matrix'])
+  del_sum += protein['deletion_matrix']  # Original sequence
+  protein['cluster_deletion_mean'] = del_sum / mask_counts
+  del del_sum
+
+  return protein
+
+
+def make_msa_mask(protein):
+  """Mask features are all ones, but will later be zero-padded."""
+  protein['msa_mask'] = np.ones(protein['msa'].shape, dtype=np.float32)
+  protein['msa_row_mask'] = np.ones(
+      protein['msa'].shape[0], dtype=np.float32)
+  return protein
+
+
+def pseudo_beta_fn(aatype, all_atom_positions, all_atom_masks):
+  """Create pseudo beta features."""
+  is_gly = np.equal(aatype, residue_constants.restype_order['G'])
+  ca_idx = residue_constants.atom_order['CA']
+  cb_idx = residue_constants.atom_order['CB']
+  pseudo_beta = np.where(
+      is_gly[..., None],
+      all_atom_positions[..., ca_idx, :],
+      all_atom_positions[..., cb_idx, :])
+
+  if all_atom_masks is not None:
+    pseudo_beta_mask = np.where(
+        is_gly, all_atom_masks[..., ca_idx], all_atom_masks[..., cb_idx])
+    pseudo_beta_mask = pseudo_beta_mask.astype(np.float32)
+    return pseudo_beta, pseudo_beta_mask
+  else:
+    return pseudo_beta
+
+
+@curry1
+def make_pseudo_beta(protein, prefix=''):
+  """Create pseudo-beta (alpha for glycine) position and mask."""
+  assert prefix in ['', 'template_']
+  protein[prefix + 'pseudo_beta'], protein[prefix + 'pseudo_beta_mask'] = (
+      pseudo_beta_fn(
+          protein['template_aatype' if prefix else 'all_atom_aatype'],
+          protein[prefix + 'all_atom_positions'],
+          protein['template_all_atom_masks' if prefix else 'all_atom_mask']))
+  return protein
+
+
+def shaped_categorical(probs, rng, epsilon=1e-10):
+  """Samples from the categorical distributions in the last axis of probs."""
+  cumulative = np.cumsum(probs + epsilon, axis=-1)
+  samples = rng.random(probs.shape[:-1]) * cumulative[..., -1]
+  counts = np.sum(cumulative <= samples[..., None], axis=-1)
+  return np.minimum(counts, probs.shape[-1] - 1).astype(np.int32)
+
+
+def make_hhblits_profile(protein):
+  """Compute the HHblits MSA profile if not already present."""
+  if 'hhblits_profile' in protein:
+    return protein
+
+  # Compute the profile for every residue (over all MSA sequences).
+  num_seq, num_res = protein['msa'].shape
+  counts = np.bincount(
+      (np.arange(num_res) * 22 + protein['msa']).ravel(),
+      minlength=num_res * 22)
+  protein['hhblits_profile'] = (
+      np.reshape(counts, [num_res, 22]).astype(np.float32) /
+      np.float32(num_seq))
+  return protein
+
+
+@curry1
+def make_masked_msa(protein, config, replace_fraction, rng):
+  """Create data for BERT on raw MSA."""
+  mask_position = rng.random(protein['msa'].shape) < replace_fraction
+
+  # Only the masked positions are sampled, from their categorical probabilities.
+  msa = protein['msa'][mask_position]
+  # Add a random amino acid uniformly
+  random_aa = np.asarray([0.05] * 20 + [0., 0.], dtype=np.float32)
+
+  categorical_probs = (
+      config.uniform_prob * random_aa +
+      config.profile_prob *
+      protein['hhblits_profile'][np.nonzero(mask_position)[1]] +
+      config.same_prob * one_hot(msa, 22))
+
+  # Put all remaining probability on [MASK] which is a new column
+  mask_prob = 1. - config.profile_prob - config.same_prob - config.uniform_prob
+  assert mask_prob >= 0.
+  categorical_probs = np.pad(
+      categorical_probs, [(0, 0), (0, 1)], constant_values=mask_prob)
+
+  bert_msa = protein['msa'].copy()
+  bert_msa[mask_position] = shaped_categorical(categorical_probs, rng)
+
+  # Mix real and masked MSA
+  protein['bert_mask'] = mask_position.astype(np.float32)
+  protein['true_msa'] = protein['msa']
+  protein['msa'] = bert_msa
+
+  return protein
+
+
+@curry1
+def make_fixed_size(protein, shape_schema, msa_cluster_size, extra_msa_size,
+                    num_res, num_templates=0):
+  """Guess at the MSA and sequence dimensions to make fixed size."""
+
+  pad_size_map = {
+      NUM_RES: num_res,
+      NUM_MSA_SEQ: msa_cluster_size,
+      NUM_EXTRA_SEQ: extra_msa_size,
+      NUM_TEMPLATES: num_templates,
+  }
+
+  for k, v in protein.items():
+    # Don't transfer this to the accelerator.
+    if k == 'extra_cluster_assignment':
+      continue
+    shape = list(v.shape)
+    schema = shape_schema[k]
+    assert len(shape) == len(schema), (
+        f'Rank mismatch between shape and shape schema for {k}: '
+        f'{shape} vs {schema}')
+    pad_size = [
+        pad_size_map.get(s2, None) or s1 for (s1, s2) in zip(shape, schema)
+    ]
+    padding = [(0, p - v.shape[i]) for i, p in enumerate(pad_size)]
+    if padding:
+      protein[k] = np.pad(v, padding)
+
+  return protein
+
+
+@curry1
+def make_msa_feat(protein):
+  """Create and concatenate MSA features."""
+  # Whether there is a domain break. Always zero for chains, but keeping
+  # for compatibility with domain datasets.
+  has_break = np.clip(
+      protein['between_segment_residues'].astype(np.float32), 0, 1)
+  aatype_1hot = one_hot(protein['aatype'], 21)
+
+  target_feat = [
+      np.expand_dims(has_break, axis=-1),
+      aatype_1hot,  # Everyone gets the original sequence.
+  ]
+
+  msa_1hot = one_hot(protein['msa'], 23)
+  has_deletion = np.clip(protein['deletion_matrix'], 0., 1.)
+  deletion_value = np.arctan(
+      protein['deletion_matrix'] / np.float32(3.)) * np.float32(2. / np.pi)
+
+  msa_feat = [
+      msa_1hot,
+      np.expand_dims(has_deletion, axis=-1),
+      np.expand_dims(deletion_value, axis=-1),
+  ]
+
+  if 'cluster_profile' in protein:
+    deletion_mean_value = (
+        np.arctan(protein['cluster_deletion_mean'] / np.float32(3.)) *
+        np.float32(2. / np.pi))
+    msa_feat.extend([
+        protein['cluster_profile'],
+        np.expand_dims(deletion_mean_value, axis=-1),
+    ])
+
+  if 'extra_deletion_matrix' in protein:
+    protein['extra_has_deletion'] = np.clip(
+        protein['extra_deletion_matrix'], 0., 1.)
+    protein['extra_deletion_value'] = np.arctan(
+        protein['extra_deletion_matrix'] / np.float32(3.)) * np.float32(
+            2. / np.pi)
+
+  protein['msa_feat'] = np.concatenate(msa_feat, axis=-1)
+  protein['target_feat'] = np.concatenate(target_feat, axis=-1)
+  return protein
+
+
+@curry1
+def select_feat(protein, feature_list):
+  return {k: v for k, v in protein.items() if k in feature_list}
+
+
+@curry1
+def crop_templates(protein, max_templates):
+  for k, v in protein.items():
+    if k.startswith('template_'):
+      protein[k] = v[:max_templates]
+  return protein
+
+
+@curry1
+def random_crop_to_size(protein, crop_size, max_templates, shape_schema,
+                        subsample_templates=False):
+  """Crop randomly to `crop_size`, or keep as is if shorter than that."""
+  seq_length = protein['seq_length']
+  if 'template_mask' in protein:
+    num_templates = protein['template_mask'].shape[0]
+  else:
+    num_templates = 0
+  num_res_crop_size = min(int(seq_length), crop_size)
+
+  # Ensures that the cropping of residues and templates happens in the same way
+  # across ensembling iterations.
+  # Do not use for randomness that should vary in ensembling.
+  crop_rng = np.random.default_rng(
+      protein['random_crop_to_size_seed'].astype(np.uint32))
+
+  if subsample_templates:
+    templates_crop_start = int(crop_rng.integers(0, num_templates + 1))
+  else:
+    templates_crop_start = 0
+
+  num_templates_crop_size = min(
+      num_templates - templates_crop_start, max_templates)
+
+  num_res_crop_start = int(
+      crop_rng.integers(0, seq_length - num_res_crop_size + 1))
+
+  templates_select_indices = crop_rng.permutation(num_templates)
+
+  for k, v in protein.items():
+    if k not in shape_schema or (
+        'template' not in k and NUM_RES not in shape_schema[k]):
+      continue
+
+    # randomly permute the templates before cropping them.
+    if k.startswith('template') and subsample_templates:
+      v = v[templates_select_indices]
+
+    crop_slices = []
+    for i, (dim_size, dim) in enumerate(zip(shape_schema[k], v.shape)):
+      is_num_res = (dim_size == NUM_RES)
+      if i == 0 and k.startswith('template'):
+        crop_size_i = num_templates_crop_size
+        crop_start = templates_crop_start
+      else:
+        crop_start = num_res_crop_start if is_num_res else 0
+        crop_size_i = num_res_crop_size if is_num_res else dim
+      crop_slices.append(slice(crop_start, crop_start + crop_size_i))
+    protein[k] = v[tuple(crop_slices)]
+
+  protein['seq_length'] = np.asarray(num_res_crop_size, np.int32)
+  return protein
+
+
+def _make_atom14_tables():
+  """Returns the per-restype atom14 and atom37 lookup tables."""
+  restype_atom14_to_atom37 = []  # mapping (restype, atom14) --> atom37
+  restype_atom37_to_atom14 = []  # mapping (restype, atom37) --> atom14
+  restype_atom14_mask = []
+
+  for rt in residue_constants.restypes:
+    atom_names = residue_constants.restype_name_to_atom14_names[
+        residue_constants.restype_1to3[rt]]
+
+    restype_atom14_to_atom37.append([
+        (residue_constants.atom_order[name] if name else 0)
+        for name in atom_names
+    ])
+
+    atom_name_to_idx14 = {name: i for i, name in enumerate(atom_names)}
+    restype_atom37_to_atom14.append([
+        (atom_name_to_idx14[name] if name in atom_name_to_idx14 else 0)
+        for name in residue_constants.atom_types
+    ])
+
+    restype_atom14_mask.append([(1. if name else 0.) for name in atom_names])
+
+  # Add dummy mapping for restype 'UNK'
+  restype_atom14_to_atom37.append([0] * 14)
+  restype_atom37_to_atom14.append([0] * 37)
+  restype_atom14_mask.append([0.] * 14)
+
+  restype_atom14_to_atom37 = np.array(restype_atom14_to_atom37, dtype=np.int32)
+  restype_atom37_to_atom14 = np.array(restype_atom37_to_atom14, dtype=np.int32)
+  restype_atom14_mask = np.array(restype_atom14_mask, dtype=np.float32)
+
+  # create the corresponding mask
+  restype_atom37_mask = np.zeros([21, 37], dtype=np.float32)
+  for restype, restype_letter in enumerate(residue_constants.restypes):
+    restype_name = residue_constants.restype_1to3[restype_letter]
+    atom_names = residue_constants.residue_atoms[restype_name]
+    for atom_name in atom_names:
+      atom_type = residue_constants.atom_order[atom_name]
+      restype_atom37_mask[restype, atom_type] = 1
+
+  return (restype_atom14_to_atom37, restype_atom37_to_atom14,
+          restype_atom14_mask, restype_atom37_mask)
+
+
+(_RESTYPE_ATOM14_TO_ATOM37, _RESTYPE_ATOM37_TO_ATOM14, _RESTYPE_ATOM14_MASK,
+ _RESTYPE_ATOM37_MASK) = _make_atom14_tables()
+
+
+def make_atom14_masks(protein):
+  """Construct denser atom positions (14 dimensions instead of 37)."""
+  aatype = protein['aatype']
+  protein['atom14_atom_exists'] = _RESTYPE_ATOM14_MASK[aatype]
+  protein['residx_atom14_to_atom37'] = _RESTYPE_ATOM14_TO_ATOM37[aatype]
+  protein['residx_atom37_to_atom14'] = _RESTYPE_ATOM37_TO_ATOM14[aatype]
+  protein['atom37_atom_exists'] = _RESTYPE_ATOM37_MASK[aatype]
+  return protein
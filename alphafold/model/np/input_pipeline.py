@@ -0,0 +1,232 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Feature pre-processing input pipeline for AlphaFold in NumPy.
+
+Computes the same features as alphafold.model.tf.input_pipeline without
+TensorFlow, so no graph has to be built and run for every model and target.
+"""
+
+from typing import Mapping, Sequence
+
+from alphafold.common import residue_constants
+from alphafold.model.np import data_transforms
+from alphafold.model.tf import shape_placeholders
+import ml_collections
+import numpy as np
+
+# Pylint gets confused by the curry1 decorator because it changes the number
+#   of arguments to the function.
+# pylint:disable=no-value-for-parameter
+
+
+NUM_RES = shape_placeholders.NUM_RES
+NUM_MSA_SEQ = shape_placeholders.NUM_MSA_SEQ
+NUM_EXTRA_SEQ = shape_placeholders.NUM_EXTRA_SEQ
+NUM_TEMPLATES = shape_placeholders.NUM_TEMPLATES
+
+FeatureDict = Mapping[str, np.ndarray]
+
+# The shapes of the data pipeline features, as in
+# alphafold.model.tf.protein_features, with the placeholders _NUM_SEQ for the
+# number of alignments and _NUM_TEMPLATES for the number of templates.
+_NUM_SEQ = 'length msa placeholder'
+_NUM_TEMPLATES = 'num templates placeholder'
+_FEATURE_SHAPES = {
+    'aatype': [NUM_RES, 21],
+    'between_segment_residues': [NUM_RES, 1],
+    'deletion_matrix': [_NUM_SEQ, NUM_RES, 1],
+    'domain_name': [1],
+    'msa': [_NUM_SEQ, NUM_RES, 1],
+    'num_alignments': [NUM_RES, 1],
+    'residue_index': [NUM_RES, 1],
+    'seq_length': [NUM_RES, 1],
+    'sequence': [1],
+    'all_atom_positions': [NUM_RES, residue_constants.atom_type_num, 3],
+    'all_atom_mask': [NUM_RES, residue_constants.atom_type_num],
+    'resolution': [1],
+    'template_domain_names': [_NUM_TEMPLATES],
+    'template_sum_probs': [_NUM_TEMPLATES, 1],
+    'template_aatype': [_NUM_TEMPLATES, NUM_RES, 22],
+    'template_all_atom_positions': [
+        _NUM_TEMPLATES, NUM_RES, residue_constants.atom_type_num, 3],
+    'template_all_atom_masks': [
+        _NUM_TEMPLATES, NUM_RES, residue_constants.atom_type_num, 1],
+}
+
+
+def np_to_feature_dict(
+    np_example: Mapping[str, np.ndarray],
+    features: Sequence[str],
+    ) -> FeatureDict:
+  """Selects and reshapes the features like proteins_dataset.np_to_tensor_dict.
+
+  Args:
+    np_example: A dict of NumPy feature arrays.
+    features: A list of strings of feature names to be returned.
+
+  Returns:
+    A dictionary of features mapping feature names to features. Only the given
+    features are returned, all other ones are filtered out.
+  """
+  # Make sure these features are always read.
+  feature_names = set(features) | {'aatype', 'sequence', 'seq_length'}
+  replacements = {
+      NUM_RES: int(np.reshape(np_example['seq_length'], [-1])[0]),
+      _NUM_SEQ: (int(np.reshape(np_example['num_alignments'], [-1])[0])
+                 if 'num_alignments' in np_example else 0),
+      _NUM_TEMPLATES: (len(np_example['template_domain_names'])
+                       if 'template_domain_names' in np_example else 0),
+  }
+  feature_dict = {}
+  for k, v in np_example.items():
+    if k in feature_names:
+      shape = [replacements.get(dim, dim) for dim in _FEATURE_SHAPES[k]]
+      feature_dict[k] = np.reshape(v, shape)
+  return feature_dict
+
+
+def nonensembled_map_fns(data_config, rng):
+  """Input pipeline functions which are not ensembled."""
+  common_cfg = data_config.common
+
+  map_fns = [
+      data_transforms.correct_msa_restypes,
+      data_transforms.add_distillation_flag(False),
+      data_transforms.cast_64bit_ints,
+      data_transforms.squeeze_features,
+      data_transforms.make_seq_mask,
+      data_transforms.make_msa_mask,
+      # Compute the HHblits profile if it's not set. This has to be run before
+      # sampling the MSA.
+      data_transforms.make_hhblits_profile,
+      data_transforms.make_random_crop_to_size_seed(rng),
+  ]
+  if common_cfg.use_templates:
+    map_fns.extend([
+        data_transforms.fix_templates_aatype,
+        data_transforms.make_template_mask,
+        data_transforms.make_pseudo_beta('template_')
+    ])
+  map_fns.extend([
+      data_transforms.make_atom14_masks,
+  ])
+
+  return map_fns
+
+
+def ensembled_map_fns(data_config, rng):
+  """Input pipeline functions that can be ensembled and averaged."""
+  common_cfg = data_config.common
+  eval_cfg = data_config.eval
+
+  map_fns = []
+
+  if common_cfg.reduce_msa_clusters_by_max_templates:
+    pad_msa_clusters = eval_cfg.max_msa_clusters - eval_cfg.max_templates
+  else:
+    pad_msa_clusters = eval_cfg.max_msa_clusters
+
+  max_msa_clusters = pad_msa_clusters
+  max_extra_msa = common_cfg.max_extra_msa
+
+  map_fns.append(
+      data_transforms.sample_msa(
+          max_msa_clusters,
+          keep_extra=True,
+          rng=rng))
+
+  if 'masked_msa' in common_cfg:
+    # Masked MSA should come *before* MSA clustering so that
+    # the clustering and full MSA profile do not leak information about
+    # the masked locations and secret corrupted locations.
+    map_fns.append(
+        data_transforms.make_masked_msa(common_cfg.masked_msa,
+                                        eval_cfg.masked_msa_replace_fraction,
+                                        rng=rng))
+
+  if common_cfg.msa_cluster_features:
+    map_fns.append(data_transforms.nearest_neighbor_clusters())
+    map_fns.append(data_transforms.summarize_clusters())
+
+  # Crop after creating the cluster profiles.
+  if max_extra_msa:
+    map_fns.append(data_transforms.crop_extra_msa(max_extra_msa, rng=rng))
+  else:
+    map_fns.append(data_transforms.delete_extra_msa)
+
+  map_fns.append(data_transforms.make_msa_feat())
+
+  crop_feats = dict(eval_cfg.feat)
+
+  if eval_cfg.fixed_size:
+    map_fns.append(data_transforms.select_feat(list(crop_feats)))
+    map_fns.append(data_transforms.random_crop_to_size(
+        eval_cfg.crop_size,
+        eval_cfg.max_templates,
+        crop_feats,
+        eval_cfg.subsample_templates))
+    map_fns.append(data_transforms.make_fixed_size(
+        crop_feats,
+        pad_msa_clusters,
+        common_cfg.max_extra_msa,
+        eval_cfg.crop_size,
+        eval_cfg.max_templates))
+  else:
+    map_fns.append(data_transforms.crop_templates(eval_cfg.max_templates))
+
+  return map_fns
+
+
+def process_arrays_from_config(
+    arrays: FeatureDict,
+    data_config: ml_collections.ConfigDict,
+    random_seed: int) -> FeatureDict:
+  """Applies the transforms to the features, based on the config.
+
+  Args:
+    arrays: The features, as returned by np_to_feature_dict.
+    data_config: The data config, as returned by features.make_data_config.
+    random_seed: The seed of the random numbers drawn by the transforms.
+
+  Returns:
+    The processed features, stacked along a leading ensemble dimension.
+  """
+  rng = np.random.default_rng(random_seed)
+
+  eval_cfg = data_config.eval
+  arrays = compose(
+      nonensembled_map_fns(
+          data_config, rng))(
+              arrays)
+
+  num_ensemble = eval_cfg.num_ensemble
+  if data_config.common.resample_msa_in_recycling:
+    # Separate batch per ensembling & recycling step.
+    num_ensemble *= data_config.common.num_recycle + 1
+
+  ensembles = []
+  for i in range(num_ensemble):
+    d = arrays.copy()
+    d['ensemble_index'] = np.asarray(i, np.int32)
+    ensembles.append(compose(ensembled_map_fns(data_config, rng))(d))
+  return {k: np.stack([ensemble[k] for ensemble in ensembles])
+          for k in ensembles[0]}
+
+
+@data_transforms.curry1
+def compose(x, fs):
+  for f in fs:
+    x = f(x)
+  return x
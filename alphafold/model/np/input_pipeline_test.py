@@ -0,0 +1,265 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the NumPy input pipeline."""
+
+import contextlib
+import copy
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from alphafold.common import residue_constants
+from alphafold.data import parsers
+from alphafold.data import pipeline
+from alphafold.model import config
+from alphafold.model import features
+from alphafold.model.np import data_transforms as np_transforms
+from alphafold.model.np import input_pipeline as np_input_pipeline
+from alphafold.model.tf import data_transforms as tf_transforms
+from alphafold.model.tf import shape_helpers
+import mock
+import numpy as np
+import tensorflow.compat.v1 as tf
+
+_MASKED_MSA = config.CONFIG.data.common.masked_msa
+
+# The ensembled MSA transforms in pipeline order, as NumPy transforms of a
+# generator and as TensorFlow transforms.
+_ENSEMBLED_TRANSFORMS = (
+    ('sample_msa',
+     lambda rng: np_transforms.sample_msa(8, keep_extra=True, rng=rng),
+     lambda: tf_transforms.sample_msa(8, keep_extra=True)),
+    ('make_masked_msa',
+     lambda rng: np_transforms.make_masked_msa(_MASKED_MSA, 0.15, rng=rng),
+     lambda: tf_transforms.make_masked_msa(_MASKED_MSA, 0.15)),
+    ('nearest_neighbor_clusters',
+     lambda rng: np_transforms.nearest_neighbor_clusters(),
+     lambda: tf_transforms.nearest_neighbor_clusters()),
+    ('summarize_clusters',
+     lambda rng: np_transforms.summarize_clusters(),
+     lambda: tf_transforms.summarize_clusters()),
+    ('crop_extra_msa',
+     lambda rng: np_transforms.crop_extra_msa(10, rng=rng),
+     lambda: tf_transforms.crop_extra_msa(10)),
+    ('make_msa_feat',
+     lambda rng: np_transforms.make_msa_feat(),
+     lambda: tf_transforms.make_msa_feat()),
+)
+
+
+def _permutation(n):
+  return np.random.RandomState(n).permutation(n).astype(np.int32)
+
+
+def _uniform(shape):
+  return np.random.RandomState(list(shape)).random_sample(shape).astype(
+      np.float32)
+
+
+def _quantile_categorical(probs):
+  # The masked MSA puts most probability on the last, [MASK], category, so a
+  # low quantile samples one of the amino acids.
+  cumulative = np.cumsum(probs, axis=-1)
+  return np.sum(cumulative < 0.2 * cumulative[..., -1:], axis=-1).astype(
+      np.int32)
+
+
+class _FixedDraws:
+  """A NumPy generator whose permutations and uniform draws depend on shape.
+
+  Integers are drawn from the wrapped generator.
+  """
+
+  def __init__(self, rng):
+    self._rng = rng
+
+  def permutation(self, x):
+    if isinstance(x, (int, np.integer)):
+      return _permutation(x)
+    return np.asarray(x)[_permutation(len(x))]
+
+  def random(self, size):
+    return _uniform(size)
+
+  def integers(self, *args, **kwargs):
+    return self._rng.integers(*args, **kwargs)
+
+
+@contextlib.contextmanager
+def _fixed_random_draws():
+  """Makes both pipelines draw the same numbers, which depend on the shape."""
+  tf_uniform = tf.random.uniform
+  default_rng = np.random.default_rng
+
+  def uniform(shape, minval=0, maxval=None, dtype=tf.float32, **kwargs):
+    if maxval is not None or dtype != tf.float32:
+      return tf_uniform(shape, minval, maxval, dtype, **kwargs)
+    draws = tf.numpy_function(lambda s: _uniform(tuple(s)),
+                              [tf.convert_to_tensor(shape, tf.int32)],
+                              tf.float32)
+    return tf.reshape(draws, shape)
+
+  def random_shuffle(value, **unused_kwargs):
+    perm = tf.numpy_function(lambda n: _permutation(int(n)),
+                             [tf.shape(value)[0]], tf.int32)
+    perm.set_shape(value.shape[:1])
+    return tf.gather(value, perm)
+
+  def tf_shaped_categorical(probs, **unused_kwargs):
+    samples = tf.numpy_function(_quantile_categorical, [probs], tf.int32)
+    return tf.reshape(samples, shape_helpers.shape_list(probs)[:-1])
+
+  with mock.patch.object(tf.random, 'uniform', uniform), \
+      mock.patch.object(tf, 'random_shuffle', random_shuffle), \
+      mock.patch.object(tf_transforms, 'shaped_categorical',
+                        tf_shaped_categorical), \
+      mock.patch.object(np_transforms, 'shaped_categorical',
+                        lambda probs, rng: _quantile_categorical(probs)), \
+      mock.patch.object(np.random, 'default_rng',
+                        lambda seed=None: _FixedDraws(default_rng(seed))):
+    yield
+
+
+def _run_tf_transform(transform, protein):
+  with tf.Graph().as_default():
+    outputs = transform({k: tf.constant(v) for k, v in protein.items()})
+    with tf.Session() as sess:
+      return sess.run(outputs)
+
+
+def _random_raw_features(num_res, num_seq, num_templates, seed=0):
+  rng = np.random.default_rng(seed)
+  restypes = list(residue_constants.restypes)
+  sequences = [''.join(rng.choice(restypes + ['-'], num_res))
+               for _ in range(num_seq)]
+  sequences[0] = sequences[0].replace('-', 'A')
+  msa = parsers.Msa(
+      sequences=sequences,
+      deletion_matrix=rng.integers(0, 3, (num_seq, num_res), dtype=np.int32),
+      descriptions=['hit'] * num_seq)
+  return {
+      **pipeline.make_sequence_features(
+          sequence=sequences[0], description='query', num_res=num_res),
+      **pipeline.make_msa_features([msa]),
+      'template_aatype': np.eye(22, dtype=np.float32)[
+          rng.integers(0, 22, (num_templates, num_res))],
+      'template_all_atom_masks': (
+          rng.random((num_templates, num_res, 37)) > 0.3).astype(np.float32),
+      'template_all_atom_positions': rng.normal(
+          size=(num_templates, num_res, 37, 3)).astype(np.float32),
+      'template_domain_names': np.array([b'1abc_A'] * num_templates,
+                                        dtype=object),
+      'template_sum_probs': rng.random((num_templates, 1)).astype(np.float32),
+  }
+
+
+def _data_config(use_numpy_pipeline):
+  cfg = config.model_config('model_1')
+  cfg.data.common.max_extra_msa = 16
+  cfg.data.common.num_recycle = 1
+  cfg.data.common.use_numpy_pipeline = use_numpy_pipeline
+  cfg.data.eval.max_msa_clusters = 8
+  return cfg
+
+
+def _nonensembled_features(raw_features):
+  """Returns the features the ensembled transforms start from."""
+  cfg, feature_names = features.make_data_config(
+      _data_config(use_numpy_pipeline=True),
+      num_res=int(raw_features['seq_length'][0]))
+  np_example = dict(raw_features)
+  np_example['deletion_matrix'] = (
+      np_example.pop('deletion_matrix_int').astype(np.float32))
+  arrays = np_input_pipeline.np_to_feature_dict(np_example, feature_names)
+  protein = np_input_pipeline.compose(np_input_pipeline.nonensembled_map_fns(
+      cfg, np.random.default_rng(0)))(arrays)
+  return {k: v for k, v in protein.items() if v.dtype != object}
+
+
+class InputPipelineTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      (name, i) for i, (name, _, _) in enumerate(_ENSEMBLED_TRANSFORMS))
+  def test_transform_matches_tf(self, index):
+    protein = _nonensembled_features(_random_raw_features(
+        num_res=20, num_seq=24, num_templates=2))
+    rng = _FixedDraws(np.random.default_rng(0))
+    _, np_transform, tf_transform = _ENSEMBLED_TRANSFORMS[index]
+
+    with _fixed_random_draws():
+      for _, previous_transform, _ in _ENSEMBLED_TRANSFORMS[:index]:
+        protein = previous_transform(rng)(protein)
+      expected = _run_tf_transform(tf_transform(), dict(protein))
+      actual = np_transform(rng)(dict(protein))
+
+    self.assertSameElements(expected, actual)
+    for k, v in expected.items():
+      with self.subTest(k):
+        self.assertEqual(actual[k].shape, v.shape)
+        self.assertEqual(actual[k].dtype, v.dtype)
+        np.testing.assert_allclose(actual[k], v, atol=1e-5)
+
+  @parameterized.named_parameters(
+      ('single_sequence', 1, 0.0, 1),
+      ('msa', 24, 0.15, 1),
+      ('ensemble', 24, 0.15, 2),
+  )
+  def test_matches_tf_pipeline(self, num_seq, replace_fraction, num_ensemble):
+    raw_features = _random_raw_features(
+        num_res=20, num_seq=num_seq, num_templates=6)
+    tf_config = _data_config(use_numpy_pipeline=False)
+    tf_config.data.eval.masked_msa_replace_fraction = replace_fraction
+    tf_config.data.eval.num_ensemble = num_ensemble
+    np_config = copy.deepcopy(tf_config)
+    np_config.data.common.use_numpy_pipeline = True
+
+    with _fixed_random_draws():
+      expected = features.np_example_to_features(raw_features, tf_config)
+      actual = features.np_example_to_features(raw_features, np_config)
+
+    self.assertSameElements(expected, actual)
+    for k, v in expected.items():
+      with self.subTest(k):
+        self.assertEqual(actual[k].shape, v.shape)
+        self.assertEqual(actual[k].dtype, v.dtype)
+        # Only seeds the cropping, which keeps all residues and templates.
+        if k != 'random_crop_to_size_seed':
+          np.testing.assert_allclose(actual[k], v, atol=1e-5)
+
+  def test_shaped_categorical_samples_probabilities(self):
+    probs = np.array([[0.1, 0.2, 0.7], [0.5, 0., 0.5]], dtype=np.float32)
+
+    samples = np_transforms.shaped_categorical(
+        np.broadcast_to(probs, (20000, 2, 3)), np.random.default_rng(0))
+
+    self.assertEqual(samples.shape, (20000, 2))
+    frequencies = np.mean(samples[..., None] == np.arange(3), axis=0)
+    np.testing.assert_allclose(frequencies, probs, atol=0.02)
+
+  def test_same_seed_same_features(self):
+    raw_features = _random_raw_features(
+        num_res=20, num_seq=24, num_templates=2)
+    cfg = _data_config(use_numpy_pipeline=True)
+
+    first = features.np_example_to_features(raw_features, cfg, random_seed=3)
+    second = features.np_example_to_features(raw_features, cfg, random_seed=3)
+    other = features.np_example_to_features(raw_features, cfg, random_seed=4)
+
+    for k, v in first.items():
+      np.testing.assert_array_equal(second[k], v)
+    self.assertFalse(np.array_equal(other['true_msa'], first['true_msa']))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,172 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Orders targets by their input shapes and estimates their cost.
+
+Running targets of the same (bucketed) input shape one after the other
+compiles each shape once, and running them from small to large or large to
+small avoids fragmenting the device memory between sizes. The cost of a
+target is estimated from its input shapes relative to the other targets and
+calibrated with the runtimes of the finished targets to report an ETA.
+"""
+
+import collections
+import dataclasses
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import ml_collections
+
+TARGET_ORDERS = ('given', 'ascending', 'descending')
+
+
+@dataclasses.dataclass(frozen=True)
+class TargetEstimate:
+  """The estimated cost of predicting a target.
+
+  Contains:
+    target_name: The name of the target.
+    num_res: The number of residues of the model inputs, after padding.
+    num_msa: The number of MSA rows that the model reads.
+    shape_key: The key shared by targets with the same model input shapes.
+    cost: The relative compute cost of the target. The pair representation
+      updates scale with num_res**3 and the MSA updates with
+      num_msa * num_res**2.
+    activation_bytes: The size of the pair and MSA representations in the
+      dtype the Evoformer runs in, a lower bound of the device memory the
+      target needs besides the parameters.
+  """
+  target_name: str
+  num_res: int
+  num_msa: int
+  shape_key: Tuple[int, ...]
+  cost: float
+  activation_bytes: int
+
+
+def max_msa_rows(model_config: ml_collections.ConfigDict,
+                 multimer_mode: bool) -> int:
+  """Returns how many MSA rows, clusters and extra, the model reads."""
+  if multimer_mode:
+    evoformer_config = model_config.model.embeddings_and_evoformer
+    return evoformer_config.num_msa + evoformer_config.num_extra_msa
+  return (model_config.data.eval.max_msa_clusters +
+          model_config.data.common.max_extra_msa)
+
+
+def estimate_target(
+    target_name: str,
+    shape_key: Tuple[int, ...],
+    msa_depth: int,
+    model_config: ml_collections.ConfigDict,
+    multimer_mode: bool) -> TargetEstimate:
+  """Estimates the cost of a target.
+
+  Args:
+    target_name: The name of the target.
+    shape_key: The key of the model input shapes of the target, whose first
+      element is the number of residues after padding.
+    msa_depth: The number of sequences in the MSA of the target, after
+      padding. Only used in multimer mode, the monomer input pipeline pads the
+      MSA to the number of rows that the model reads.
+    model_config: The config of the models.
+    multimer_mode: Whether the models are multimer models.
+
+  Returns:
+    The estimate.
+  """
+  num_res = shape_key[0]
+  num_msa = max_msa_rows(model_config, multimer_mode)
+  if multimer_mode:
+    num_msa = min(msa_depth, num_msa)
+  evoformer_config = model_config.model.embeddings_and_evoformer
+  # The Evoformer keeps its activations in bfloat16 if the config asks for it.
+  dtype_bytes = 2 if model_config.model.global_config.bfloat16 else 4
+  activation_bytes = dtype_bytes * (
+      num_res**2 * evoformer_config.pair_channel +
+      num_msa * num_res * evoformer_config.msa_channel)
+  return TargetEstimate(
+      target_name=target_name,
+      num_res=num_res,
+      num_msa=num_msa,
+      shape_key=tuple(shape_key),
+      cost=float(num_res**3 + num_msa * num_res**2),
+      activation_bytes=activation_bytes)
+
+
+def order_targets(
+    estimates: Sequence[TargetEstimate],
+    order: str) -> List[TargetEstimate]:
+  """Orders targets so that targets of the same input shape run together.
+
+  Args:
+    estimates: The estimates of the targets, in the given order.
+    order: One of TARGET_ORDERS. 'given' keeps the order, 'ascending' runs the
+      shapes from the cheapest to the most expensive and 'descending' the
+      other way round. The targets of a shape keep their given order.
+
+  Returns:
+    The ordered estimates.
+  """
+  if order not in TARGET_ORDERS:
+    raise ValueError(f'Unknown target order {order}, expected one of '
+                     f'{TARGET_ORDERS}.')
+  if order == 'given':
+    return list(estimates)
+  by_shape = collections.defaultdict(list)
+  for estimate in estimates:
+    by_shape[estimate.shape_key].append(estimate)
+  shape_groups = sorted(by_shape.values(), key=lambda g: g[0].cost,
+                        reverse=order == 'descending')
+  return [estimate for group in shape_groups for estimate in group]
+
+
+class EtaTracker:
+  """Estimates the remaining runtime from the runtimes of finished targets."""
+
+  def __init__(self, estimates: Iterable[TargetEstimate]):
+    self._costs = {e.target_name: e.cost for e in estimates}
+    self._done_cost = 0.
+    self._done_seconds = 0.
+    self._remaining = set(self._costs)
+
+  def record(self, target_names: Sequence[str], seconds: float):
+    """Records that the targets finished in the given time, together."""
+    for target_name in target_names:
+      if target_name in self._remaining:
+        self._remaining.remove(target_name)
+        self._done_cost += self._costs[target_name]
+    self._done_seconds += seconds
+
+  @property
+  def num_remaining(self) -> int:
+    return len(self._remaining)
+
+  def eta_seconds(self) -> Optional[float]:
+    """Returns the estimated remaining seconds, None before any target."""
+    if not self._done_cost:
+      return None
+    remaining_cost = sum(self._costs[name] for name in self._remaining)
+    return remaining_cost * self._done_seconds / self._done_cost
+
+  def progress(self) -> float:
+    """Returns the fraction of the total cost that is done."""
+    total_cost = sum(self._costs.values())
+    return self._done_cost / total_cost if total_cost else 1.
+
+
+def schedule_summary(
+    estimates: Sequence[TargetEstimate]) -> Dict[str, Mapping[str, object]]:
+  """Returns the estimates by target name, in order, for schedule.json."""
+  return {e.target_name: {'position': i, **dataclasses.asdict(e)}
+          for i, e in enumerate(estimates)}
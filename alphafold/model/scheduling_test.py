@@ -0,0 +1,83 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for scheduling."""
+
+from absl.testing import absltest
+from alphafold.model import config
+from alphafold.model import scheduling
+
+
+class SchedulingTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.model_config = config.model_config('model_1')
+    self.estimates = [
+        scheduling.estimate_target(name, (num_res,), 1000, self.model_config,
+                                   multimer_mode=False)
+        for name, num_res in [('a', 512), ('b', 256), ('c', 512), ('d', 768)]]
+
+  def test_estimate_target(self):
+    estimate = self.estimates[1]
+    self.assertEqual(estimate.num_res, 256)
+    # The monomer input pipeline pads the MSA to 512 clusters and 5120 extra
+    # sequences, however deep it is.
+    num_msa = 512 + 5120
+    self.assertEqual(estimate.num_msa, num_msa)
+    self.assertEqual(estimate.cost, 256**3 + num_msa * 256**2)
+    self.assertEqual(estimate.activation_bytes,
+                     4 * (256**2 * 128 + num_msa * 256 * 256))
+
+    self.model_config.model.global_config.bfloat16 = True
+    half = scheduling.estimate_target('b', (256,), 1000, self.model_config,
+                                      multimer_mode=False)
+    self.assertEqual(half.activation_bytes, estimate.activation_bytes // 2)
+
+    shallow = scheduling.estimate_target('e', (256,), 10, self.model_config,
+                                         multimer_mode=False)
+    self.assertEqual(shallow.num_msa, num_msa)
+
+    multimer_config = config.model_config('model_1_multimer_v3')
+    shallow = scheduling.estimate_target('f', (256, 128, 4), 128,
+                                         multimer_config, multimer_mode=True)
+    self.assertEqual(shallow.num_msa, 128)
+    deep = scheduling.estimate_target('g', (256, 8192, 4), 8192,
+                                      multimer_config, multimer_mode=True)
+    self.assertEqual(deep.num_msa, 508 + 2048)
+
+  def test_order_targets(self):
+    def names(order):
+      return [e.target_name for e in scheduling.order_targets(
+          self.estimates, order)]
+    self.assertEqual(names('given'), ['a', 'b', 'c', 'd'])
+    self.assertEqual(names('ascending'), ['b', 'a', 'c', 'd'])
+    self.assertEqual(names('descending'), ['d', 'a', 'c', 'b'])
+
+  def test_eta(self):
+    tracker = scheduling.EtaTracker(self.estimates)
+    self.assertIsNone(tracker.eta_seconds())
+    tracker.record(['b'], 10.)
+    self.assertEqual(tracker.num_remaining, 3)
+    remaining_cost = (sum(e.cost for e in self.estimates) -
+                      self.estimates[1].cost)
+    self.assertAlmostEqual(tracker.eta_seconds(),
+                           remaining_cost * 10. / self.estimates[1].cost)
+    tracker.record(['a', 'c', 'd'], 100.)
+    self.assertEqual(tracker.eta_seconds(), 0.)
+    self.assertEqual(tracker.progress(), 1.)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -113,7 +113,9 @@ def flat_params_to_haiku(params: Mapping[str, np.ndarray]) -> hk.Params:
     scope, name = path.split('//')
     if scope not in hk_params:
       hk_params[scope] = {}
-    hk_params[scope][name] = jnp.array(array)
+    # Aligned read-only arrays, like memory-mapped ones, are used without a
+    # copy on the CPU.
+    hk_params[scope][name] = jnp.asarray(array)
 
   return hk_params
 
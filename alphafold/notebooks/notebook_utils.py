@@ -80,7 +80,7 @@ def merge_chunked_msa(
     # Jackhmmer lists sequences as <sequence name>/<residue from>-<residue to>.
     e_values = [e_values_dict[t.partition('/')[0]] for t in msa.descriptions]
     chunk_results = zip(
-        msa.sequences, msa.deletion_matrix, msa.descriptions, e_values)
+        msa.sequences, msa.deletion_matrix.tolist(), msa.descriptions, e_values)
     if chunk_index != 0:
       next(chunk_results)  # Only take query (first hit) from the first chunk.
     unsorted_results.extend(chunk_results)
@@ -22,7 +22,7 @@ import random
 import shutil
 import sys
 import time
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Optional, Union
 
 from absl import app
 from absl import flags
@@ -30,11 +30,15 @@ from absl import logging
 from alphafold.common import confidence
 from alphafold.common import protein
 from alphafold.common import residue_constants
+from alphafold.common import results
+from alphafold.data import feature_store
+from alphafold.data import msa_cache as msa_cache_lib
 from alphafold.data import pipeline
 from alphafold.data import pipeline_multimer
 from alphafold.data import templates
 from alphafold.data.tools import hhsearch
 from alphafold.data.tools import hmmsearch
+from alphafold.model import bucketing
 from alphafold.model import config
 from alphafold.model import data
 from alphafold.model import model
@@ -112,6 +116,29 @@ flags.DEFINE_boolean('benchmark', False, 'Run multiple JAX model evaluations '
                      'to obtain a timing that excludes the compilation time, '
                      'which should be more indicative of the time required for '
                      'inferencing many proteins.')
+flags.DEFINE_boolean('bucket_shapes', False, 'Pad the model inputs to a '
+                     'few bucket sizes and crop the outputs back, so that '
+                     'the models are compiled once per bucket instead of '
+                     'once per sequence length. Useful when predicting many '
+                     'targets in one run.')
+flags.DEFINE_list('residue_buckets',
+                  [str(b) for b in bucketing.DEFAULT_RESIDUE_BUCKETS],
+                  'Numbers of residues the inputs are padded to with '
+                  '--bucket_shapes. Longer inputs are not padded.')
+flags.DEFINE_list('msa_buckets',
+                  [str(b) for b in bucketing.DEFAULT_MSA_BUCKETS],
+                  'Numbers of MSA rows the multimer inputs are padded to with '
+                  '--bucket_shapes.')
+flags.DEFINE_string('compilation_cache_dir', None, 'If set, compiled models '
+                    'are stored in and reused from this directory across '
+                    'runs. Combine with --bucket_shapes, and precompile the '
+                    'buckets with scripts/precompile_models.py.')
+flags.DEFINE_string('params_store_dir', None, 'If set, the model parameters '
+                    'are memory-mapped from uncompressed parameter files in '
+                    'this directory, converted from the params_*.npz files on '
+                    'first use, instead of being read into memory. Processes '
+                    'on a node that share the directory share the pages of '
+                    'the parameters and load them without decompressing.')
 flags.DEFINE_integer('random_seed', None, 'The random seed for the data '
                      'pipeline. By default, this is randomly generated. Note '
                      'that even if this is set, Alphafold may still not be '
@@ -122,6 +149,54 @@ flags.DEFINE_integer('num_multimer_predictions_per_model', 5, 'How many '
                      'generated per model. E.g. if this is 2 and there are 5 '
                      'models then there will be 10 predictions per input. '
                      'Note: this FLAG only applies if model_preset=multimer')
+flags.DEFINE_integer('multimer_seed_batch_size', 1, 'How many of the '
+                     'predictions of a multimer model to run at once, '
+                     'vmapped over their random seeds. Larger batches keep '
+                     'the accelerator busy on small complexes, but need '
+                     'proportionally more memory.')
+flags.DEFINE_list('result_outputs', None, 'If set, only these model outputs '
+                  '(keys of the result dicts, e.g. distogram or '
+                  'representations) are transferred from the device and '
+                  'stored in result_model_*.pkl, besides the structure, '
+                  'confidence metrics and number of recycles that the outputs '
+                  'are written from. By default, all outputs are stored.')
+flags.DEFINE_enum('result_format', 'pkl', ['pkl', 'npz', 'npz_float16'],
+                  'The format of the result_model_*.* files. pkl pickles the '
+                  'result dict. npz stores one compressed array per output, '
+                  'which alphafold.common.results.load_result reads on '
+                  'access; npz_float16 stores the large float outputs like '
+                  'logits and representations in float16 as well.')
+flags.DEFINE_float('device_memory_budget_gb', None, 'If set, the device '
+                   'memory in GB available to the models. The subbatch and '
+                   'chunk sizes of the models are then chosen per input '
+                   'shape as the largest whose estimated peak memory fits, '
+                   'trading speed for memory only where needed. The choice '
+                   'is recorded in timings.json.')
+flags.DEFINE_float('recycle_early_stop_tolerance', None, 'If set, stop '
+                   'recycling once the CA pairwise distances change by less '
+                   'than this many Angstroms between recycling iterations. '
+                   'Negative values disable early stopping. By default, the '
+                   'multimer models stop at 0.5 and the monomer models '
+                   'always run all iterations.')
+flags.DEFINE_boolean('monomer_bfloat16', False, 'Whether to run the '
+                     'embeddings and Evoformer of the monomer models in '
+                     'bfloat16, as the multimer models always do. This halves '
+                     'their activation memory, so that longer sequences fit. '
+                     'Softmaxes, layer norms and the structure module still '
+                     'run in float32. scripts/validate_bfloat16.py compares '
+                     'the predictions against float32.')
+flags.DEFINE_boolean('numpy_input_pipeline', False, 'Whether to process the '
+                     'monomer features with the NumPy input pipeline instead '
+                     'of the TensorFlow one. It computes the same features '
+                     'without building a TensorFlow graph per prediction, but '
+                     'samples the MSA with different random numbers.')
+flags.DEFINE_enum('features_format', 'pkl', ['pkl', 'npy', 'npy_compressed'],
+                  'How to write the features. pkl pickles them to '
+                  'features.pkl. npy writes a feature store to features/, '
+                  'with one file per array that run_alphafold_inference.py '
+                  'memory-maps, loading only the features the models read; '
+                  'npy_compressed gzips the arrays, which are then read into '
+                  'memory instead.')
 flags.DEFINE_boolean('use_precomputed_msas', False, 'Whether to read MSAs that '
                      'have been written to disk instead of running the MSA '
                      'tools. The MSA files are looked up in the output '
@@ -129,6 +204,35 @@ flags.DEFINE_boolean('use_precomputed_msas', False, 'Whether to read MSAs that '
                      'runs that are to reuse the MSAs. WARNING: This will not '
                      'check if the sequence, database or configuration have '
                      'changed.')
+flags.DEFINE_integer('num_msa_search_workers', 1, 'How many of the '
+                     'independent MSA database searches (UniRef90 with the '
+                     'template search, MGnify and BFD) to run concurrently for '
+                     'each sequence. With 1, they run one after another.')
+flags.DEFINE_integer('msa_search_cpus', None, 'If set, the total number of '
+                     'CPUs to split between the concurrently running MSA '
+                     'search tools. By default each tool uses its own '
+                     'default number of CPUs.')
+flags.DEFINE_boolean('use_database_shards', False, 'Whether to search the '
+                     'shards of the jackhmmer databases written by '
+                     'scripts/shard_database.py in parallel instead of the '
+                     'databases themselves. The database paths must then be '
+                     'the shard prefixes. E-values are computed for the size '
+                     'of the full database.')
+flags.DEFINE_string('msa_cache_dir', None, 'If set, a directory in which MSAs '
+                    'are cached by sequence, database and search parameters, '
+                    'so that chains that were searched before, e.g. in '
+                    'another job, are not searched again.')
+flags.DEFINE_float('msa_cache_max_gb', None, 'If set, the maximum size of the '
+                   'MSA cache in gigabytes. The least recently used MSAs are '
+                   'evicted first.')
+flags.DEFINE_integer('num_template_workers', 1, 'How many processes to '
+                     'featurize template hits in. With more than 1, the next '
+                     'best hits are featurized in parallel; the same '
+                     'templates are picked either way.')
+flags.DEFINE_string('template_store_dir', None, 'Path to a template store '
+                    'built from --template_mmcif_dir with '
+                    'scripts/build_template_store.py. Templates in the store '
+                    'are read from it instead of being parsed from mmCIF.')
 flags.DEFINE_enum_class('models_to_relax', ModelsToRelax.BEST, ModelsToRelax,
                         'The models to run the final relaxation step on. '
                         'If `all`, all models are relaxed, which may be time '
@@ -152,6 +256,12 @@ RELAX_STIFFNESS = 10.0
 RELAX_EXCLUDE_RESIDUES = []
 RELAX_MAX_OUTER_ITERATIONS = 3
 
+# The outputs of the models that the structures and confidence files are
+# written from, kept with --result_outputs.
+_REQUIRED_RESULT_OUTPUTS = (
+    'iptm', 'max_predicted_aligned_error', 'num_recycles', 'plddt',
+    'predicted_aligned_error', 'ptm', 'ranking_confidence', 'structure_module')
+
 
 def _check_flag(flag_name: str,
                 other_flag_name: str,
@@ -229,6 +339,22 @@ def _save_pae_json_file(
     f.write(pae_json)
 
 
+def _save_result_file(
+    prediction_result: Dict[str, Any],
+    output_dir: str,
+    model_name: str,
+    result_format: str) -> None:
+  """Saves the model outputs in the given --result_format."""
+  if result_format == 'pkl':
+    result_output_path = os.path.join(output_dir, f'result_{model_name}.pkl')
+    with open(result_output_path, 'wb') as f:
+      pickle.dump(prediction_result, f, protocol=4)
+  else:
+    results.save_result(
+        os.path.join(output_dir, f'result_{model_name}.npz'),
+        prediction_result, float16=result_format == 'npz_float16')
+
+
 def predict_structure(
     fasta_path: str,
     fasta_name: str,
@@ -240,6 +366,9 @@ def predict_structure(
     random_seed: int,
     models_to_relax: ModelsToRelax,
     model_type: str,
+    seed_batches: Optional[Dict[str, List[str]]] = None,
+    result_format: str = 'pkl',
+    features_format: str = 'pkl',
 ):
   """Predicts structure using AlphaFold for the given sequence."""
   logging.info('Predicting %s', fasta_name)
@@ -258,10 +387,8 @@ def predict_structure(
       msa_output_dir=msa_output_dir)
   timings['features'] = time.time() - t_0
 
-  # Write out features as a pickled dictionary.
-  features_output_path = os.path.join(output_dir, 'features.pkl')
-  with open(features_output_path, 'wb') as f:
-    pickle.dump(feature_dict, f, protocol=4)
+  # Write out features as a pickled dictionary or a feature store.
+  feature_store.write_features(output_dir, feature_dict, features_format)
 
   unrelaxed_pdbs = {}
   unrelaxed_proteins = {}
@@ -271,28 +398,48 @@ def predict_structure(
 
   # Run the models.
   num_models = len(model_runners)
+  model_random_seeds = {
+      model_name: model_index + random_seed * num_models
+      for model_index, model_name in enumerate(model_runners)}
+  seed_batches = seed_batches or {}
+  # Predictions made along with an earlier one of their seed batch.
+  batched_results = {}
   for model_index, (model_name, model_runner) in enumerate(
       model_runners.items()):
     logging.info('Running model %s on %s', model_name, fasta_name)
     t_0 = time.time()
-    model_random_seed = model_index + random_seed * num_models
+    model_random_seed = model_random_seeds[model_name]
     processed_feature_dict = model_runner.process_features(
         feature_dict, random_seed=model_random_seed)
     timings[f'process_features_{model_name}'] = time.time() - t_0
 
     t_0 = time.time()
-    prediction_result = model_runner.predict(processed_feature_dict,
-                                             random_seed=model_random_seed)
+    seed_batch = seed_batches.get(model_name)
+    if seed_batch:
+      batch_random_seeds = [model_random_seeds[name] for name in seed_batch]
+      if model_name not in batched_results:
+        batched_results.update(zip(seed_batch, model_runner.predict_batch(
+            processed_feature_dict, random_seeds=batch_random_seeds)))
+      prediction_result = batched_results.pop(model_name)
+    else:
+      prediction_result = model_runner.predict(processed_feature_dict,
+                                               random_seed=model_random_seed)
     t_diff = time.time() - t_0
     timings[f'predict_and_compile_{model_name}'] = t_diff
+    if model_runner.memory_budget_bytes:
+      timings[f'chunk_sizes_{model_name}'] = model_runner.chunk_sizes
     logging.info(
         'Total JAX model %s on %s predict time (includes compilation time, see --benchmark): %.1fs',
         model_name, fasta_name, t_diff)
 
     if benchmark:
       t_0 = time.time()
-      model_runner.predict(processed_feature_dict,
-                           random_seed=model_random_seed)
+      if seed_batch:
+        model_runner.predict_batch(processed_feature_dict,
+                                   random_seeds=batch_random_seeds)
+      else:
+        model_runner.predict(processed_feature_dict,
+                             random_seed=model_random_seed)
       t_diff = time.time() - t_0
       timings[f'predict_benchmark_{model_name}'] = t_diff
       logging.info(
@@ -315,9 +462,8 @@ def predict_structure(
     np_prediction_result = _jnp_to_np(dict(prediction_result))
 
     # Save the model outputs.
-    result_output_path = os.path.join(output_dir, f'result_{model_name}.pkl')
-    with open(result_output_path, 'wb') as f:
-      pickle.dump(np_prediction_result, f, protocol=4)
+    _save_result_file(np_prediction_result, output_dir, model_name,
+                      result_format)
 
     # Add the predicted LDDT in the b-factor column.
     # Note that higher predicted LDDT value means higher model confidence.
@@ -470,7 +616,9 @@ def main(argv):
         max_hits=MAX_TEMPLATE_HITS,
         kalign_binary_path=FLAGS.kalign_binary_path,
         release_dates_path=None,
-        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path)
+        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path,
+        num_workers=FLAGS.num_template_workers,
+        template_store_dir=FLAGS.template_store_dir)
   else:
     template_searcher = hhsearch.HHSearch(
         binary_path=FLAGS.hhsearch_binary_path,
@@ -481,7 +629,18 @@ def main(argv):
         max_hits=MAX_TEMPLATE_HITS,
         kalign_binary_path=FLAGS.kalign_binary_path,
         release_dates_path=None,
-        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path)
+        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path,
+        num_workers=FLAGS.num_template_workers,
+        template_store_dir=FLAGS.template_store_dir)
+
+  if FLAGS.msa_cache_dir:
+    if FLAGS.msa_cache_max_gb is not None:
+      msa_cache_max_size = int(FLAGS.msa_cache_max_gb * 1024 ** 3)
+    else:
+      msa_cache_max_size = None
+    msa_cache = msa_cache_lib.MsaCache(FLAGS.msa_cache_dir, msa_cache_max_size)
+  else:
+    msa_cache = None
 
   monomer_data_pipeline = pipeline.DataPipeline(
       jackhmmer_binary_path=FLAGS.jackhmmer_binary_path,
@@ -494,7 +653,11 @@ def main(argv):
       template_searcher=template_searcher,
       template_featurizer=template_featurizer,
       use_small_bfd=use_small_bfd,
-      use_precomputed_msas=FLAGS.use_precomputed_msas)
+      use_precomputed_msas=FLAGS.use_precomputed_msas,
+      num_search_workers=FLAGS.num_msa_search_workers,
+      search_cpu_budget=FLAGS.msa_search_cpus,
+      use_database_shards=FLAGS.use_database_shards,
+      msa_cache=msa_cache)
 
   if run_multimer_system:
     num_predictions_per_model = FLAGS.num_multimer_predictions_per_model
@@ -502,11 +665,29 @@ def main(argv):
         monomer_data_pipeline=monomer_data_pipeline,
         jackhmmer_binary_path=FLAGS.jackhmmer_binary_path,
         uniprot_database_path=FLAGS.uniprot_database_path,
-        use_precomputed_msas=FLAGS.use_precomputed_msas)
+        use_precomputed_msas=FLAGS.use_precomputed_msas,
+        use_database_shards=FLAGS.use_database_shards,
+        msa_cache=msa_cache)
   else:
     num_predictions_per_model = 1
     data_pipeline = monomer_data_pipeline
 
+  if FLAGS.compilation_cache_dir:
+    model.enable_compilation_cache(FLAGS.compilation_cache_dir)
+  if FLAGS.bucket_shapes:
+    residue_buckets = [int(b) for b in FLAGS.residue_buckets]
+    msa_buckets = [int(b) for b in FLAGS.msa_buckets]
+  else:
+    residue_buckets = msa_buckets = None
+  if FLAGS.device_memory_budget_gb:
+    memory_budget_bytes = int(FLAGS.device_memory_budget_gb * 2**30)
+  else:
+    memory_budget_bytes = None
+  if FLAGS.result_outputs:
+    output_keys = set(_REQUIRED_RESULT_OUTPUTS) | set(FLAGS.result_outputs)
+  else:
+    output_keys = None
+
   model_runners = {}
   model_names = config.MODEL_PRESETS[FLAGS.model_preset]
   for model_name in model_names:
@@ -515,14 +696,28 @@ def main(argv):
       model_config.model.num_ensemble_eval = num_ensemble
     else:
       model_config.data.eval.num_ensemble = num_ensemble
+      model_config.data.common.use_numpy_pipeline = FLAGS.numpy_input_pipeline
+      model_config.model.global_config.bfloat16 = FLAGS.monomer_bfloat16
+    if FLAGS.recycle_early_stop_tolerance is not None:
+      model_config.model.recycle_early_stop_tolerance = (
+          FLAGS.recycle_early_stop_tolerance)
     model_params = data.get_model_haiku_params(
-        model_name=model_name, data_dir=FLAGS.data_dir)
-    model_runner = model.RunModel(model_config, model_params)
+        model_name=model_name, data_dir=FLAGS.data_dir,
+        params_store_dir=FLAGS.params_store_dir)
+    model_runner = model.RunModel(
+        model_config, model_params, residue_buckets=residue_buckets,
+        msa_buckets=msa_buckets, memory_budget_bytes=memory_budget_bytes,
+        output_keys=output_keys)
     for i in range(num_predictions_per_model):
       model_runners[f'{model_name}_pred_{i}'] = model_runner
 
   logging.info('Have %d models: %s', len(model_runners),
                list(model_runners.keys()))
+  # Models with the same config share their compiled model function.
+  logging.info('The models share %d compiled model functions.',
+               len({id(r.apply) for r in model_runners.values()}))
+  seed_batches = model.get_seed_batches(
+      model_runners, FLAGS.multimer_seed_batch_size)
 
   amber_relaxer = relax.AmberRelaxation(
       max_iterations=RELAX_MAX_ITERATIONS,
@@ -551,6 +746,9 @@ def main(argv):
         random_seed=random_seed,
         models_to_relax=FLAGS.models_to_relax,
         model_type=model_type,
+        seed_batches=seed_batches,
+        result_format=FLAGS.result_format,
+        features_format=FLAGS.features_format,
     )
 
 
@@ -14,7 +14,12 @@
 # limitations under the License.
 
 """AlphaFold inference script - runs model predictions from preprocessed features."""
+import collections
+from concurrent import futures
+import dataclasses
+import datetime
 import enum
+import functools
 import json
 import os
 import pathlib
@@ -22,19 +27,25 @@ import pickle
 import random
 import sys
 import time
-from typing import Any, Dict, Mapping
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
 
 from absl import app
 from absl import flags
 from absl import logging
 from alphafold.common import confidence
+from alphafold.common import job_spool
 from alphafold.common import protein
 from alphafold.common import residue_constants
+from alphafold.common import results
+from alphafold.data import feature_store
+from alphafold.model import bucketing
 from alphafold.model import config
 from alphafold.model import data
 from alphafold.model import model
+from alphafold.model import scheduling
 from alphafold.relax import relax
 import jax.numpy as jnp
+import ml_collections
 import numpy as np
 
 logging.set_verbosity(logging.INFO)
@@ -49,8 +60,9 @@ class ModelsToRelax(enum.Enum):
 
 flags.DEFINE_list(
     'target_names', None, 'Names of targets to run inference on. These should '
-    'correspond to directories in the output_dir containing features.pkl files. '
-    'If not specified, will run on all targets with features.pkl files.')
+    'correspond to directories in the output_dir containing features.pkl files '
+    'or feature stores. If not specified, will run on all targets with '
+    'features.')
 flags.DEFINE_string('output_dir', None, 'Path to directory containing '
                     'preprocessed features and where results will be stored.')
 flags.DEFINE_string('data_dir', None, 'Path to directory of supporting data '
@@ -64,6 +76,29 @@ flags.DEFINE_boolean('benchmark', False, 'Run multiple JAX model evaluations '
                      'to obtain a timing that excludes the compilation time, '
                      'which should be more indicative of the time required for '
                      'inferencing many proteins.')
+flags.DEFINE_boolean('bucket_shapes', False, 'Pad the model inputs to a '
+                     'few bucket sizes and crop the outputs back, so that '
+                     'the models are compiled once per bucket instead of '
+                     'once per sequence length. Useful when predicting many '
+                     'targets in one run.')
+flags.DEFINE_list('residue_buckets',
+                  [str(b) for b in bucketing.DEFAULT_RESIDUE_BUCKETS],
+                  'Numbers of residues the inputs are padded to with '
+                  '--bucket_shapes. Longer inputs are not padded.')
+flags.DEFINE_list('msa_buckets',
+                  [str(b) for b in bucketing.DEFAULT_MSA_BUCKETS],
+                  'Numbers of MSA rows the multimer inputs are padded to with '
+                  '--bucket_shapes.')
+flags.DEFINE_string('compilation_cache_dir', None, 'If set, compiled models '
+                    'are stored in and reused from this directory across '
+                    'runs. Combine with --bucket_shapes, and precompile the '
+                    'buckets with scripts/precompile_models.py.')
+flags.DEFINE_string('params_store_dir', None, 'If set, the model parameters '
+                    'are memory-mapped from uncompressed parameter files in '
+                    'this directory, converted from the params_*.npz files on '
+                    'first use, instead of being read into memory. Processes '
+                    'on a node that share the directory share the pages of '
+                    'the parameters and load them without decompressing.')
 flags.DEFINE_integer('random_seed', None, 'The random seed for the data '
                      'pipeline. By default, this is randomly generated. Note '
                      'that even if this is set, Alphafold may still not be '
@@ -74,6 +109,87 @@ flags.DEFINE_integer('num_multimer_predictions_per_model', 5, 'How many '
                      'generated per model. E.g. if this is 2 and there are 5 '
                      'models then there will be 10 predictions per input. '
                      'Note: this FLAG only applies if model_preset=multimer')
+flags.DEFINE_integer('multimer_seed_batch_size', 1, 'How many of the '
+                     'predictions of a multimer model to run at once, '
+                     'vmapped over their random seeds. Larger batches keep '
+                     'the accelerator busy on small complexes, but need '
+                     'proportionally more memory.')
+flags.DEFINE_integer('target_batch_size', 1, 'How many targets of the same '
+                     'bucket to run through the models at once, stacked '
+                     'along a batch dimension. Speeds up many small targets. '
+                     'Combine with --bucket_shapes, otherwise only targets '
+                     'with the same input shapes share a batch.')
+flags.DEFINE_enum('target_order', 'given', list(scheduling.TARGET_ORDERS),
+                  'The order in which to run the targets. given keeps the '
+                  'order of --target_names, or of the target directories. '
+                  'ascending runs the targets grouped by their (bucketed) '
+                  'input shape from the smallest to the largest, so that each '
+                  'shape is compiled once and results arrive early; '
+                  'descending runs the largest first, which avoids '
+                  'fragmenting the device memory. The order and estimated '
+                  'cost of the targets are written to schedule.json in '
+                  '--output_dir.')
+flags.DEFINE_list('result_outputs', None, 'If set, only these model outputs '
+                  '(keys of the result dicts, e.g. distogram or '
+                  'representations) are transferred from the device and '
+                  'stored in result_model_*.pkl, besides the structure, '
+                  'confidence metrics and number of recycles that the outputs '
+                  'are written from. By default, all outputs are stored.')
+flags.DEFINE_enum('result_format', 'pkl', ['pkl', 'npz', 'npz_float16'],
+                  'The format of the result_model_*.* files. pkl pickles the '
+                  'result dict. npz stores one compressed array per output, '
+                  'which alphafold.common.results.load_result reads on '
+                  'access; npz_float16 stores the large float outputs like '
+                  'logits and representations in float16 as well.')
+flags.DEFINE_float('device_memory_budget_gb', None, 'If set, the device '
+                   'memory in GB available to the models. The subbatch and '
+                   'chunk sizes of the models are then chosen per input '
+                   'shape as the largest whose estimated peak memory fits, '
+                   'trading speed for memory only where needed. The choice '
+                   'is recorded in timings.json.')
+flags.DEFINE_float('recycle_early_stop_tolerance', None, 'If set, stop '
+                   'recycling once the CA pairwise distances change by less '
+                   'than this many Angstroms between recycling iterations. '
+                   'Negative values disable early stopping. By default, the '
+                   'multimer models stop at 0.5 and the monomer models '
+                   'always run all iterations.')
+flags.DEFINE_boolean('monomer_bfloat16', False, 'Whether to run the '
+                     'embeddings and Evoformer of the monomer models in '
+                     'bfloat16, as the multimer models always do. This halves '
+                     'their activation memory, so that longer sequences fit. '
+                     'Softmaxes, layer norms and the structure module still '
+                     'run in float32. scripts/validate_bfloat16.py compares '
+                     'the predictions against float32.')
+flags.DEFINE_boolean('numpy_input_pipeline', False, 'Whether to process the '
+                     'monomer features with the NumPy input pipeline instead '
+                     'of the TensorFlow one. It computes the same features '
+                     'without building a TensorFlow graph per prediction, but '
+                     'samples the MSA with different random numbers.')
+flags.DEFINE_integer('num_host_workers', 0, 'If set, the number of threads '
+                     'that write the outputs and relax the predictions while '
+                     'the models predict. The features are processed ahead '
+                     'on one more thread. Relaxation and output writing of up '
+                     'to this many targets may be pending at a time. By '
+                     'default, all steps run one after the other.')
+flags.DEFINE_string('spool_dir', None, 'If set, run as a long-lived worker '
+                    'that keeps the models loaded and compiled, and runs the '
+                    'jobs submitted to this spool directory with '
+                    'scripts/submit_inference_jobs.py instead of the targets '
+                    'in --output_dir. The queue depth and job counts are '
+                    'written to status.json in the spool directory.')
+flags.DEFINE_float('spool_poll_interval', 5., 'How many seconds a --spool_dir '
+                   'worker waits before looking for new jobs when the spool '
+                   'is empty.')
+flags.DEFINE_float('spool_idle_timeout', None, 'If set, a --spool_dir worker '
+                   'exits after the spool has been empty for this many '
+                   'seconds. By default, it runs until it is stopped or the '
+                   'spool is closed, see run_alphafold_pipeline.py.')
+flags.DEFINE_float('spool_claim_timeout', None, 'If set, a --spool_dir worker '
+                   'that finds the spool empty re-queues the jobs that were '
+                   'claimed more than this many seconds ago, assuming that '
+                   'their worker is gone. It must be longer than any job '
+                   'takes. Jobs of workers on the same host that have exited '
+                   'are always re-queued.')
 flags.DEFINE_enum_class('models_to_relax', ModelsToRelax.BEST, ModelsToRelax,
                         'The models to run the final relaxation step on. '
                         'If `all`, all models are relaxed, which may be time '
@@ -96,6 +212,12 @@ RELAX_STIFFNESS = 10.0
 RELAX_EXCLUDE_RESIDUES = []
 RELAX_MAX_OUTER_ITERATIONS = 3
 
+# The outputs of the models that the structures and confidence files are
+# written from, kept with --result_outputs.
+_REQUIRED_RESULT_OUTPUTS = (
+    'iptm', 'max_predicted_aligned_error', 'num_recycles', 'plddt',
+    'predicted_aligned_error', 'ptm', 'ranking_confidence', 'structure_module')
+
 
 def _jnp_to_np(output: Dict[str, Any]) -> Dict[str, Any]:
   """Recursively changes jax arrays to numpy arrays."""
@@ -142,116 +264,271 @@ def _save_pae_json_file(
     f.write(pae_json)
 
 
-def run_inference_on_target(
-    target_name: str,
+def _save_result_file(
+    prediction_result: Dict[str, Any],
+    output_dir: str,
+    model_name: str,
+    result_format: str) -> None:
+  """Saves the model outputs in the given --result_format."""
+  if result_format == 'pkl':
+    result_output_path = os.path.join(output_dir, f'result_{model_name}.pkl')
+    with open(result_output_path, 'wb') as f:
+      pickle.dump(prediction_result, f, protocol=4)
+  else:
+    results.save_result(
+        os.path.join(output_dir, f'result_{model_name}.npz'),
+        prediction_result, float16=result_format == 'npz_float16')
+
+
+@dataclasses.dataclass(frozen=True)
+class _TargetBatchPrediction:
+  """The prediction of one model for a target of a batch of targets."""
+  processed_features: Dict[str, Any]
+  result: Mapping[str, Any]
+  timings: Dict[str, Any]
+
+
+def _target_shape_key(
+    feature_shapes: Mapping[str, Tuple[int, ...]],
+    multimer_mode: bool,
+    residue_buckets: Optional[Sequence[int]],
+    msa_buckets: Optional[Sequence[int]]) -> Tuple[int, ...]:
+  """Returns a key shared by targets with the same padded model inputs."""
+  num_res = bucketing.get_bucket_size(
+      feature_shapes['residue_index'][0], residue_buckets)
+  if not multimer_mode:
+    # The input pipeline pads the MSA and templates to fixed sizes.
+    return (num_res,)
+  num_msa = bucketing.get_bucket_size(
+      feature_shapes['msa'][0], msa_buckets)
+  return (num_res, num_msa, feature_shapes['template_aatype'][0])
+
+
+def _estimate_targets(
+    target_names: Sequence[str],
+    output_dir_base: str,
+    model_config: ml_collections.ConfigDict,
+    multimer_mode: bool,
+    residue_buckets: Optional[Sequence[int]],
+    msa_buckets: Optional[Sequence[int]],
+) -> List[scheduling.TargetEstimate]:
+  """Estimates the cost of the targets that have features, from their shapes."""
+  estimates = []
+  for target_name in target_names:
+    target_dir = os.path.join(output_dir_base, target_name)
+    if not feature_store.has_features(target_dir):
+      continue
+    feature_shapes = feature_store.read_feature_shapes(target_dir)
+    shape_key = _target_shape_key(feature_shapes, multimer_mode,
+                                  residue_buckets, msa_buckets)
+    estimates.append(scheduling.estimate_target(
+        target_name,
+        shape_key,
+        # The multimer models read the MSA as padded to its bucket.
+        msa_depth=shape_key[1] if multimer_mode else feature_shapes['msa'][0],
+        model_config=model_config,
+        multimer_mode=multimer_mode))
+  return estimates
+
+
+def _get_input_feature_names(
+    model_runners: Dict[str, model.RunModel]) -> Optional[List[str]]:
+  """Returns the raw features any of the models reads, None if all."""
+  feature_names = {}
+  for model_runner in model_runners.values():
+    model_feature_names = model_runner.input_feature_names()
+    if model_feature_names is None:
+      return None
+    feature_names.update(dict.fromkeys(model_feature_names))
+  return list(feature_names)
+
+
+def _get_target_batches(
+    target_names: Sequence[str],
+    shape_keys: Mapping[str, Tuple[int, ...]],
+    target_batch_size: int) -> List[List[str]]:
+  """Groups the targets into batches of targets with the same input shapes.
+
+  Args:
+    target_names: The targets, in the order to run them.
+    shape_keys: The input shape key of each target that has features.
+    target_batch_size: The maximum number of targets per batch.
+
+  Returns:
+    The batches of target names.
+  """
+  targets_by_shape = collections.defaultdict(list)
+  target_batches = []
+  for target_name in target_names:
+    if target_name not in shape_keys:
+      # Reported by run_inference_on_target.
+      target_batches.append([target_name])
+      continue
+    targets_by_shape[shape_keys[target_name]].append(target_name)
+
+  for shape_key, shape_target_names in targets_by_shape.items():
+    for i in range(0, len(shape_target_names), target_batch_size):
+      target_batches.append(shape_target_names[i:i + target_batch_size])
+    logging.info('%d targets have input shape %s.',
+                 len(shape_target_names), shape_key)
+  return target_batches
+
+
+def _predict_target_batch(
+    target_names: Sequence[str],
     output_dir_base: str,
     model_runners: Dict[str, model.RunModel],
-    amber_relaxer: relax.AmberRelaxation,
-    benchmark: bool,
     random_seed: int,
-    models_to_relax: ModelsToRelax,
-    model_type: str,
-):
-  """Runs inference for a single target from preprocessed features."""
-  logging.info('Running inference for %s', target_name)
-  timings = {}
-  output_dir = os.path.join(output_dir_base, target_name)
-  
-  # Load preprocessed features
-  features_input_path = os.path.join(output_dir, 'features.pkl')
-  if not os.path.exists(features_input_path):
-    logging.error('Features not found for %s at %s. Run preprocessing first.',
-                  target_name, features_input_path)
-    return
-  
-  with open(features_input_path, 'rb') as f:
-    feature_dict = pickle.load(f)
-  
-  # Load preprocessing metadata if available
-  metadata_path = os.path.join(output_dir, 'preprocessing_metadata.json')
-  if os.path.exists(metadata_path):
-    with open(metadata_path, 'r') as f:
-      preprocessing_metadata = json.load(f)
-      logging.info('Loaded preprocessing metadata for %s', target_name)
-  
-  unrelaxed_pdbs = {}
-  unrelaxed_proteins = {}
-  relaxed_pdbs = {}
-  relax_metrics = {}
-  ranking_confidences = {}
+) -> Dict[str, Dict[str, _TargetBatchPrediction]]:
+  """Runs each model on a batch of targets at once.
 
-  # Run the models.
+  Args:
+    target_names: The targets, whose features have the same shapes after
+      padding.
+    output_dir_base: The output directory with the features of the targets.
+    model_runners: The model runners, by prediction name.
+    random_seed: The random seed, as passed to run_inference_on_target.
+
+  Returns:
+    The predictions of each target, by target name and prediction name.
+  """
+  feature_names = _get_input_feature_names(model_runners)
+  feature_dicts = [
+      feature_store.read_features(os.path.join(output_dir_base, target_name),
+                                  fields=feature_names)
+      for target_name in target_names]
+
+  predictions = {target_name: {} for target_name in target_names}
   num_models = len(model_runners)
   for model_index, (model_name, model_runner) in enumerate(
       model_runners.items()):
-    logging.info('Running model %s on %s', model_name, target_name)
-    t_0 = time.time()
+    logging.info('Running model %s on %d targets', model_name,
+                 len(target_names))
+    # The same seeds as without batching.
     model_random_seed = model_index + random_seed * num_models
-    processed_feature_dict = model_runner.process_features(
-        feature_dict, random_seed=model_random_seed)
-    timings[f'process_features_{model_name}'] = time.time() - t_0
+    t_0 = time.time()
+    processed_feature_dicts = [
+        model_runner.process_features(
+            feature_dict, random_seed=model_random_seed)
+        for feature_dict in feature_dicts]
+    process_time = (time.time() - t_0) / len(target_names)
 
     t_0 = time.time()
-    prediction_result = model_runner.predict(processed_feature_dict,
-                                             random_seed=model_random_seed)
+    prediction_results = model_runner.predict_targets(
+        processed_feature_dicts,
+        random_seeds=[model_random_seed] * len(target_names))
     t_diff = time.time() - t_0
-    timings[f'predict_and_compile_{model_name}'] = t_diff
     logging.info(
-        'Total JAX model %s on %s predict time (includes compilation time, see --benchmark): %.1fs',
-        model_name, target_name, t_diff)
+        'Total JAX model %s on %d targets predict time (includes compilation time): %.1fs',
+        model_name, len(target_names), t_diff)
 
-    if benchmark:
-      t_0 = time.time()
-      model_runner.predict(processed_feature_dict,
-                           random_seed=model_random_seed)
-      t_diff = time.time() - t_0
-      timings[f'predict_benchmark_{model_name}'] = t_diff
-      logging.info(
-          'Total JAX model %s on %s predict time (excludes compilation time): %.1fs',
-          model_name, target_name, t_diff)
+    # The predict time is that of the whole batch.
+    timings = {f'process_features_{model_name}': process_time,
+               f'predict_and_compile_{model_name}': t_diff}
+    if model_runner.memory_budget_bytes:
+      timings[f'chunk_sizes_{model_name}'] = model_runner.chunk_sizes
+    for target_name, processed_feature_dict, prediction_result in zip(
+        target_names, processed_feature_dicts, prediction_results):
+      predictions[target_name][model_name] = _TargetBatchPrediction(
+          processed_features=processed_feature_dict,
+          result=prediction_result,
+          timings=timings)
+  return predictions
 
-    plddt = prediction_result['plddt']
-    _save_confidence_json_file(plddt, output_dir, model_name)
-    ranking_confidences[model_name] = prediction_result['ranking_confidence']
 
-    if (
-        'predicted_aligned_error' in prediction_result
-        and 'max_predicted_aligned_error' in prediction_result
-    ):
-      pae = prediction_result['predicted_aligned_error']
-      max_pae = prediction_result['max_predicted_aligned_error']
-      _save_pae_json_file(pae, float(max_pae), output_dir, model_name)
+def _run_now(fn: Callable[..., Any], *args, **kwargs) -> futures.Future:
+  """Runs fn at once and returns its result as a completed future."""
+  future = futures.Future()
+  future.set_result(fn(*args, **kwargs))
+  return future
 
-    # Remove jax dependency from results.
-    np_prediction_result = _jnp_to_np(dict(prediction_result))
 
-    # Save the model outputs.
-    result_output_path = os.path.join(output_dir, f'result_{model_name}.pkl')
-    with open(result_output_path, 'wb') as f:
-      pickle.dump(np_prediction_result, f, protocol=4)
-
-    # Add the predicted LDDT in the b-factor column.
-    plddt_b_factors = np.repeat(
-        plddt[:, None], residue_constants.atom_type_num, axis=-1)
-    unrelaxed_protein = protein.from_prediction(
-        features=processed_feature_dict,
-        result=prediction_result,
-        b_factors=plddt_b_factors,
-        remove_leading_feature_dimension=not model_runner.multimer_mode)
-
-    unrelaxed_proteins[model_name] = unrelaxed_protein
-    unrelaxed_pdbs[model_name] = protein.to_pdb(unrelaxed_protein)
-    unrelaxed_pdb_path = os.path.join(output_dir, f'unrelaxed_{model_name}.pdb')
-    with open(unrelaxed_pdb_path, 'w') as f:
-      f.write(unrelaxed_pdbs[model_name])
+def _process_features(
+    model_runner: model.RunModel,
+    feature_dict: Dict[str, Any],
+    random_seed: int) -> Tuple[Dict[str, Any], float]:
+  """Returns the processed features and the time it took to process them."""
+  t_0 = time.time()
+  processed_feature_dict = model_runner.process_features(
+      feature_dict, random_seed=random_seed)
+  return processed_feature_dict, time.time() - t_0
 
-    _save_mmcif_file(
-        prot=unrelaxed_protein,
-        output_dir=output_dir,
-        model_name=f'unrelaxed_{model_name}',
-        file_id=str(model_index),
-        model_type=model_type,
-    )
+
+def _write_model_outputs(
+    output_dir: str,
+    model_name: str,
+    model_index: int,
+    prediction_result: Mapping[str, Any],
+    processed_feature_dict: Dict[str, Any],
+    multimer_mode: bool,
+    model_type: str,
+    result_format: str,
+) -> Tuple[protein.Protein, str]:
+  """Writes the outputs of a model, returns the unrelaxed protein and PDB."""
+  plddt = prediction_result['plddt']
+  _save_confidence_json_file(plddt, output_dir, model_name)
+
+  if (
+      'predicted_aligned_error' in prediction_result
+      and 'max_predicted_aligned_error' in prediction_result
+  ):
+    pae = prediction_result['predicted_aligned_error']
+    max_pae = prediction_result['max_predicted_aligned_error']
+    _save_pae_json_file(pae, float(max_pae), output_dir, model_name)
+
+  # Remove jax dependency from results.
+  np_prediction_result = _jnp_to_np(dict(prediction_result))
+
+  # Save the model outputs.
+  _save_result_file(np_prediction_result, output_dir, model_name,
+                    result_format)
+
+  # Add the predicted LDDT in the b-factor column.
+  plddt_b_factors = np.repeat(
+      plddt[:, None], residue_constants.atom_type_num, axis=-1)
+  unrelaxed_protein = protein.from_prediction(
+      features=processed_feature_dict,
+      result=prediction_result,
+      b_factors=plddt_b_factors,
+      remove_leading_feature_dimension=not multimer_mode)
+
+  unrelaxed_pdb = protein.to_pdb(unrelaxed_protein)
+  unrelaxed_pdb_path = os.path.join(output_dir, f'unrelaxed_{model_name}.pdb')
+  with open(unrelaxed_pdb_path, 'w') as f:
+    f.write(unrelaxed_pdb)
+
+  _save_mmcif_file(
+      prot=unrelaxed_protein,
+      output_dir=output_dir,
+      model_name=f'unrelaxed_{model_name}',
+      file_id=str(model_index),
+      model_type=model_type,
+  )
+  return unrelaxed_protein, unrelaxed_pdb
+
+
+def _relax_and_write_ranked(
+    target_name: str,
+    output_dir: str,
+    model_outputs: Mapping[str, futures.Future],
+    ranking_confidences: Dict[str, Any],
+    ranking_label: str,
+    amber_relaxer: relax.AmberRelaxation,
+    models_to_relax: ModelsToRelax,
+    model_type: str,
+    timings: Dict[str, Any],
+) -> Dict[str, Any]:
+  """Relaxes the predictions of a target, writes them in rank order.
+
+  Returns the timings of the target.
+  """
+  unrelaxed_proteins = {}
+  unrelaxed_pdbs = {}
+  for model_name, model_output in model_outputs.items():
+    unrelaxed_proteins[model_name], unrelaxed_pdbs[model_name] = (
+        model_output.result())
+  relaxed_pdbs = {}
+  relax_metrics = {}
 
   # Rank by model confidence.
   ranked_order = [
@@ -317,9 +594,9 @@ def run_inference_on_target(
 
   ranking_output_path = os.path.join(output_dir, 'ranking_debug.json')
   with open(ranking_output_path, 'w') as f:
-    label = 'iptm+ptm' if 'iptm' in prediction_result else 'plddts'
     f.write(json.dumps(
-        {label: ranking_confidences, 'order': ranked_order}, indent=4))
+        {ranking_label: ranking_confidences, 'order': ranked_order},
+        indent=4))
 
   logging.info('Final timings for %s: %s', target_name, timings)
 
@@ -330,6 +607,261 @@ def run_inference_on_target(
     relax_metrics_path = os.path.join(output_dir, 'relax_metrics.json')
     with open(relax_metrics_path, 'w') as f:
       f.write(json.dumps(relax_metrics, indent=4))
+  return timings
+
+
+def run_inference_on_target(
+    target_name: str,
+    output_dir_base: str,
+    model_runners: Dict[str, model.RunModel],
+    amber_relaxer: relax.AmberRelaxation,
+    benchmark: bool,
+    random_seed: int,
+    models_to_relax: ModelsToRelax,
+    model_type: str,
+    seed_batches: Optional[Dict[str, List[str]]] = None,
+    target_batch_predictions: Optional[
+        Dict[str, _TargetBatchPrediction]] = None,
+    host_executor: Optional[futures.Executor] = None,
+    result_format: str = 'pkl',
+    features_executor: Optional[futures.Executor] = None,
+) -> Optional[futures.Future]:
+  """Runs inference for a single target from preprocessed features.
+
+  With a host_executor, the outputs of the previous models are written on it
+  while a model predicts, and the target is relaxed and its ranked outputs
+  written on it as well, so that the device can go on with the next target.
+  The features of the next model are processed on features_executor, or on
+  host_executor if it is not set. A separate features_executor keeps the
+  feature processing, which the device waits for, from queueing behind the
+  relaxation of earlier targets.
+
+  Args:
+    target_name: The name of the target, i.e. of its output directory.
+    output_dir_base: The output directory with the features of the targets.
+    model_runners: The model runners, by prediction name.
+    amber_relaxer: The relaxer of the predictions.
+    benchmark: Whether to run every prediction twice to time it without
+      compilation.
+    random_seed: The random seed of the target.
+    models_to_relax: Which predictions to relax.
+    model_type: The model type written to the mmCIF files.
+    seed_batches: The batch of seeds of each prediction that is made in one
+      with other predictions of its model, see model.get_seed_batches.
+    target_batch_predictions: The predictions of the target that were made in
+      a batch of targets, by prediction name.
+    host_executor: If set, the executor to run host-side work on.
+    result_format: The format of the result files, see --result_format.
+    features_executor: If set, the executor to process the features on.
+
+  Returns:
+    A future of the relaxation and output writing of the target, whose result
+    is the timings of the target, or None if the target has no features.
+  """
+  logging.info('Running inference for %s', target_name)
+  timings = {}
+  output_dir = os.path.join(output_dir_base, target_name)
+  
+  # Load preprocessed features
+  if not feature_store.has_features(output_dir):
+    logging.error('Features not found for %s in %s. Run preprocessing first.',
+                  target_name, output_dir)
+    return
+
+  # Only the features the models read are loaded from feature stores.
+  feature_dict = feature_store.read_features(
+      output_dir, fields=_get_input_feature_names(model_runners))
+  
+  # Load preprocessing metadata if available
+  metadata_path = os.path.join(output_dir, 'preprocessing_metadata.json')
+  if os.path.exists(metadata_path):
+    with open(metadata_path, 'r') as f:
+      preprocessing_metadata = json.load(f)
+      logging.info('Loaded preprocessing metadata for %s', target_name)
+  
+  ranking_confidences = {}
+  submit = host_executor.submit if host_executor else _run_now
+  features_executor = features_executor or host_executor
+  submit_features = (
+      features_executor.submit if features_executor else _run_now)
+  # The unrelaxed protein and PDB of each prediction, once written.
+  model_outputs = {}
+
+  # Run the models.
+  num_models = len(model_runners)
+  model_names = list(model_runners)
+  model_random_seeds = {
+      model_name: model_index + random_seed * num_models
+      for model_index, model_name in enumerate(model_runners)}
+  seed_batches = seed_batches or {}
+  target_batch_predictions = target_batch_predictions or {}
+  # Predictions made along with an earlier one of their seed batch.
+  batched_results = {}
+  # The features of the models whose predictions are yet to be made.
+  processed_features = {}
+
+  def _submit_process_features(model_name):
+    if model_name not in target_batch_predictions:
+      processed_features[model_name] = submit_features(
+          _process_features, model_runners[model_name], feature_dict,
+          model_random_seeds[model_name])
+
+  _submit_process_features(model_names[0])
+  for model_index, (model_name, model_runner) in enumerate(
+      model_runners.items()):
+    logging.info('Running model %s on %s', model_name, target_name)
+    if model_index + 1 < num_models:
+      # Processed while this model predicts.
+      _submit_process_features(model_names[model_index + 1])
+    if model_name in target_batch_predictions:
+      # Predicted along with the other targets of its batch.
+      target_batch_prediction = target_batch_predictions[model_name]
+      processed_feature_dict = target_batch_prediction.processed_features
+      prediction_result = target_batch_prediction.result
+      timings.update(target_batch_prediction.timings)
+    else:
+      model_random_seed = model_random_seeds[model_name]
+      processed_feature_dict, timings[f'process_features_{model_name}'] = (
+          processed_features.pop(model_name).result())
+      t_0 = time.time()
+      seed_batch = seed_batches.get(model_name)
+      if seed_batch:
+        batch_random_seeds = [model_random_seeds[name] for name in seed_batch]
+        if model_name not in batched_results:
+          batched_results.update(zip(seed_batch, model_runner.predict_batch(
+              processed_feature_dict, random_seeds=batch_random_seeds)))
+        prediction_result = batched_results.pop(model_name)
+      else:
+        prediction_result = model_runner.predict(processed_feature_dict,
+                                                 random_seed=model_random_seed)
+      t_diff = time.time() - t_0
+      timings[f'predict_and_compile_{model_name}'] = t_diff
+      if model_runner.memory_budget_bytes:
+        timings[f'chunk_sizes_{model_name}'] = model_runner.chunk_sizes
+      logging.info(
+          'Total JAX model %s on %s predict time (includes compilation time, see --benchmark): %.1fs',
+          model_name, target_name, t_diff)
+
+      if benchmark:
+        t_0 = time.time()
+        if seed_batch:
+          model_runner.predict_batch(processed_feature_dict,
+                                     random_seeds=batch_random_seeds)
+        else:
+          model_runner.predict(processed_feature_dict,
+                               random_seed=model_random_seed)
+        t_diff = time.time() - t_0
+        timings[f'predict_benchmark_{model_name}'] = t_diff
+        logging.info(
+            'Total JAX model %s on %s predict time (excludes compilation time): %.1fs',
+            model_name, target_name, t_diff)
+
+    ranking_confidences[model_name] = prediction_result['ranking_confidence']
+    model_outputs[model_name] = submit(
+        _write_model_outputs, output_dir, model_name, model_index,
+        prediction_result, processed_feature_dict, model_runner.multimer_mode,
+        model_type, result_format)
+
+  ranking_label = 'iptm+ptm' if 'iptm' in prediction_result else 'plddts'
+  return submit(
+      _relax_and_write_ranked, target_name, output_dir, model_outputs,
+      ranking_confidences, ranking_label, amber_relaxer, models_to_relax,
+      model_type, timings)
+
+
+def _serve_spool(
+    spool: job_spool.JobSpool,
+    run_target: Callable[[str, str], Optional[futures.Future]],
+    max_pending_jobs: int,
+    poll_interval: float,
+    idle_timeout: Optional[float],
+    claim_timeout: Optional[float] = None):
+  """Runs the jobs of a spool directory until it is closed or idle for long.
+
+  Args:
+    spool: The spool to claim jobs from.
+    run_target: Runs inference on the target of a job, given its name and
+      output directory, like run_inference_on_target.
+    max_pending_jobs: How many jobs may wait for their relaxation and output
+      writing while the next job runs.
+    poll_interval: How many seconds to wait for jobs when the spool is empty.
+    idle_timeout: If set, return once the spool has been empty for this many
+      seconds.
+    claim_timeout: If set, jobs claimed longer ago than this many seconds are
+      re-queued when the spool is empty, see JobSpool.requeue_stale_jobs.
+  """
+  # The jobs waiting for their relaxation and output writing, oldest first.
+  pending_jobs = collections.deque()
+  stats = {'jobs_run': 0, 'worker_start_time': time.time()}
+
+  def _complete_oldest_job():
+    job, pending_target, t_start = pending_jobs.popleft()
+    try:
+      timings = dict(pending_target.result())
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('Job %s failed.', job.name)
+      spool.fail(job, repr(e))
+      return
+    timings['queue_wait'] = t_start - job.submit_time
+    timings['total'] = time.time() - t_start
+    spool.finish(job, timings)
+    logging.info('Finished job %s in %.1fs.', job.name, timings['total'])
+
+  idle_since = time.time()
+  while True:
+    # Checked before claiming, so that a job submitted right before the spool
+    # is closed is claimed before the worker exits.
+    closed = spool.is_closed()
+    try:
+      job = spool.claim()
+      if job is None and not pending_jobs:
+        requeued = spool.requeue_stale_jobs(claim_timeout)
+      else:
+        requeued = []
+    except OSError:
+      logging.exception('Could not claim a job from %s.', spool.spool_dir)
+      time.sleep(poll_interval)
+      continue
+    if requeued:
+      logging.info('Re-queued the stale jobs %s.', ', '.join(requeued))
+      continue
+    if job is None:
+      if pending_jobs:
+        _complete_oldest_job()
+        continue
+      spool.write_status(current_job=None, **stats)
+      if closed:
+        logging.info('Spool %s is closed and empty, exiting.',
+                     spool.spool_dir)
+        return
+      if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+        logging.info('Spool %s has been idle for %.0fs, exiting.',
+                     spool.spool_dir, idle_timeout)
+        return
+      time.sleep(poll_interval)
+      continue
+
+    logging.info('Running job %s (%d more queued).', job.name,
+                 spool.queue_depth())
+    spool.write_status(current_job=job.name, **stats)
+    t_start = time.time()
+    try:
+      pending_target = run_target(job.target_name, job.output_dir)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception('Job %s failed.', job.name)
+      spool.fail(job, repr(e))
+      pending_target = None
+    else:
+      if pending_target is None:
+        spool.fail(job, 'Features not found in '
+                   f'{os.path.join(job.output_dir, job.target_name)}.')
+    if pending_target:
+      pending_jobs.append((job, pending_target, t_start))
+    stats['jobs_run'] += 1
+    # Bounds the host-side work queued behind the device.
+    while len(pending_jobs) > max_pending_jobs:
+      _complete_oldest_job()
+    idle_since = time.time()
 
 
 def main(argv):
@@ -345,17 +877,18 @@ def main(argv):
     num_ensemble = 1
 
   # Find targets to run inference on
-  if FLAGS.target_names:
+  if FLAGS.spool_dir:
+    # The targets are submitted to the spool while the worker runs.
+    target_names = []
+  elif FLAGS.target_names:
     target_names = FLAGS.target_names
   else:
-    # Find all directories with features.pkl files
+    # Find all directories with features.pkl files or feature stores
     target_names = []
     for entry in os.listdir(FLAGS.output_dir):
       target_dir = os.path.join(FLAGS.output_dir, entry)
-      if os.path.isdir(target_dir):
-        features_path = os.path.join(target_dir, 'features.pkl')
-        if os.path.exists(features_path):
-          target_names.append(entry)
+      if os.path.isdir(target_dir) and feature_store.has_features(target_dir):
+        target_names.append(entry)
     
     if not target_names:
       raise ValueError(f'No preprocessed features found in {FLAGS.output_dir}. '
@@ -364,6 +897,22 @@ def main(argv):
     logging.info('Found %d targets with preprocessed features: %s',
                  len(target_names), target_names)
 
+  if FLAGS.compilation_cache_dir:
+    model.enable_compilation_cache(FLAGS.compilation_cache_dir)
+  if FLAGS.bucket_shapes:
+    residue_buckets = [int(b) for b in FLAGS.residue_buckets]
+    msa_buckets = [int(b) for b in FLAGS.msa_buckets]
+  else:
+    residue_buckets = msa_buckets = None
+  if FLAGS.device_memory_budget_gb:
+    memory_budget_bytes = int(FLAGS.device_memory_budget_gb * 2**30)
+  else:
+    memory_budget_bytes = None
+  if FLAGS.result_outputs:
+    output_keys = set(_REQUIRED_RESULT_OUTPUTS) | set(FLAGS.result_outputs)
+  else:
+    output_keys = None
+
   # Set up model runners
   model_runners = {}
   model_names = config.MODEL_PRESETS[FLAGS.model_preset]
@@ -373,9 +922,18 @@ def main(argv):
       model_config.model.num_ensemble_eval = num_ensemble
     else:
       model_config.data.eval.num_ensemble = num_ensemble
+      model_config.data.common.use_numpy_pipeline = FLAGS.numpy_input_pipeline
+      model_config.model.global_config.bfloat16 = FLAGS.monomer_bfloat16
+    if FLAGS.recycle_early_stop_tolerance is not None:
+      model_config.model.recycle_early_stop_tolerance = (
+          FLAGS.recycle_early_stop_tolerance)
     model_params = data.get_model_haiku_params(
-        model_name=model_name, data_dir=FLAGS.data_dir)
-    model_runner = model.RunModel(model_config, model_params)
+        model_name=model_name, data_dir=FLAGS.data_dir,
+        params_store_dir=FLAGS.params_store_dir)
+    model_runner = model.RunModel(
+        model_config, model_params, residue_buckets=residue_buckets,
+        msa_buckets=msa_buckets, memory_budget_bytes=memory_budget_bytes,
+        output_keys=output_keys)
     
     if run_multimer_system:
       num_predictions_per_model = FLAGS.num_multimer_predictions_per_model
@@ -387,6 +945,11 @@ def main(argv):
 
   logging.info('Have %d models: %s', len(model_runners),
                list(model_runners.keys()))
+  # Models with the same config share their compiled model function.
+  logging.info('The models share %d compiled model functions.',
+               len({id(r.apply) for r in model_runners.values()}))
+  seed_batches = model.get_seed_batches(
+      model_runners, FLAGS.multimer_seed_batch_size)
 
   amber_relaxer = relax.AmberRelaxation(
       max_iterations=RELAX_MAX_ITERATIONS,
@@ -401,18 +964,108 @@ def main(argv):
     random_seed = random.randrange(sys.maxsize // len(model_runners))
   logging.info('Using random seed %d for inference', random_seed)
 
+  if FLAGS.num_host_workers:
+    host_executor = futures.ThreadPoolExecutor(
+        max_workers=FLAGS.num_host_workers)
+    # The features of one model are processed ahead at a time, on a thread of
+    # their own so that they never wait for a relaxation on host_executor.
+    features_executor = futures.ThreadPoolExecutor(max_workers=1)
+  else:
+    host_executor = None
+    features_executor = None
+
+  if FLAGS.spool_dir:
+    _serve_spool(
+        job_spool.JobSpool(FLAGS.spool_dir),
+        functools.partial(
+            run_inference_on_target,
+            model_runners=model_runners,
+            amber_relaxer=amber_relaxer,
+            benchmark=FLAGS.benchmark,
+            random_seed=random_seed,
+            models_to_relax=FLAGS.models_to_relax,
+            model_type=model_type,
+            seed_batches=seed_batches,
+            host_executor=host_executor,
+            result_format=FLAGS.result_format,
+            features_executor=features_executor),
+        max_pending_jobs=FLAGS.num_host_workers,
+        poll_interval=FLAGS.spool_poll_interval,
+        idle_timeout=FLAGS.spool_idle_timeout,
+        claim_timeout=FLAGS.spool_claim_timeout)
+    if host_executor:
+      host_executor.shutdown()
+      features_executor.shutdown()
+    return
+
+  # Targets without features stay in place and are reported when they run.
+  estimates = _estimate_targets(
+      target_names, FLAGS.output_dir,
+      model_config=next(iter(model_runners.values())).config,
+      multimer_mode=run_multimer_system, residue_buckets=residue_buckets,
+      msa_buckets=msa_buckets)
+  estimates = scheduling.order_targets(estimates, FLAGS.target_order)
+  estimated_names = iter(e.target_name for e in estimates)
+  target_names = [
+      next(estimated_names) if feature_store.has_features(
+          os.path.join(FLAGS.output_dir, target_name)) else target_name
+      for target_name in target_names]
+  with open(os.path.join(FLAGS.output_dir, 'schedule.json'), 'w') as f:
+    f.write(json.dumps(scheduling.schedule_summary(estimates), indent=4))
+  eta_tracker = scheduling.EtaTracker(estimates)
+
+  if FLAGS.target_batch_size > 1:
+    target_batches = _get_target_batches(
+        target_names, {e.target_name: e.shape_key for e in estimates},
+        FLAGS.target_batch_size)
+  else:
+    target_batches = [[target_name] for target_name in target_names]
+
+  # The relaxation and output writing of the last targets, oldest first.
+  pending_targets = collections.deque()
+
   # Run inference for each target
-  for target_name in target_names:
-    run_inference_on_target(
-        target_name=target_name,
-        output_dir_base=FLAGS.output_dir,
-        model_runners=model_runners,
-        amber_relaxer=amber_relaxer,
-        benchmark=FLAGS.benchmark,
-        random_seed=random_seed,
-        models_to_relax=FLAGS.models_to_relax,
-        model_type=model_type,
-    )
+  for target_batch in target_batches:
+    t_batch = time.time()
+    if len(target_batch) > 1:
+      batch_predictions = _predict_target_batch(
+          target_batch, FLAGS.output_dir, model_runners, random_seed)
+    else:
+      batch_predictions = {}
+    for target_name in target_batch:
+      pending_target = run_inference_on_target(
+          target_name=target_name,
+          output_dir_base=FLAGS.output_dir,
+          model_runners=model_runners,
+          amber_relaxer=amber_relaxer,
+          benchmark=FLAGS.benchmark,
+          random_seed=random_seed,
+          models_to_relax=FLAGS.models_to_relax,
+          model_type=model_type,
+          seed_batches=seed_batches,
+          target_batch_predictions=batch_predictions.get(target_name),
+          host_executor=host_executor,
+          result_format=FLAGS.result_format,
+          features_executor=features_executor,
+      )
+      if pending_target:
+        pending_targets.append(pending_target)
+      # Bounds the host-side work queued behind the device.
+      while len(pending_targets) > FLAGS.num_host_workers:
+        pending_targets.popleft().result()
+    eta_tracker.record(target_batch, time.time() - t_batch)
+    eta_seconds = eta_tracker.eta_seconds()
+    if eta_seconds is not None:
+      logging.info(
+          '%d targets left, %.0f%% of the estimated cost done, ETA %s.',
+          eta_tracker.num_remaining, 100 * eta_tracker.progress(),
+          datetime.timedelta(seconds=round(eta_seconds)))
+
+  while pending_targets:
+    pending_targets.popleft().result()
+  if host_executor:
+    host_executor.shutdown()
+    features_executor.shutdown()
 
 
 if __name__ == '__main__':
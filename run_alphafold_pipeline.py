@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""AlphaFold pipeline script - preprocesses and predicts targets as a stream.
+
+Runs run_alphafold_preprocess.py on up to --num_preprocess_workers targets at
+a time, and a run_alphafold_inference.py worker that predicts each target as
+soon as its features are written, instead of after all targets are
+preprocessed. Flags not defined here are passed on to both scripts, each of
+which ignores the flags of the other, e.g.
+
+  python run_alphafold_pipeline.py \
+    --fasta_paths=target1.fasta,target2.fasta \
+    --output_dir=/path/to/output \
+    --num_preprocess_workers=4 \
+    --data_dir=/path/to/alphafold/data \
+    --uniref90_database_path=... \
+    --model_preset=monomer \
+    --use_gpu_relax=true
+"""
+
+import collections
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import List, Sequence
+
+from absl import app
+from absl import flags
+from absl import logging
+from alphafold.common import job_spool
+
+logging.set_verbosity(logging.INFO)
+
+flags.DEFINE_list(
+    'fasta_paths', None, 'Paths to FASTA files, each containing a prediction '
+    'target, as for run_alphafold_preprocess.py. The targets are preprocessed '
+    'in this order.')
+flags.DEFINE_string('output_dir', None, 'Path to a directory that will '
+                    'store the features and results of the targets.')
+flags.DEFINE_integer('num_preprocess_workers', 1, 'How many targets to '
+                     'preprocess at a time, each in its own process.')
+flags.DEFINE_integer('max_queued_targets', 2, 'How many preprocessed targets '
+                     'may wait for inference. No more targets are '
+                     'preprocessed while this many wait, so that the '
+                     'features do not pile up when inference is the '
+                     'bottleneck.')
+flags.DEFINE_string('spool_dir', None, 'Path to the spool directory through '
+                    'which the preprocessed targets are passed to inference. '
+                    'Defaults to .inference_spool in --output_dir.')
+
+FLAGS = flags.FLAGS
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# How many seconds to wait between checks of the preprocessing processes.
+_POLL_INTERVAL = 1.0
+
+
+def _parse_flags(argv: List[str]) -> List[str]:
+  """Parses the flags of this script, returns the others to pass on."""
+  return FLAGS(argv, known_only=True)
+
+
+def _flag_names(args: Sequence[str]) -> List[str]:
+  """Returns the names of the flags in args, for --undefok."""
+  names = []
+  for arg in args:
+    if not arg.startswith('--'):
+      raise app.UsageError(
+          f'Unexpected argument {arg}. Pass the flags of the preprocessing '
+          'and inference scripts as --flag=value.')
+    name = arg[2:].split('=', 1)[0]
+    names.append(name)
+    if name.startswith('no'):
+      # A negated boolean flag.
+      names.append(name[2:])
+  return names
+
+
+def _script_command(script: str, args: Sequence[str]) -> List[str]:
+  return [sys.executable, os.path.join(_SCRIPT_DIR, script), *args]
+
+
+def main(argv):
+  passed_args = argv[1:]
+  # Each script ignores the flags that only the other one defines.
+  common_args = [f'--output_dir={FLAGS.output_dir}', *passed_args,
+                 f'--undefok={",".join(_flag_names(passed_args))}']
+
+  spool_dir = FLAGS.spool_dir or os.path.join(FLAGS.output_dir,
+                                              '.inference_spool')
+  spool = job_spool.JobSpool(spool_dir)
+  spool.reopen()
+  inference_process = subprocess.Popen(_script_command(
+      'run_alphafold_inference.py', [f'--spool_dir={spool_dir}',
+                                     *common_args]))
+  logging.info('Started the inference worker on spool %s.', spool_dir)
+
+  fasta_paths = collections.deque(FLAGS.fasta_paths)
+  # The preprocessing processes, by target name.
+  preprocess_processes = {}
+  failed_targets = []
+  # The inference jobs, by target name.
+  submitted_jobs = {}
+  try:
+    while fasta_paths or preprocess_processes:
+      if inference_process.poll() is not None:
+        raise RuntimeError('The inference worker exited with code '
+                           f'{inference_process.returncode}.')
+
+      for target_name, process in list(preprocess_processes.items()):
+        if process.poll() is None:
+          continue
+        del preprocess_processes[target_name]
+        if process.returncode:
+          logging.error('Preprocessing %s failed with code %d.', target_name,
+                        process.returncode)
+          failed_targets.append(target_name)
+        else:
+          submitted_jobs[target_name] = spool.submit(target_name,
+                                                     FLAGS.output_dir)
+          logging.info('Submitted %s for inference.', target_name)
+
+      # Backpressure: targets are only preprocessed while inference keeps up.
+      while (fasta_paths and
+             len(preprocess_processes) < FLAGS.num_preprocess_workers and
+             spool.queue_depth() < FLAGS.max_queued_targets):
+        fasta_path = fasta_paths.popleft()
+        target_name = pathlib.Path(fasta_path).stem
+        preprocess_processes[target_name] = subprocess.Popen(_script_command(
+            'run_alphafold_preprocess.py', [f'--fasta_paths={fasta_path}',
+                                            *common_args]))
+        logging.info('Started preprocessing %s (%d targets left).',
+                     target_name, len(fasta_paths))
+      time.sleep(_POLL_INTERVAL)
+  except BaseException:
+    for process in [*preprocess_processes.values(), inference_process]:
+      process.terminate()
+    raise
+  finally:
+    # The inference worker exits once it has run the submitted targets.
+    spool.close()
+
+  if inference_process.wait():
+    raise RuntimeError('The inference worker exited with code '
+                       f'{inference_process.returncode}.')
+  # The spool may hold jobs of earlier runs, so only this run's are checked.
+  failed_inference_targets = []
+  unfinished_targets = []
+  for target_name, job in submitted_jobs.items():
+    state = spool.job_state(job)
+    if state == 'failed':
+      failed_inference_targets.append(target_name)
+    elif state != 'done':
+      unfinished_targets.append(target_name)
+  logging.info('Inference finished for %d of %d submitted targets.',
+               len(submitted_jobs) - len(failed_inference_targets) -
+               len(unfinished_targets), len(submitted_jobs))
+  errors = []
+  if failed_targets:
+    errors.append(f'Preprocessing failed for {failed_targets}.')
+  if failed_inference_targets:
+    errors.append(f'Inference failed for {failed_inference_targets}, see '
+                  f'{os.path.join(spool_dir, "failed")}.')
+  if unfinished_targets:
+    errors.append(f'Inference did not finish for {unfinished_targets}.')
+  if errors:
+    raise RuntimeError(' '.join(errors))
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required([
+      'fasta_paths',
+      'output_dir',
+  ])
+  app.run(main, flags_parser=_parse_flags)
@@ -17,7 +17,6 @@
 import json
 import os
 import pathlib
-import pickle
 import shutil
 import sys
 import time
@@ -27,6 +26,8 @@ from absl import app
 from absl import flags
 from absl import logging
 from alphafold.common import residue_constants
+from alphafold.data import feature_store
+from alphafold.data import msa_cache as msa_cache_lib
 from alphafold.data import pipeline
 from alphafold.data import pipeline_multimer
 from alphafold.data import templates
@@ -97,8 +98,59 @@ flags.DEFINE_boolean('use_precomputed_msas', False, 'Whether to read MSAs that '
                      'runs that are to reuse the MSAs. WARNING: This will not '
                      'check if the sequence, database or configuration have '
                      'changed.')
+flags.DEFINE_integer('num_msa_search_workers', 1, 'How many of the '
+                     'independent MSA database searches (UniRef90 with the '
+                     'template search, MGnify and BFD) to run concurrently for '
+                     'each sequence. With 1, they run one after another.')
+flags.DEFINE_integer('msa_search_cpus', None, 'If set, the total number of '
+                     'CPUs to split between the concurrently running MSA '
+                     'search tools. By default each tool uses its own '
+                     'default number of CPUs.')
+flags.DEFINE_boolean('batch_msa_search', False, 'Whether to run the jackhmmer '
+                     'searches of all the input sequences as one batch before '
+                     'preprocessing them one by one. Together with '
+                     '--shared_scan_chunk_mb each jackhmmer database is read '
+                     'only once for the whole batch.')
+flags.DEFINE_integer('shared_scan_chunk_mb', None, 'If set, batched jackhmmer '
+                     'searches read each database once in chunks of this many '
+                     'megabytes and search all the queries of the batch '
+                     'against each chunk. The per-chunk hits are merged with '
+                     'E-values for the full database.')
+flags.DEFINE_string('shared_scan_dir', None, 'Directory in which database '
+                    'chunks are stored during a shared scan, ideally on fast '
+                    'local storage. Defaults to the system temporary '
+                    'directory.')
+flags.DEFINE_boolean('use_database_shards', False, 'Whether to search the '
+                     'shards of the jackhmmer databases written by '
+                     'scripts/shard_database.py in parallel instead of the '
+                     'databases themselves. The database paths must then be '
+                     'the shard prefixes. E-values are computed for the size '
+                     'of the full database.')
+flags.DEFINE_string('msa_cache_dir', None, 'If set, a directory in which MSAs '
+                    'are cached by sequence, database and search parameters, '
+                    'so that chains that were searched before, e.g. in '
+                    'another job, are not searched again.')
+flags.DEFINE_float('msa_cache_max_gb', None, 'If set, the maximum size of the '
+                   'MSA cache in gigabytes. The least recently used MSAs are '
+                   'evicted first.')
+flags.DEFINE_integer('num_template_workers', 1, 'How many processes to '
+                     'featurize template hits in. With more than 1, the next '
+                     'best hits are featurized in parallel; the same '
+                     'templates are picked either way.')
+flags.DEFINE_string('template_store_dir', None, 'Path to a template store '
+                    'built from --template_mmcif_dir with '
+                    'scripts/build_template_store.py. Templates in the store '
+                    'are read from it instead of being parsed from mmCIF.')
+flags.DEFINE_enum('features_format', 'pkl', ['pkl', 'npy', 'npy_compressed'],
+                  'How to write the features. pkl pickles them to '
+                  'features.pkl. npy writes a feature store to features/, '
+                  'with one file per array that run_alphafold_inference.py '
+                  'memory-maps, loading only the features the models read; '
+                  'npy_compressed gzips the arrays, which are then read into '
+                  'memory instead.')
 flags.DEFINE_boolean('skip_existing', False, 'Skip preprocessing for sequences '
-                     'that already have features.pkl in the output directory.')
+                     'that already have features.pkl or a feature store in '
+                     'the output directory.')
 
 FLAGS = flags.FLAGS
 
@@ -129,8 +181,7 @@ def preprocess_target(
     os.makedirs(output_dir)
   
   # Check if features already exist
-  features_output_path = os.path.join(output_dir, 'features.pkl')
-  if FLAGS.skip_existing and os.path.exists(features_output_path):
+  if FLAGS.skip_existing and feature_store.has_features(output_dir):
     logging.info('Features already exist for %s, skipping preprocessing.', fasta_name)
     return
   
@@ -145,9 +196,9 @@ def preprocess_target(
       msa_output_dir=msa_output_dir)
   timings['features'] = time.time() - t_0
 
-  # Write out features as a pickled dictionary.
-  with open(features_output_path, 'wb') as f:
-    pickle.dump(feature_dict, f, protocol=4)
+  # Write out features as a pickled dictionary or a feature store.
+  features_output_path = feature_store.write_features(
+      output_dir, feature_dict, FLAGS.features_format)
   logging.info('Features saved to %s', features_output_path)
 
   # Save preprocessing metadata
@@ -214,7 +265,9 @@ def main(argv):
         max_hits=MAX_TEMPLATE_HITS,
         kalign_binary_path=FLAGS.kalign_binary_path,
         release_dates_path=None,
-        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path)
+        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path,
+        num_workers=FLAGS.num_template_workers,
+        template_store_dir=FLAGS.template_store_dir)
   else:
     template_searcher = hhsearch.HHSearch(
         binary_path=FLAGS.hhsearch_binary_path,
@@ -225,7 +278,23 @@ def main(argv):
         max_hits=MAX_TEMPLATE_HITS,
         kalign_binary_path=FLAGS.kalign_binary_path,
         release_dates_path=None,
-        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path)
+        obsolete_pdbs_path=FLAGS.obsolete_pdbs_path,
+        num_workers=FLAGS.num_template_workers,
+        template_store_dir=FLAGS.template_store_dir)
+
+  if FLAGS.shared_scan_chunk_mb:
+    shared_scan_chunk_size = FLAGS.shared_scan_chunk_mb * 1024 * 1024
+  else:
+    shared_scan_chunk_size = None
+
+  if FLAGS.msa_cache_dir:
+    if FLAGS.msa_cache_max_gb is not None:
+      msa_cache_max_size = int(FLAGS.msa_cache_max_gb * 1024 ** 3)
+    else:
+      msa_cache_max_size = None
+    msa_cache = msa_cache_lib.MsaCache(FLAGS.msa_cache_dir, msa_cache_max_size)
+  else:
+    msa_cache = None
 
   monomer_data_pipeline = pipeline.DataPipeline(
       jackhmmer_binary_path=FLAGS.jackhmmer_binary_path,
@@ -238,17 +307,46 @@ def main(argv):
       template_searcher=template_searcher,
       template_featurizer=template_featurizer,
       use_small_bfd=use_small_bfd,
-      use_precomputed_msas=FLAGS.use_precomputed_msas)
+      use_precomputed_msas=FLAGS.use_precomputed_msas,
+      num_search_workers=FLAGS.num_msa_search_workers,
+      search_cpu_budget=FLAGS.msa_search_cpus,
+      shared_scan_chunk_size=shared_scan_chunk_size,
+      shared_scan_dir=FLAGS.shared_scan_dir,
+      use_database_shards=FLAGS.use_database_shards,
+      msa_cache=msa_cache)
 
   if run_multimer_system:
     data_pipeline = pipeline_multimer.DataPipeline(
         monomer_data_pipeline=monomer_data_pipeline,
         jackhmmer_binary_path=FLAGS.jackhmmer_binary_path,
         uniprot_database_path=FLAGS.uniprot_database_path,
-        use_precomputed_msas=FLAGS.use_precomputed_msas)
+        use_precomputed_msas=FLAGS.use_precomputed_msas,
+        shared_scan_chunk_size=shared_scan_chunk_size,
+        shared_scan_dir=FLAGS.shared_scan_dir,
+        use_database_shards=FLAGS.use_database_shards,
+        msa_cache=msa_cache)
   else:
     data_pipeline = monomer_data_pipeline
 
+  if FLAGS.batch_msa_search:
+    batch_fasta_paths = []
+    batch_msa_output_dirs = []
+    for fasta_path, fasta_name in zip(FLAGS.fasta_paths, fasta_names):
+      output_dir = os.path.join(FLAGS.output_dir, fasta_name)
+      if FLAGS.skip_existing and feature_store.has_features(output_dir):
+        continue
+      msa_output_dir = os.path.join(output_dir, 'msas')
+      if not os.path.exists(msa_output_dir):
+        os.makedirs(msa_output_dir)
+      batch_fasta_paths.append(fasta_path)
+      batch_msa_output_dirs.append(msa_output_dir)
+    t_0 = time.time()
+    data_pipeline.search_msas_batched(
+        input_fasta_paths=batch_fasta_paths,
+        msa_output_dirs=batch_msa_output_dirs)
+    logging.info('Batched MSA search of %d targets took %.1f seconds',
+                 len(batch_fasta_paths), time.time() - t_0)
+
   # Preprocess each of the sequences.
   for i, fasta_path in enumerate(FLAGS.fasta_paths):
     fasta_name = fasta_names[i]
@@ -0,0 +1,80 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Builds a memory-mapped template store from the mmCIF mirror.
+
+Templates in the store are read from it instead of being parsed from their
+mmCIF files, e.g.
+
+  python scripts/build_template_store.py \
+    --mmcif_dir=/data/pdb_mmcif/mmcif_files \
+    --output_dir=/data/pdb_mmcif/template_store
+
+and then pass --template_store_dir=/data/pdb_mmcif/template_store. Rebuild
+the store after updating the mmCIF mirror; entries missing from the store are
+read from their mmCIF files.
+"""
+
+import glob
+import multiprocessing
+import os
+
+from absl import app
+from absl import flags
+from absl import logging
+from alphafold.data import template_store
+from alphafold.data import templates
+
+flags.DEFINE_string('mmcif_dir', None, 'Path to the directory with the mmCIF '
+                    'files of the template structures.')
+flags.DEFINE_string('output_dir', None, 'Path to the directory the template '
+                    'store is written to.')
+flags.DEFINE_integer('num_workers', os.cpu_count(), 'Number of processes '
+                     'parsing the mmCIF files.')
+
+FLAGS = flags.FLAGS
+
+
+def _parse_entry(cif_path: str) -> template_store.TemplateStoreEntry:
+  file_id = os.path.splitext(os.path.basename(cif_path))[0]
+  with open(cif_path) as f:
+    return templates.get_template_store_entry(file_id, f.read())
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+
+  # Sorted by file ID, as required by the store.
+  cif_paths = sorted(glob.glob(os.path.join(FLAGS.mmcif_dir, '*.cif')))
+  if not cif_paths:
+    raise ValueError(f'Could not find CIFs in {FLAGS.mmcif_dir}')
+  logging.info('Building template store from %d mmCIF files.', len(cif_paths))
+
+  with template_store.TemplateStoreWriter(FLAGS.output_dir) as writer:
+    with multiprocessing.Pool(FLAGS.num_workers) as pool:
+      for i, entry in enumerate(
+          pool.imap(_parse_entry, cif_paths, chunksize=16), 1):
+        writer.add(entry)
+        if i % 10000 == 0:
+          logging.info('Added %d of %d entries.', i, len(cif_paths))
+  logging.info('Wrote template store to %s.', FLAGS.output_dir)
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required([
+      'mmcif_dir',
+      'output_dir',
+  ])
+  app.run(main)
@@ -0,0 +1,180 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Precompiles the models into a persistent compilation cache.
+
+The models are compiled for placeholder inputs of the given sizes and stored
+in the cache, so that later runs with the same --compilation_cache_dir and
+--bucket_shapes start predicting without compiling, e.g.
+
+  python scripts/precompile_models.py \
+    --data_dir=/data/alphafold \
+    --model_preset=monomer \
+    --compilation_cache_dir=/shared/alphafold_compilation_cache \
+    --num_res=256,512,768,1024
+
+Run it on the same kind of hardware and with the same JAX version as the
+prediction jobs, otherwise their cache keys differ.
+"""
+
+import itertools
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+from alphafold.common import residue_constants
+from alphafold.data import feature_processing
+from alphafold.data import parsers
+from alphafold.data import pipeline
+from alphafold.data import pipeline_multimer
+from alphafold.model import bucketing
+from alphafold.model import config
+from alphafold.model import data
+from alphafold.model import model
+import numpy as np
+
+flags.DEFINE_string('data_dir', None, 'Path to directory of supporting data '
+                    '(for model parameters).')
+flags.DEFINE_enum('model_preset', 'monomer',
+                  ['monomer', 'monomer_casp14', 'monomer_ptm', 'multimer'],
+                  'The model preset to compile the models of.')
+flags.DEFINE_string('compilation_cache_dir', None, 'Directory of the '
+                    'persistent compilation cache the models are stored in.')
+flags.DEFINE_string('params_store_dir', None, 'If set, the model parameters '
+                    'are memory-mapped from uncompressed parameter files in '
+                    'this directory, converted from the params_*.npz files on '
+                    'first use, instead of being read into memory. Processes '
+                    'on a node that share the directory share the pages of '
+                    'the parameters and load them without decompressing.')
+flags.DEFINE_list('num_res',
+                  [str(b) for b in bucketing.DEFAULT_RESIDUE_BUCKETS],
+                  'Numbers of residues to compile the models for, typically '
+                  'the --residue_buckets of the prediction jobs.')
+flags.DEFINE_list('num_msa',
+                  [str(b) for b in bucketing.DEFAULT_MSA_BUCKETS],
+                  'Numbers of MSA rows to compile the multimer models for, '
+                  'typically the --msa_buckets of the prediction jobs.')
+flags.DEFINE_float('device_memory_budget_gb', None, 'Device memory budget '
+                   'of the models in GB, as passed to the prediction jobs.')
+flags.DEFINE_float('recycle_early_stop_tolerance', None, 'Early stopping '
+                   'tolerance of the recycling, as passed to the prediction '
+                   'jobs.')
+flags.DEFINE_boolean('monomer_bfloat16', False, 'Whether the monomer models '
+                     'run in bfloat16, as passed to the prediction jobs.')
+
+FLAGS = flags.FLAGS
+
+
+def _placeholder_chain_features(num_res: int) -> pipeline.FeatureDict:
+  """Returns data pipeline features of a chain without MSA hits or templates."""
+  sequence = 'A' * num_res
+  msa = parsers.Msa(sequences=[sequence],
+                    deletion_matrix=np.zeros((1, num_res), dtype=np.int32),
+                    descriptions=['placeholder'])
+  num_templates = 0
+  return {
+      **pipeline.make_sequence_features(
+          sequence=sequence, description='placeholder', num_res=num_res),
+      **pipeline.make_msa_features([msa]),
+      'template_aatype': np.zeros(
+          (num_templates, num_res,
+           len(residue_constants.restypes_with_x_and_gap)), dtype=np.float32),
+      'template_all_atom_masks': np.zeros(
+          (num_templates, num_res, residue_constants.atom_type_num),
+          dtype=np.float32),
+      'template_all_atom_positions': np.zeros(
+          (num_templates, num_res, residue_constants.atom_type_num, 3),
+          dtype=np.float32),
+      'template_domain_names': np.zeros([num_templates], dtype=object),
+      'template_sequence': np.zeros([num_templates], dtype=object),
+      'template_sum_probs': np.zeros([num_templates, 1], dtype=np.float32),
+  }
+
+
+def _placeholder_multimer_features(num_res: int) -> pipeline.FeatureDict:
+  """Returns multimer data pipeline features of a single placeholder chain."""
+  chain_features = pipeline_multimer.convert_monomer_features(
+      _placeholder_chain_features(num_res), chain_id='A')
+  all_chain_features = pipeline_multimer.add_assembly_features(
+      {'A': chain_features})
+  np_example = feature_processing.pair_and_merge(
+      all_chain_features=all_chain_features)
+  return pipeline_multimer.pad_msa(np_example, 512)
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+
+  model.enable_compilation_cache(FLAGS.compilation_cache_dir)
+  run_multimer_system = 'multimer' in FLAGS.model_preset
+  num_ensemble = 8 if FLAGS.model_preset == 'monomer_casp14' else 1
+  num_res_sizes = sorted(int(n) for n in FLAGS.num_res)
+  num_msa_sizes = sorted(int(n) for n in FLAGS.num_msa)
+  if FLAGS.device_memory_budget_gb:
+    memory_budget_bytes = int(FLAGS.device_memory_budget_gb * 2**30)
+  else:
+    memory_budget_bytes = None
+
+  for model_name in config.MODEL_PRESETS[FLAGS.model_preset]:
+    model_config = config.model_config(model_name)
+    if run_multimer_system:
+      model_config.model.num_ensemble_eval = num_ensemble
+    else:
+      model_config.data.eval.num_ensemble = num_ensemble
+      model_config.model.global_config.bfloat16 = FLAGS.monomer_bfloat16
+    if FLAGS.recycle_early_stop_tolerance is not None:
+      model_config.model.recycle_early_stop_tolerance = (
+          FLAGS.recycle_early_stop_tolerance)
+    model_params = data.get_model_haiku_params(
+        model_name=model_name, data_dir=FLAGS.data_dir,
+        params_store_dir=FLAGS.params_store_dir)
+
+    if run_multimer_system:
+      shapes = list(itertools.product(num_res_sizes, num_msa_sizes))
+    else:
+      # The monomer input pipeline pads the MSA to a fixed size.
+      shapes = [(num_res, None) for num_res in num_res_sizes]
+    for num_res, num_msa in shapes:
+      # Padding the placeholder features to exactly these sizes gives the
+      # inputs of the prediction jobs with --bucket_shapes.
+      model_runner = model.RunModel(
+          model_config, model_params, residue_buckets=[num_res],
+          msa_buckets=[num_msa] if num_msa else None,
+          memory_budget_bytes=memory_budget_bytes)
+      if run_multimer_system:
+        raw_features = _placeholder_multimer_features(num_res)
+        if raw_features['msa'].shape[0] > num_msa:
+          logging.warning('Skipping %d MSA rows, the MSA has at least %d.',
+                          num_msa, raw_features['msa'].shape[0])
+          continue
+      else:
+        raw_features = _placeholder_chain_features(num_res)
+      processed_features = model_runner.process_features(
+          raw_features, random_seed=0)
+
+      t_0 = time.time()
+      model_runner.compile(processed_features)
+      logging.info('Compiled %s for %d residues%s in %.1fs.', model_name,
+                   num_res, f' and {num_msa} MSA rows' if num_msa else '',
+                   time.time() - t_0)
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required([
+      'data_dir',
+      'compilation_cache_dir',
+  ])
+  app.run(main)
@@ -0,0 +1,67 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splits a jackhmmer FASTA database into shards for parallel searches.
+
+The shards are written to <output_prefix>.1 ... <output_prefix>.K together
+with a <output_prefix>.shards.json manifest. Pass <output_prefix> as the
+database path together with --use_database_shards to search the shards in
+parallel, e.g.
+
+  python scripts/shard_database.py \
+    --database_path=/data/uniref90/uniref90.fasta \
+    --num_shards=8 \
+    --output_prefix=/local_ssd/uniref90/uniref90.fasta
+"""
+
+import json
+import os
+
+from absl import app
+from absl import flags
+from absl import logging
+from alphafold.data.tools import jackhmmer
+
+flags.DEFINE_string('database_path', None, 'Path to the FASTA database.')
+flags.DEFINE_integer('num_shards', None, 'Number of shards to split the '
+                     'database into, typically the number of parallel '
+                     'jackhmmer processes the searches should use.')
+flags.DEFINE_string('output_prefix', None, 'Path prefix of the shards, '
+                    'ideally on fast local storage. Defaults to '
+                    '--database_path.')
+
+FLAGS = flags.FLAGS
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  if FLAGS.num_shards < 1:
+    raise ValueError(f'num_shards must be at least 1, got {FLAGS.num_shards}.')
+
+  output_prefix = FLAGS.output_prefix or FLAGS.database_path
+  output_dir = os.path.dirname(output_prefix)
+  if output_dir:
+    os.makedirs(output_dir, exist_ok=True)
+  manifest = jackhmmer.shard_database(
+      FLAGS.database_path, FLAGS.num_shards, output_prefix)
+  logging.info('Wrote database shards: %s', json.dumps(manifest, indent=4))
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required([
+      'database_path',
+      'num_shards',
+  ])
+  app.run(main)
@@ -0,0 +1,68 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Submits preprocessed targets to the spool of inference workers.
+
+Workers started with run_alphafold_inference.py --spool_dir keep their models
+loaded and compiled between jobs, e.g.
+
+  python scripts/submit_inference_jobs.py \
+    --spool_dir=/shared/alphafold_spool \
+    --output_dir=/path/to/output \
+    --target_names=T1050,T1083
+
+Without --target_names, the status of the spool is printed.
+"""
+
+import json
+import os
+
+from absl import app
+from absl import flags
+from absl import logging
+from alphafold.common import job_spool
+from alphafold.data import feature_store
+
+flags.DEFINE_string('spool_dir', None, 'Path to the spool directory of the '
+                    'inference workers.')
+flags.DEFINE_string('output_dir', None, 'Path to the directory with the '
+                    'preprocessed targets, where the outputs are written.')
+flags.DEFINE_list('target_names', None, 'Names of the targets to submit, '
+                  'i.e. of their directories in --output_dir.')
+
+FLAGS = flags.FLAGS
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  if FLAGS.target_names and not FLAGS.output_dir:
+    raise app.UsageError('--target_names requires --output_dir.')
+
+  spool = job_spool.JobSpool(FLAGS.spool_dir)
+  for target_name in FLAGS.target_names or []:
+    if not feature_store.has_features(
+        os.path.join(FLAGS.output_dir, target_name)):
+      raise ValueError(f'No features for {target_name} in {FLAGS.output_dir}. '
+                       'Run preprocessing first.')
+    job = spool.submit(target_name, FLAGS.output_dir)
+    logging.info('Submitted %s as job %s.', target_name, job.name)
+
+  print(json.dumps({'queue_depth': spool.queue_depth(),
+                    'worker_status': spool.read_status()}, indent=4))
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required(['spool_dir'])
+  app.run(main)
@@ -0,0 +1,225 @@
+# Copyright 2021 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the monomer models in bfloat16 against float32.
+
+Predicts each target with the models in float32 and with --monomer_bfloat16,
+from the same features, parameters and random seed, and compares the pLDDT
+and the CA coordinates of the two predictions, e.g.
+
+  python scripts/validate_bfloat16.py \
+    --data_dir=/data/alphafold \
+    --model_names=model_1,model_2
+
+By default, the targets are the first chains of the test structures bundled
+in alphafold/common/testdata, predicted from their sequence alone, and the
+predictions are also compared to these structures. Targets preprocessed by
+run_alphafold.py can be added with --target_dirs. The script exits with an
+error if a comparison exceeds the tolerances.
+"""
+
+import copy
+import glob
+import json
+import os
+import sys
+from typing import Any, Dict, Optional
+
+from absl import app
+from absl import flags
+from absl import logging
+from alphafold.common import protein
+from alphafold.common import residue_constants
+from alphafold.data import feature_store
+from alphafold.data import parsers
+from alphafold.data import pipeline
+from alphafold.model import config
+from alphafold.model import data
+from alphafold.model import model
+import numpy as np
+
+_TESTDATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'alphafold', 'common', 'testdata')
+
+flags.DEFINE_string('data_dir', None, 'Path to directory of supporting data '
+                    '(for model parameters).')
+flags.DEFINE_list('model_names', ['model_1'], 'Names of the monomer models '
+                  'to compare.')
+flags.DEFINE_list('pdb_paths', sorted(glob.glob(
+    os.path.join(_TESTDATA_DIR, '*.pdb'))), 'Paths to PDB files whose first '
+                  'chain is predicted from its sequence alone and compared '
+                  'to the structure. Defaults to the bundled test structures.')
+flags.DEFINE_list('target_dirs', [], 'Paths to output directories of '
+                  'preprocessed targets, with a features.pkl or a feature '
+                  'store, to predict as well.')
+flags.DEFINE_string('params_store_dir', None, 'If set, the model parameters '
+                    'are memory-mapped from parameter files in this '
+                    'directory, as with run_alphafold.py.')
+flags.DEFINE_integer('random_seed', 0, 'The random seed of the predictions.')
+flags.DEFINE_float('max_plddt_diff', 1.0, 'Tolerance of the mean absolute '
+                   'difference of the per-residue pLDDT.')
+flags.DEFINE_float('max_ca_rmsd', 0.5, 'Tolerance in Angstroms of the CA '
+                   'RMSD between the superposed predictions.')
+flags.DEFINE_string('output_path', None, 'If set, the comparisons are '
+                    'written to this JSON file.')
+
+FLAGS = flags.FLAGS
+
+
+def _sequence_features(sequence: str, description: str) -> pipeline.FeatureDict:
+  """Returns features of a sequence without MSA hits or templates."""
+  num_res = len(sequence)
+  msa = parsers.Msa(sequences=[sequence],
+                    deletion_matrix=np.zeros((1, num_res), dtype=np.int32),
+                    descriptions=[description])
+  num_templates = 0
+  return {
+      **pipeline.make_sequence_features(
+          sequence=sequence, description=description, num_res=num_res),
+      **pipeline.make_msa_features([msa]),
+      'template_aatype': np.zeros(
+          (num_templates, num_res,
+           len(residue_constants.restypes_with_x_and_gap)), dtype=np.float32),
+      'template_all_atom_masks': np.zeros(
+          (num_templates, num_res, residue_constants.atom_type_num),
+          dtype=np.float32),
+      'template_all_atom_positions': np.zeros(
+          (num_templates, num_res, residue_constants.atom_type_num, 3),
+          dtype=np.float32),
+      'template_domain_names': np.zeros([num_templates], dtype=object),
+      'template_sequence': np.zeros([num_templates], dtype=object),
+      'template_sum_probs': np.zeros([num_templates, 1], dtype=np.float32),
+  }
+
+
+def _first_chain(pdb_path: str) -> protein.Protein:
+  """Reads the first chain of a PDB file."""
+  with open(pdb_path) as f:
+    prot = protein.from_pdb_string(f.read())
+  in_chain = prot.chain_index == prot.chain_index[0]
+  return protein.Protein(
+      atom_positions=prot.atom_positions[in_chain],
+      aatype=prot.aatype[in_chain],
+      atom_mask=prot.atom_mask[in_chain],
+      residue_index=prot.residue_index[in_chain],
+      chain_index=prot.chain_index[in_chain],
+      b_factors=prot.b_factors[in_chain])
+
+
+def superposed_rmsd(x: np.ndarray, y: np.ndarray,
+                    mask: Optional[np.ndarray] = None) -> float:
+  """Returns the RMSD of two [N, 3] point sets after optimal superposition."""
+  if mask is not None:
+    x, y = x[mask > 0], y[mask > 0]
+  x = x - x.mean(axis=0)
+  y = y - y.mean(axis=0)
+  # Kabsch: the rotation that superposes x on y, without reflection.
+  u, _, vt = np.linalg.svd(x.T @ y)
+  d = np.sign(np.linalg.det(u @ vt))
+  rotation = u @ np.diag([1., 1., d]) @ vt
+  return float(np.sqrt(np.mean(np.sum((x @ rotation - y)**2, axis=-1))))
+
+
+def compare_predictions(
+    result_float32: Dict[str, Any],
+    result_bfloat16: Dict[str, Any],
+    reference: Optional[protein.Protein] = None) -> Dict[str, float]:
+  """Compares the pLDDT and CA coordinates of two predictions of a target."""
+  ca = residue_constants.atom_order['CA']
+  plddt_diff = np.abs(result_float32['plddt'] - result_bfloat16['plddt'])
+  ca_float32 = result_float32['structure_module']['final_atom_positions'][:, ca]
+  ca_bfloat16 = (
+      result_bfloat16['structure_module']['final_atom_positions'][:, ca])
+  comparison = {
+      'mean_plddt_float32': float(np.mean(result_float32['plddt'])),
+      'mean_plddt_bfloat16': float(np.mean(result_bfloat16['plddt'])),
+      'plddt_mean_abs_diff': float(np.mean(plddt_diff)),
+      'plddt_max_abs_diff': float(np.max(plddt_diff)),
+      'ca_rmsd': superposed_rmsd(ca_float32, ca_bfloat16),
+  }
+  if reference is not None:
+    reference_ca = reference.atom_positions[:, ca]
+    reference_mask = reference.atom_mask[:, ca]
+    comparison['ca_rmsd_to_reference_float32'] = superposed_rmsd(
+        ca_float32, reference_ca, reference_mask)
+    comparison['ca_rmsd_to_reference_bfloat16'] = superposed_rmsd(
+        ca_bfloat16, reference_ca, reference_mask)
+  return comparison
+
+
+def main(argv):
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+
+  targets = {}
+  for pdb_path in FLAGS.pdb_paths:
+    reference = _first_chain(pdb_path)
+    sequence = ''.join(
+        residue_constants.restypes_with_x[aatype]
+        for aatype in reference.aatype)
+    target_name = os.path.splitext(os.path.basename(pdb_path))[0]
+    targets[target_name] = (_sequence_features(sequence, target_name),
+                            reference)
+  for target_dir in FLAGS.target_dirs:
+    target_name = os.path.basename(os.path.normpath(target_dir))
+    targets[target_name] = (feature_store.read_features(target_dir), None)
+
+  comparisons = {}
+  for model_name in FLAGS.model_names:
+    model_config = config.model_config(model_name)
+    if model_config.model.global_config.multimer_mode:
+      raise app.UsageError(f'{model_name} is not a monomer model.')
+    model_params = data.get_model_haiku_params(
+        model_name=model_name, data_dir=FLAGS.data_dir,
+        params_store_dir=FLAGS.params_store_dir)
+    bfloat16_config = copy.deepcopy(model_config)
+    bfloat16_config.model.global_config.bfloat16 = True
+    model_runner = model.RunModel(model_config, model_params)
+    bfloat16_runner = model.RunModel(bfloat16_config, model_params)
+
+    for target_name, (feature_dict, reference) in targets.items():
+      processed_features = model_runner.process_features(
+          feature_dict, random_seed=FLAGS.random_seed)
+      result_float32 = model_runner.predict(
+          processed_features, random_seed=FLAGS.random_seed)
+      result_bfloat16 = bfloat16_runner.predict(
+          processed_features, random_seed=FLAGS.random_seed)
+      comparison = compare_predictions(result_float32, result_bfloat16,
+                                       reference)
+      comparison['passed'] = (
+          comparison['plddt_mean_abs_diff'] <= FLAGS.max_plddt_diff and
+          comparison['ca_rmsd'] <= FLAGS.max_ca_rmsd)
+      logging.info('%s %s: %s', target_name, model_name, comparison)
+      comparisons.setdefault(target_name, {})[model_name] = comparison
+
+  report = json.dumps(comparisons, indent=4)
+  print(report)
+  if FLAGS.output_path:
+    with open(FLAGS.output_path, 'w') as f:
+      f.write(report)
+
+  failed = [f'{target_name} {model_name}'
+            for target_name, by_model in comparisons.items()
+            for model_name, comparison in by_model.items()
+            if not comparison['passed']]
+  if failed:
+    logging.error('bfloat16 predictions exceed the tolerances for: %s',
+                  ', '.join(failed))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required(['data_dir'])
+  app.run(main)
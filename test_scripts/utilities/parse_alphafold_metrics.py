@@ -63,12 +63,19 @@ class AlphaFoldMetricsParser:
                 metrics['best_model'] = ranking_data.get('order', ['unknown'])[0]
         
         # Parse individual model results for detailed metrics
-        for pkl_file in self.output_dir.glob("result_model_*.pkl"):
+        result_files = (list(self.output_dir.glob("result_model_*.pkl")) +
+                        list(self.output_dir.glob("result_model_*.npz")))
+        for pkl_file in result_files:
             model_name = pkl_file.stem.replace('result_', '')
             
             try:
-                with open(pkl_file, 'rb') as f:
-                    result = pickle.load(f)
+                if pkl_file.suffix == '.npz':
+                    # Written with --result_format=npz; the top-level
+                    # metrics are stored under their own names.
+                    result = np.load(pkl_file)
+                else:
+                    with open(pkl_file, 'rb') as f:
+                        result = pickle.load(f)
                     
                 # Extract key metrics
                 if 'plddt' in result:
@@ -90,13 +97,23 @@ class AlphaFoldMetricsParser:
     def parse_msa_metrics(self) -> Dict[str, any]:
         """Extract MSA-related metrics from features."""
         features_file = self.output_dir / "features.pkl"
+        # Written with --features_format=npy, one .npy file per feature.
+        features_store = self.output_dir / "features"
         
-        if not features_file.exists():
+        if not features_file.exists() and not features_store.is_dir():
             return {}
             
         try:
-            with open(features_file, 'rb') as f:
-                features = pickle.load(f)
+            if features_file.exists():
+                with open(features_file, 'rb') as f:
+                    features = pickle.load(f)
+            else:
+                features = {
+                    npy_file.name[:-len('.npy')]: np.load(
+                        npy_file, mmap_mode='r', allow_pickle=True)
+                    for npy_file in features_store.glob("*.npy")
+                    if npy_file.name[:-len('.npy')] in (
+                        'sequence', 'msa', 'template_domain_names')}
                 
             metrics = {
                 'sequence_length': len(features.get('sequence', '')),